@@ -0,0 +1,101 @@
+import os
+import zipfile
+import logging
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from fastapi import UploadFile
+
+from uploads import IngestedUpload, MAX_UPLOAD_BYTES, ingest_upload
+
+logger = logging.getLogger(__name__)
+
+# Batch analysis configuration
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "500"))
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "16"))
+BATCH_MAX_ENTRY_BYTES = int(os.environ.get("BATCH_MAX_ENTRY_BYTES", str(50 * 1024 * 1024)))
+# Combined size of every image in a batch: plain files plus uncompressed ZIP members
+BATCH_MAX_TOTAL_BYTES = int(os.environ.get("BATCH_MAX_TOTAL_BYTES", str(512 * 1024 * 1024)))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed", "application/x-zip")
+
+
+class BatchTooLarge(Exception):
+    """Raised when a batch has too many images, an oversized ZIP member or too many bytes in total."""
+
+
+def is_zip_upload(file: UploadFile) -> bool:
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+def is_image_upload(file: UploadFile) -> bool:
+    return not is_zip_upload(file) and (file.content_type or "").startswith("image/")
+
+
+async def ingest_image_files(files: List[UploadFile], max_images: int = BATCH_MAX_IMAGES,
+                             max_total_bytes: int = BATCH_MAX_TOTAL_BYTES) -> List[Optional[IngestedUpload]]:
+    """Stream a batch's plain image files into the blob store, each capped at MAX_UPLOAD_BYTES.
+
+    Returns one entry per file: the stored upload, or None for ZIP archives
+    and non-images. Raises UploadTooLarge or BatchTooLarge.
+    """
+    stored, count, total = [], 0, 0
+    for file in files:
+        if not is_image_upload(file):
+            stored.append(None)
+            continue
+        count += 1
+        if count > max_images:
+            raise BatchTooLarge(f"Batch exceeds the limit of {max_images} images")
+        upload = await ingest_upload(file, MAX_UPLOAD_BYTES)
+        total += upload.size
+        if total > max_total_bytes:
+            raise BatchTooLarge(f"Batch exceeds the limit of {max_total_bytes} bytes")
+        stored.append(upload)
+    return stored
+
+
+def iter_image_entries(files: List[UploadFile], stored: List[Optional[IngestedUpload]],
+                       max_images: int = BATCH_MAX_IMAGES, max_total_bytes: int = BATCH_MAX_TOTAL_BYTES
+                       ) -> Iterator[Tuple[str, Union[bytes, IngestedUpload]]]:
+    """Yield (filename, image) for every image in the uploads, expanding ZIP archives.
+
+    Plain image files have already been stored by ingest_image_files() and
+    are yielded as their IngestedUpload. ZIP members are decompressed one at
+    a time from the spooled upload, so an archive is never held in memory as
+    a whole, and are yielded as bytes. Non-image members are skipped.
+    """
+    count = sum(1 for upload in stored if upload is not None)
+    total = sum(upload.size for upload in stored if upload is not None)
+    for file, upload in zip(files, stored):
+        if upload is not None:
+            yield upload.filename, upload
+        elif is_zip_upload(file):
+            file.file.seek(0)
+            with zipfile.ZipFile(file.file) as archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS) \
+                            or os.path.basename(name).startswith("."):
+                        continue
+                    count += 1
+                    if count > max_images:
+                        raise BatchTooLarge(f"Batch exceeds the limit of {max_images} images")
+                    if info.file_size > BATCH_MAX_ENTRY_BYTES:
+                        raise BatchTooLarge(f"{name} exceeds the limit of {BATCH_MAX_ENTRY_BYTES} bytes")
+                    total += info.file_size
+                    if total > max_total_bytes:
+                        raise BatchTooLarge(f"Batch exceeds the limit of {max_total_bytes} bytes")
+                    yield name, archive.read(info)
+        else:
+            logger.warning(f"Skipping non-image upload in batch: {file.filename}")
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,177 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple, Union
+
+import torch
+
+from model_registry import registry as model_registry, XRAY_MODEL_NAME
+from heatmaps import class_activation_maps
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching configuration for the X-ray model
+XRAY_BATCH_MAX_SIZE = int(os.environ.get("XRAY_BATCH_MAX_SIZE", "8"))
+XRAY_BATCH_MAX_WAIT_MS = float(os.environ.get("XRAY_BATCH_MAX_WAIT_MS", "10"))
+
+
+class _BatchItem:
+    __slots__ = ("tensor", "future")
+
+    def __init__(self, tensor: torch.Tensor):
+        self.tensor = tensor
+        self.future: Future = Future()
+
+
+class BatchScheduler:
+    """Collects inputs from many callers and runs them through a model as one batch.
+
+    Callers submit tensors with a leading batch dimension. A background thread
+    waits for up to ``max_batch_size`` rows or ``max_wait_ms`` after the first
+    arrival, concatenates them, runs a single forward pass and hands every
+    caller back its own slice of the output (of each output, if ``run_batch``
+    returns a tuple).
+    """
+
+    def __init__(self, run_batch: Callable[[torch.Tensor], Union[torch.Tensor, Tuple[torch.Tensor, ...]]],
+                 max_batch_size: int,
+                 max_wait_ms: float, name: str = "batch"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Optional[_BatchItem]]" = queue.Queue()
+        self._carry: Optional[_BatchItem] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._rows = 0
+        self._largest_batch = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name=f"{self.name}-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, tensor: torch.Tensor) -> Future:
+        """Queue a tensor of shape (N, ...) and return a future for its (N, ...) output."""
+        item = _BatchItem(tensor)
+        if self.max_batch_size == 1:
+            # Batching disabled: run inline on the caller's thread.
+            try:
+                item.future.set_result(self.run_batch(tensor))
+            except Exception as e:
+                item.future.set_exception(e)
+            return item.future
+
+        self.start()
+        self._queue.put(item)
+        return item.future
+
+    def predict(self, tensor: torch.Tensor) -> Union[torch.Tensor, Tuple[torch.Tensor, ...]]:
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(tensor).result()
+
+    def _next_item(self, timeout: Optional[float]) -> Optional[_BatchItem]:
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _loop(self):
+        while True:
+            first = self._next_item(None)
+            if first is None:
+                return
+
+            batch: List[_BatchItem] = [first]
+            rows = first.tensor.shape[0]
+            deadline = time.monotonic() + self.max_wait
+            stopping = False
+
+            while rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._next_item(remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if rows + item.tensor.shape[0] > self.max_batch_size:
+                    # Does not fit; it opens the next batch instead.
+                    self._carry = item
+                    break
+                batch.append(item)
+                rows += item.tensor.shape[0]
+
+            self._run(batch, rows)
+            if stopping:
+                if self._carry is not None:
+                    self._run([self._carry], self._carry.tensor.shape[0])
+                    self._carry = None
+                return
+
+    def _run(self, batch: List[_BatchItem], rows: int):
+        try:
+            inputs = batch[0].tensor if len(batch) == 1 else torch.cat([i.tensor for i in batch])
+            outputs = self.run_batch(inputs)
+        except Exception as e:
+            logger.error(f"{self.name} batch of {rows} failed: {str(e)}")
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        offset = 0
+        for item in batch:
+            n = item.tensor.shape[0]
+            if isinstance(outputs, tuple):
+                item.future.set_result(tuple(output[offset:offset + n] for output in outputs))
+            else:
+                item.future.set_result(outputs[offset:offset + n])
+            offset += n
+
+        self._batches += 1
+        self._rows += rows
+        self._largest_batch = max(self._largest_batch, rows)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "pending": self._queue.qsize(),
+            "batches": self._batches,
+            "rows": self._rows,
+            "mean_batch_size": round(self._rows / self._batches, 2) if self._batches else 0.0,
+            "largest_batch": self._largest_batch,
+        }
+
+
+def _run_xray_batch(batch: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Predictions and class activation maps for a batch, from one forward pass."""
+    model = model_registry.get(XRAY_MODEL_NAME)
+    with torch.no_grad():
+        return class_activation_maps(model, batch)
+
+
+xray_batcher = BatchScheduler(
+    _run_xray_batch,
+    max_batch_size=XRAY_BATCH_MAX_SIZE,
+    max_wait_ms=XRAY_BATCH_MAX_WAIT_MS,
+    name="xray",
+)
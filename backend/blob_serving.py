@@ -0,0 +1,119 @@
+import os
+import re
+import mimetypes
+import logging
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# Stored uploads never change once written (content-addressed or uuid-named),
+# but they are per-user, so shared caches must not keep them.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+RANGE_CHUNK_BYTES = 256 * 1024
+
+_BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header starts beyond the end of the file."""
+
+
+def blob_etag(key: str) -> str:
+    """Strong ETag from the blob's name, which is its content digest (or a uuid for legacy uploads)."""
+    return f'"{os.path.basename(key).split(".", 1)[0]}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single byte range, or None to serve the whole file.
+
+    Multi-range and malformed headers are ignored, which RFC 9110 allows.
+    """
+    match = _BYTE_RANGE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == "":
+        if end == "":
+            return None
+        suffix = int(end)
+        if suffix == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - suffix), size - 1
+    start = int(start)
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    end = min(int(end), size - 1) if end else size - 1
+    if end < start:
+        return None
+    return start, end
+
+
+def _cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+
+def not_modified(request: Request, key: str) -> Optional[Response]:
+    """A 304 response if the client already holds this blob, else None."""
+    etag = blob_etag(key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    return None
+
+
+def _iter_file_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_BYTES, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def blob_file_response(request: Request, path: Path, key: str) -> Response:
+    """Serve a stored blob with a strong ETag, immutable caching and single-range support.
+
+    Full responses go through FileResponse, which hands the file to the server
+    for zero-copy sending when the server supports it.
+    """
+    cached = not_modified(request, key)
+    if cached is not None:
+        return cached
+    etag = blob_etag(key)
+    headers = _cache_headers(etag)
+
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
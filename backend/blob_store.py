@@ -0,0 +1,372 @@
+import os
+import abc
+import uuid
+import asyncio
+import logging
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+
+from fastapi import UploadFile
+
+from cache import content_hasher, content_digest
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Blob storage configuration
+BLOB_STORE = os.environ.get("BLOB_STORE", "local")  # "local" or "s3"
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "uploads/")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None  # e.g. MinIO
+S3_REGION = os.environ.get("S3_REGION") or None
+S3_MULTIPART_THRESHOLD_BYTES = int(os.environ.get("S3_MULTIPART_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNK_BYTES = int(os.environ.get("S3_MULTIPART_CHUNK_BYTES", str(8 * 1024 * 1024)))
+S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", "4"))
+S3_UPLOAD_WORKERS = int(os.environ.get("S3_UPLOAD_WORKERS", "4"))
+
+# Stored uploads are served by the API, which the frontend's nginx only proxies under /api
+UPLOAD_URL_PREFIX = "/api/uploads/"
+# Analyses recorded before uploads moved under /api still reference this path
+LEGACY_UPLOAD_URL_PREFIX = "/uploads/"
+
+
+class UploadTooLarge(Exception):
+    """Raised as soon as an upload exceeds the configured size limit."""
+
+
+class BlobRef:
+    """A stored blob: its content-addressed key, digest, size and whether this write created it."""
+
+    __slots__ = ("key", "digest", "size", "created")
+
+    def __init__(self, key: str, digest: str, size: int, created: bool):
+        self.key = key
+        self.digest = digest
+        self.size = size
+        self.created = created
+
+
+def blob_key(digest: str, extension: str) -> str:
+    """Two-level sharded key, e.g. "3f/a2/3fa2....jpg", so no directory grows unbounded."""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+
+def upload_key(image_url: Optional[str]) -> Optional[str]:
+    """Blob key behind a stored upload's URL, current or legacy; None for any other URL."""
+    for prefix in (UPLOAD_URL_PREFIX, LEGACY_UPLOAD_URL_PREFIX):
+        if image_url and image_url.startswith(prefix):
+            return image_url[len(prefix):]
+    return None
+
+
+def upload_url(image_url: Optional[str]) -> Optional[str]:
+    """A stored upload's URL in its current form; other URLs (e.g. placeholders) are returned as is."""
+    key = upload_key(image_url)
+    return image_url if key is None else f"{UPLOAD_URL_PREFIX}{key}"
+
+
+def _write_chunk(out, hasher, chunk: bytes):
+    hasher.update(chunk)
+    out.write(chunk)
+
+
+class BlobStore(abc.ABC):
+    """Content-addressed storage for uploaded images.
+
+    Blobs are named by the digest of their bytes, so storing the same image
+    twice keeps a single copy. Uploads are spooled to a local temporary file
+    while they are hashed, then committed under their final key.
+    """
+
+    def __init__(self, spool_dir: Path):
+        self.spool_dir = Path(spool_dir)
+
+    def url(self, key: str) -> str:
+        return f"{UPLOAD_URL_PREFIX}{key}"
+
+    def _spool_path(self) -> Path:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        return self.spool_dir / f"{uuid.uuid4().hex}.part"
+
+    async def put_stream(self, file: UploadFile, extension: str, max_bytes: int) -> BlobRef:
+        """Stream an upload in chunks, hashing it on the fly and enforcing max_bytes."""
+        part_path = self._spool_path()
+        hasher = content_hasher()
+        size = 0
+        try:
+            with open(part_path, "wb") as out:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes")
+                    await asyncio.to_thread(_write_chunk, out, hasher, chunk)
+            digest = hasher.hexdigest()
+            key = blob_key(digest, extension)
+            created = await asyncio.to_thread(self._commit, part_path, key)
+        finally:
+            try:
+                part_path.unlink()
+            except FileNotFoundError:
+                pass
+        return BlobRef(key, digest, size, created)
+
+    def put_bytes(self, data: bytes, extension: str) -> BlobRef:
+        """Store bytes that are already in memory (e.g. ZIP members).
+
+        Blocks on disk I/O, so async callers run it on a worker thread.
+        Duplicates are detected by _commit(), which does not touch the network.
+        """
+        digest = content_digest(data)
+        key = blob_key(digest, extension)
+        part_path = self._spool_path()
+        try:
+            part_path.write_bytes(data)
+            created = self._commit(part_path, key)
+        finally:
+            try:
+                part_path.unlink()
+            except FileNotFoundError:
+                pass
+        return BlobRef(key, digest, len(data), created)
+
+    @abc.abstractmethod
+    def _commit(self, part_path: Path, key: str) -> bool:
+        """Move a fully written spool file to its key; False if the blob already existed."""
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether the blob is stored; may need a network round trip, so call it off the event loop."""
+
+    @abc.abstractmethod
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path of a local copy the decoder can read directly, if there is one."""
+
+    @abc.abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open the blob for reading."""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Remove the blob if it exists."""
+
+    def iter_chunks(self, key: str, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+        """Stream a blob's bytes without loading it into memory."""
+        with self.open(key) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def shutdown(self):
+        """Finish any background writes."""
+
+    def stats(self) -> dict:
+        return {"backend": "local"}
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs kept on local disk in two-level sharded directories under root."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        super().__init__(self.root / ".spool")
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid blob key: {key}")
+        return path
+
+    def _commit(self, part_path: Path, key: str) -> bool:
+        final_path = self.path(key)
+        if final_path.exists():
+            return False
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        # Same filesystem, so the rename is atomic: readers never see a partial blob.
+        os.replace(part_path, final_path)
+        return True
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = self.path(key)
+        return path if path.exists() else None
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    def delete(self, key: str):
+        try:
+            self.path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore(LocalBlobStore):
+    """Blobs kept in an S3-compatible bucket, with a local disk cache under root.
+
+    A new blob is committed to the local cache first, so the request that
+    uploaded it can analyze it straight away, and copied to the bucket by a
+    background pool. Large blobs go up as multipart uploads with their parts
+    sent in parallel. Blobs written by another node are downloaded into the
+    cache on first local use, or streamed from the bucket.
+    """
+
+    def __init__(self, root: Path, bucket: str, prefix: str = S3_PREFIX,
+                 endpoint_url: Optional[str] = S3_ENDPOINT_URL, region: Optional[str] = S3_REGION,
+                 upload_workers: int = S3_UPLOAD_WORKERS):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD_BYTES,
+            multipart_chunksize=S3_MULTIPART_CHUNK_BYTES,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+        self._uploader = ThreadPoolExecutor(max_workers=max(1, upload_workers), thread_name_prefix="blob-upload")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failed = set()
+        self.uploaded = 0
+        self.upload_failures = 0
+        self.downloaded = 0
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _is_missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def _remote_exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def _commit(self, part_path: Path, key: str) -> bool:
+        created = super()._commit(part_path, key)
+        with self._lock:
+            retry = key in self._failed
+        if created or retry:
+            self._schedule_upload(key)
+        return created
+
+    def _schedule_upload(self, key: str):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self._failed.discard(key)
+        self._uploader.submit(self._upload, key)
+
+    def _upload(self, key: str):
+        try:
+            # Another node may already have stored the same content
+            if not self._remote_exists(key):
+                self.client.upload_file(
+                    str(self.path(key)), self.bucket, self.object_key(key),
+                    ExtraArgs={"ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream"},
+                    Config=self.transfer_config,
+                )
+            with self._lock:
+                self.uploaded += 1
+        except Exception as e:
+            with self._lock:
+                self._failed.add(key)
+                self.upload_failures += 1
+            logger.error(f"Error uploading blob {key} to s3://{self.bucket}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def exists(self, key: str) -> bool:
+        return super().exists(key) or self._remote_exists(key)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = super().local_path(key)
+        if path is not None:
+            return path
+        from botocore.exceptions import ClientError
+        part_path = self._spool_path()
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), str(part_path), Config=self.transfer_config)
+            # Cache only; the blob is already in the bucket
+            LocalBlobStore._commit(self, part_path, key)
+            with self._lock:
+                self.downloaded += 1
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        finally:
+            try:
+                part_path.unlink()
+            except FileNotFoundError:
+                pass
+        return self.path(key)
+
+    def open(self, key: str) -> BinaryIO:
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        return open(path, "rb")
+
+    def iter_chunks(self, key: str, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+        if super().exists(key):
+            yield from super().iter_chunks(key, chunk_size)
+            return
+        body = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        super().delete(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def shutdown(self):
+        """Wait for queued uploads so no blob is left only on this node's disk."""
+        self._uploader.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "s3",
+                "bucket": self.bucket,
+                "pending_uploads": len(self._pending),
+                "failed_uploads": len(self._failed),
+                "uploaded": self.uploaded,
+                "upload_failures": self.upload_failures,
+                "downloaded": self.downloaded,
+            }
+
+
+def create_blob_store(root: Path) -> BlobStore:
+    """Build the blob store selected by BLOB_STORE, caching under root."""
+    if BLOB_STORE == "s3":
+        if not S3_BUCKET:
+            raise ValueError("BLOB_STORE=s3 requires S3_BUCKET")
+        logger.info(f"Storing uploads in s3://{S3_BUCKET}/{S3_PREFIX}")
+        return S3BlobStore(root, S3_BUCKET)
+    if BLOB_STORE != "local":
+        raise ValueError(f"Unknown BLOB_STORE: {BLOB_STORE}")
+    return LocalBlobStore(root)
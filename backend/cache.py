@@ -0,0 +1,178 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Result cache configuration
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+RESULT_CACHE_PERSISTENT = os.environ.get("RESULT_CACHE_PERSISTENT", "false").lower() in ("1", "true", "yes")
+
+# Authenticated user lookup cache configuration
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+IMAGE_ACCESS_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_ACCESS_CACHE_MAX_ENTRIES", "10000"))
+IMAGE_ACCESS_CACHE_TTL_SECONDS = float(os.environ.get("IMAGE_ACCESS_CACHE_TTL_SECONDS", "300"))
+
+_MISSING = object()
+
+
+def content_hasher():
+    """Incremental hasher behind content_digest(), for data that arrives in chunks."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_digest(data) -> str:
+    """Fast 128-bit digest of uploaded bytes, used as a content address."""
+    hasher = content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache whose entries also expire after a fixed TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class ResultCache:
+    """Analysis results keyed by content digest, analysis type and model version.
+
+    The in-memory tier is always used; when a MongoDB collection is attached the
+    results are also persisted there (with a TTL index) so they survive restarts
+    and are shared between workers.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS):
+        self.memory = TTLCache(max_entries, ttl_seconds)
+        self.collection = None
+        self.persistent_hits = 0
+        self.persistent_errors = 0
+
+    @staticmethod
+    def key(digest: str, analysis_type: str, model_version: str) -> str:
+        return f"{analysis_type}:{model_version}:{digest}"
+
+    async def attach(self, collection):
+        """Enable the persistent tier on a (Motor) MongoDB collection."""
+        await collection.create_index("expires_at", expireAfterSeconds=0)
+        self.collection = collection
+
+    async def get(self, key: str) -> Optional[dict]:
+        result = self.memory.get(key)
+        if result is not None or self.collection is None:
+            return result
+
+        try:
+            doc = await self.collection.find_one({"_id": key})
+        except Exception as e:
+            self.persistent_errors += 1
+            logger.error(f"Error reading result cache: {str(e)}")
+            return None
+        if doc is None or doc["expires_at"] < datetime.utcnow():
+            return None
+
+        self.persistent_hits += 1
+        self.memory.set(key, doc["result"])
+        return doc["result"]
+
+    async def set(self, key: str, result: dict):
+        self.memory.set(key, result)
+        if self.collection is None:
+            return
+
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {
+                    "_id": key,
+                    "result": result,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.memory.ttl),
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            self.persistent_errors += 1
+            logger.error(f"Error writing result cache: {str(e)}")
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        return {
+            "memory": memory,
+            "persistent": self.collection is not None,
+            "persistent_hits": self.persistent_hits,
+            "persistent_errors": self.persistent_errors,
+            "hits": memory["hits"] + self.persistent_hits,
+            "misses": memory["misses"] - self.persistent_hits,
+        }
+
+
+result_cache = ResultCache()
+
+# Users resolved from access tokens, keyed by user id. Entries are dropped on
+# profile updates in this worker; the short TTL bounds staleness elsewhere.
+user_cache = TTLCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+# Successful (user id, upload key) ownership checks, so repeated image views
+# are answered without a database round trip.
+image_access_cache = TTLCache(IMAGE_ACCESS_CACHE_MAX_ENTRIES, IMAGE_ACCESS_CACHE_TTL_SECONDS)
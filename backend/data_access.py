@@ -0,0 +1,316 @@
+import os
+import json
+import base64
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Connection pool configuration
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+# Storage backend: "mongo", "sqlite" (embedded, no server), or "auto" (SQLite when Mongo is unreachable)
+DATA_BACKEND = os.environ.get("DATA_BACKEND", "mongo").lower()
+SQLITE_PATH = Path(os.environ.get("SQLITE_PATH", "./zemedic.db"))
+
+# Fields returned by the lightweight history summary view
+HISTORY_SUMMARY_FIELDS = {"user_id": 1, "type": 1, "date": 1, "image_url": 1, "predictions": 1, "updated_at": 1}
+
+# Lowest possible ObjectId, for a watermark that sits between two timestamps
+MIN_OBJECT_ID = ObjectId("0" * 24)
+
+
+def _with_id(doc: Optional[dict]) -> Optional[dict]:
+    """Expose Mongo's ObjectId `_id` as the string `id` the API returns."""
+    if doc is None:
+        return None
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+def encode_cursor(date: datetime, analysis_id: str) -> str:
+    """Opaque keyset cursor pointing just past the (date, _id) of the last item returned."""
+    raw = json.dumps({"d": date.isoformat(), "i": analysis_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Inverse of encode_cursor(); raises ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["d"]), ObjectId(data["i"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class UserRepository:
+    """Async access to the users collection."""
+
+    def __init__(self, db):
+        self.collection = db.users
+
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        return _with_id(await self.collection.find_one({"email": email}))
+
+    async def get_by_id(self, user_id: str) -> Optional[dict]:
+        return _with_id(await self.collection.find_one({"_id": ObjectId(user_id)}))
+
+    async def email_exists(self, email: str) -> bool:
+        return await self.collection.count_documents({"email": email}, limit=1) > 0
+
+    async def create(self, user_doc: dict):
+        await self.collection.insert_one(user_doc)
+
+    async def update(self, user_id: str, updates: dict) -> Optional[dict]:
+        if updates:
+            await self.collection.update_one({"_id": ObjectId(user_id)}, {"$set": updates})
+        return await self.get_by_id(user_id)
+
+    async def create_if_absent(self, user_doc: dict) -> bool:
+        """Insert a user replicated from another node; False if its id or email is already taken."""
+        if await self.collection.count_documents(
+            {"$or": [{"_id": user_doc["_id"]}, {"email": user_doc["email"]}]}, limit=1
+        ):
+            return False
+        try:
+            await self.collection.insert_one(user_doc)
+        except DuplicateKeyError:
+            return False
+        return True
+
+
+class AnalysisRepository:
+    """Async access to the analyses collection.
+
+    Every insert or change stamps the document with ``updated_at`` and the
+    next value of a per-database sequence, ``sync_seq``, so the changes
+    since any point can be read back in order (see sync.py).
+    """
+
+    def __init__(self, db):
+        self.collection = db.analyses
+        self.counters = db.counters
+
+    async def _reserve_seq(self, n: int) -> int:
+        """Reserve n consecutive sequence values, returning the first."""
+        doc = await self.counters.find_one_and_update(
+            {"_id": "analyses"}, {"$inc": {"seq": n}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc["seq"] - n + 1
+
+    async def _stamp(self, analysis_docs: List[dict]):
+        first = await self._reserve_seq(len(analysis_docs))
+        now = datetime.utcnow()
+        for i, doc in enumerate(analysis_docs):
+            doc["sync_seq"] = first + i
+            doc["updated_at"] = now
+
+    async def insert(self, analysis_doc: dict):
+        await self._stamp([analysis_doc])
+        await self.collection.insert_one(analysis_doc)
+
+    async def insert_many(self, analysis_docs: List[dict]):
+        await self._stamp(analysis_docs)
+        await self.collection.insert_many(analysis_docs, ordered=False)
+
+    async def get(self, analysis_id: str) -> Optional[dict]:
+        return _with_id(await self.collection.find_one({"_id": ObjectId(analysis_id)}))
+
+    async def upsert_many(self, analysis_docs: List[dict]):
+        """Insert or replace documents by id, e.g. ones replicated from another node."""
+        if not analysis_docs:
+            return
+        await self._stamp(analysis_docs)
+        await self.collection.bulk_write([
+            ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in analysis_docs
+        ], ordered=False)
+
+    async def set_heatmaps(self, analysis_id: str, heatmaps: dict, condition_locations: dict):
+        seq = await self._reserve_seq(1)
+        await self.collection.update_one(
+            {"_id": ObjectId(analysis_id)},
+            {"$set": {"heatmaps": heatmaps, "condition_locations": condition_locations,
+                      "sync_seq": seq, "updated_at": datetime.utcnow()}}
+        )
+
+    async def changes_since(self, seq: int, limit: int) -> List[dict]:
+        """Documents inserted or changed after sequence value seq, in sequence order, with their raw `_id`."""
+        cursor = self.collection.find({"sync_seq": {"$gt": seq}}).sort("sync_seq", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def owns_image(self, user_id: str, image_url: str) -> bool:
+        doc = await self.collection.find_one({"user_id": user_id, "image_url": image_url}, {"_id": 1})
+        return doc is not None
+
+    async def list_page(self, user_id: str, limit: int, cursor: Optional[str] = None,
+                        summary: bool = True) -> Tuple[List[dict], Optional[str]]:
+        """One page of a user's analyses, newest first, using keyset pagination on (date, _id).
+
+        Returns the page and the cursor for the next one (None on the last page).
+        """
+        query = {"user_id": user_id}
+        if cursor is not None:
+            date, last_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"date": {"$lt": date}},
+                {"date": date, "_id": {"$lt": last_id}},
+            ]
+
+        # Fetch one extra document to learn whether another page follows.
+        docs = await self.collection.find(
+            query, HISTORY_SUMMARY_FIELDS if summary else None
+        ).sort([("date", -1), ("_id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["date"], str(docs[-1]["_id"]))
+        return [_with_id(doc) for doc in docs], next_cursor
+
+    async def iter_history(self, user_id: str, batch_size: int) -> AsyncIterator[dict]:
+        """Every analysis of a user, newest first, fetched from the server batch_size at a time."""
+        cursor = self.collection.find({"user_id": user_id}).sort([("date", -1), ("_id", -1)]).batch_size(batch_size)
+        try:
+            async for doc in cursor:
+                yield _with_id(doc)
+        finally:
+            await cursor.close()
+
+    async def list_changed(self, user_id: str, since: Tuple[datetime, ObjectId], limit: int,
+                           until: Optional[datetime] = None, summary: bool = True) -> List[dict]:
+        """Up to limit of a user's analyses stored or changed after since, an (updated_at, _id) position.
+
+        Ordered by (updated_at, _id), so the last item's position is where
+        the next call continues. Changes after until are left out.
+        """
+        updated_at, last_id = since
+        query = {"user_id": user_id, "$or": [
+            {"updated_at": {"$gt": updated_at}},
+            {"updated_at": updated_at, "_id": {"$gt": last_id}},
+        ]}
+        if until is not None:
+            query["updated_at"] = {"$lte": until}
+        docs = await self.collection.find(
+            query, HISTORY_SUMMARY_FIELDS if summary else None
+        ).sort([("updated_at", 1), ("_id", 1)]).limit(limit).to_list(length=limit)
+        return [_with_id(doc) for doc in docs]
+
+    async def backfill_change_tracking(self, batch_size: int = 1000) -> int:
+        """Stamp analyses stored before change tracking, so sync and ?since= see them.
+
+        Each gets the next sequence values and its analysis date as
+        ``updated_at``. Returns how many documents were stamped.
+        """
+        unstamped = {"sync_seq": {"$exists": False}}
+        stamped = 0
+        while True:
+            docs = await self.collection.find(unstamped, {"date": 1}).sort("_id", 1).limit(batch_size).to_list(
+                length=batch_size
+            )
+            if not docs:
+                return stamped
+            first = await self._reserve_seq(len(docs))
+            now = datetime.utcnow()
+            # The filter repeats the condition so another worker's stamp is never overwritten.
+            result = await self.collection.bulk_write([
+                UpdateOne({"_id": doc["_id"], **unstamped},
+                          {"$set": {"sync_seq": first + i, "updated_at": doc.get("date", now)}})
+                for i, doc in enumerate(docs)
+            ], ordered=False)
+            stamped += result.modified_count
+
+    async def ensure_indexes(self):
+        # Serves the history query and its (date, _id) keyset ordering.
+        await self.collection.create_index(
+            [("user_id", 1), ("date", -1), ("_id", -1)], name="user_history"
+        )
+        # Serves the ownership check when an uploaded image is requested.
+        await self.collection.create_index([("user_id", 1), ("image_url", 1)], name="user_images")
+        # Serves incremental history fetches (?since=).
+        await self.collection.create_index(
+            [("user_id", 1), ("updated_at", 1), ("_id", 1)], name="user_changes"
+        )
+        # Serves the change feed read by sync.
+        await self.collection.create_index([("sync_seq", 1)], name="sync_changes")
+
+        stamped = await self.backfill_change_tracking()
+        if stamped:
+            logger.info(f"Added change tracking to {stamped} existing analyses")
+
+
+class SyncStateRepository:
+    """Per-node sync watermarks kept by the receiving deployment: the highest sequence value applied."""
+
+    def __init__(self, db):
+        self.collection = db.sync_nodes
+
+    async def last_seq(self, node_id: str) -> int:
+        doc = await self.collection.find_one({"_id": node_id})
+        return doc["last_seq"] if doc else 0
+
+    async def advance(self, node_id: str, seq: int) -> int:
+        """Raise a node's watermark to seq (never lower it), returning the new value."""
+        doc = await self.collection.find_one_and_update(
+            {"_id": node_id},
+            {"$max": {"last_seq": seq}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc["last_seq"]
+
+
+class DataStore:
+    """MongoDB connection (via Motor) and the repositories built on it."""
+
+    def __init__(self, client: AsyncIOMotorClient, db_name: str):
+        self.client = client
+        self.db = client[db_name]
+        self.users = UserRepository(self.db)
+        self.analyses = AnalysisRepository(self.db)
+        self.sync = SyncStateRepository(self.db)
+
+    async def ensure_indexes(self):
+        await self.analyses.ensure_indexes()
+
+    def close(self):
+        self.client.close()
+
+
+async def connect(mongo_url: Optional[str], db_name: str):
+    """Open the storage backend selected by DATA_BACKEND.
+
+    Returns a DataStore for MongoDB or a SQLiteDataStore for embedded storage.
+    Returns None when MongoDB is unreachable (and DATA_BACKEND is not "auto")
+    so the API can run in demo mode.
+    """
+    if DATA_BACKEND == "sqlite":
+        from sqlite_store import connect_sqlite
+        return await connect_sqlite(SQLITE_PATH)
+
+    client = AsyncIOMotorClient(
+        mongo_url,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    )
+    try:
+        await client.admin.command('ping')
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {str(e)}")
+        client.close()
+        if DATA_BACKEND == "auto":
+            from sqlite_store import connect_sqlite
+            return await connect_sqlite(SQLITE_PATH)
+        return None
+
+    logger.info("Successfully connected to MongoDB")
+    return DataStore(client, db_name)
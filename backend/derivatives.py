@@ -0,0 +1,151 @@
+import os
+import uuid
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps, features
+
+from blob_store import BlobStore
+from image_decode import HIGH_BIT_DEPTH_MODES, reduce_high_bit_depth
+from singleflight import SingleFlight
+from uploads import UPLOAD_DIR, blob_store, upload_key, UPLOAD_URL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Derivative image configuration
+DERIVATIVE_FORMAT = os.environ.get("DERIVATIVE_FORMAT", "webp").lower()  # "webp" or "jpeg"
+DERIVATIVE_QUALITY = int(os.environ.get("DERIVATIVE_QUALITY", "80"))
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", "2"))
+
+# Longest edge in pixels of each derivative variant
+DERIVATIVE_SIZES = {"thumbnail": 256, "preview": 1024}
+
+
+def variant_urls(image_url: str, image_token: Optional[str] = None) -> dict:
+    """thumbnail_url and preview_url for an analysis image, served under /api/uploads.
+
+    With an image token the URLs carry it, so an <img> tag can load them.
+    Images that are not stored uploads (e.g. placeholders) are returned as is.
+    """
+    key = upload_key(image_url)
+    if key is None:
+        return {f"{variant}_url": image_url for variant in DERIVATIVE_SIZES}
+    token = f"&token={image_token}" if image_token else ""
+    return {f"{variant}_url": f"{UPLOAD_URL_PREFIX}{key}?variant={variant}{token}" for variant in DERIVATIVE_SIZES}
+
+
+class DerivativeStore:
+    """Downscaled thumbnail and preview copies of stored uploads.
+
+    Derivatives are rendered on first request (or prefetched after an upload)
+    on a small thread pool, then kept on local disk next to the uploads.
+    They can always be regenerated from the original, so with a shared blob
+    backend each node keeps its own.
+    """
+
+    def __init__(self, blobs: BlobStore, root: Path, max_workers: int = DERIVATIVE_WORKERS):
+        self.blobs = blobs
+        self.root = Path(root)
+        self.format = DERIVATIVE_FORMAT
+        if self.format == "webp" and not features.check("webp"):
+            logger.warning("Pillow has no WebP support; falling back to JPEG derivatives")
+            self.format = "jpeg"
+        self.extension = "webp" if self.format == "webp" else "jpg"
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="derivative")
+        self._flights = SingleFlight("derivative")
+        self._prefetching = set()
+        self.hits = 0
+        self.generated = 0
+        self.failed = 0
+
+    def name(self, key: str, variant: str) -> str:
+        """File name of a derivative, e.g. "<digest>-thumbnail.webp"."""
+        stem = os.path.basename(key).split(".", 1)[0]
+        return f"{stem}-{variant}.{self.extension}"
+
+    def path(self, key: str, variant: str) -> Path:
+        return self.root / os.path.dirname(key) / self.name(key, variant)
+
+    async def get(self, key: str, variant: str) -> Optional[Path]:
+        """Path of the derivative, rendering it first if needed; None if the original is missing."""
+        if variant not in DERIVATIVE_SIZES:
+            raise ValueError(f"Unknown image variant: {variant}")
+        target = self.path(key, variant)
+        if target.exists():
+            self.hits += 1
+            return target
+        loop = asyncio.get_running_loop()
+        return await self._flights.do(
+            (key, variant), lambda: loop.run_in_executor(self._executor, self._generate, key, variant)
+        )
+
+    def prefetch(self, key: str, variant: str = "thumbnail"):
+        """Render a derivative in the background so the first history view finds it ready."""
+        if self.path(key, variant).exists():
+            return
+        task = asyncio.ensure_future(self.get(key, variant))
+        self._prefetching.add(task)
+        task.add_done_callback(lambda t, k=key, v=variant: self._prefetched(k, v, t))
+
+    def _prefetched(self, key: str, variant: str, task: asyncio.Task):
+        self._prefetching.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Error prefetching {variant} for {key}: {str(task.exception())}")
+
+    def _generate(self, key: str, variant: str) -> Optional[Path]:
+        target = self.path(key, variant)
+        if target.exists():
+            return target
+        source = self.blobs.local_path(key)
+        if source is None:
+            return None
+        try:
+            self._render(source, target, DERIVATIVE_SIZES[variant])
+        except Exception:
+            self.failed += 1
+            raise
+        self.generated += 1
+        return target
+
+    def _render(self, source: Path, target: Path, edge: int):
+        with Image.open(source) as img:
+            if img.format == "JPEG":
+                # Decode at the smallest DCT scale that still covers the target
+                img.draft(None, (edge, edge))
+            img = ImageOps.exif_transpose(img)
+            if img.mode in HIGH_BIT_DEPTH_MODES:
+                img = reduce_high_bit_depth(img, (edge, edge))
+            elif img.mode in ("1", "LA"):
+                img = img.convert("L")
+            elif img.mode not in ("L", "RGB"):
+                img = img.convert("RGB")
+            img.thumbnail((edge, edge), Image.LANCZOS, reducing_gap=3.0)
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            part_path = target.with_name(f".{uuid.uuid4().hex}.part")
+            try:
+                img.save(part_path, format=self.format, quality=DERIVATIVE_QUALITY)
+                os.replace(part_path, target)
+            finally:
+                try:
+                    part_path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "format": self.format,
+            "hits": self.hits,
+            "generated": self.generated,
+            "failed": self.failed,
+            **self._flights.stats(),
+        }
+
+
+derivative_store = DerivativeStore(blob_store, UPLOAD_DIR / ".derived")
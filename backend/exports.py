@@ -0,0 +1,107 @@
+import io
+import os
+import csv
+import json
+import zlib
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List
+
+from bson.objectid import ObjectId
+
+from blob_store import upload_url
+
+logger = logging.getLogger(__name__)
+
+# History export configuration
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+EXPORT_GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", "6"))
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+CSV_COLUMNS = ["id", "date", "type", "image_url", "top_finding", "top_confidence", "predictions", "recommendations"]
+
+# Internal bookkeeping left out of exported records
+INTERNAL_FIELDS = ("image_key", "sync_seq")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot export value of type {type(value).__name__}")
+
+
+def _record(doc: dict) -> dict:
+    record = {key: value for key, value in doc.items() if key not in INTERNAL_FIELDS}
+    if "image_url" in record:
+        record["image_url"] = upload_url(record["image_url"])
+    return record
+
+
+def ndjson_rows(docs: Iterable[dict]) -> str:
+    return "".join(json.dumps(_record(doc), default=_json_default) + "\n" for doc in docs)
+
+
+def _csv_text(rows: List[list]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def csv_rows(docs: Iterable[dict]) -> str:
+    """One flat row per analysis: the top finding, plus all predictions and recommendations joined."""
+    rows = []
+    for doc in docs:
+        predictions = sorted(doc.get("predictions") or [], key=lambda p: p["confidence"], reverse=True)
+        date = doc.get("date")
+        rows.append([
+            doc["id"],
+            date.isoformat() if isinstance(date, datetime) else date,
+            doc.get("type"),
+            upload_url(doc.get("image_url")),
+            predictions[0]["label"] if predictions else "",
+            f"{predictions[0]['confidence']:.4f}" if predictions else "",
+            "; ".join(f"{p['label']}={p['confidence']:.4f}" for p in predictions),
+            " | ".join(doc.get("recommendations") or []),
+        ])
+    return _csv_text(rows)
+
+
+async def export_stream(docs: AsyncIterator[dict], export_format: str, compress: bool = False,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Encode analyses as they arrive, yielding one chunk per batch_size documents.
+
+    Only one batch is held at a time, so memory does not grow with the
+    length of the history. With compress the chunks form a gzip stream.
+    """
+    encode = csv_rows if export_format == "csv" else ndjson_rows
+    deflater = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return deflater.compress(data) if deflater is not None else data
+
+    # An empty chunk could end a chunked response early, so only non-empty ones are yielded
+    if export_format == "csv":
+        chunk = emit(_csv_text([CSV_COLUMNS]))
+        if chunk:
+            yield chunk
+    batch = []
+    async for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            chunk = emit(encode(batch))
+            batch = []
+            if chunk:
+                yield chunk
+    if batch:
+        chunk = emit(encode(batch))
+        if chunk:
+            yield chunk
+    if deflater is not None:
+        yield deflater.flush()
@@ -0,0 +1,99 @@
+import base64
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+# Findings below this confidence get no location, as before
+LOCATION_MIN_CONFIDENCE = 0.3
+# Fraction of a map's peak that counts as part of the highlighted region
+REGION_THRESHOLD = 0.5
+
+
+def class_activation_maps(model: torch.nn.Module, batch: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Run the DenseNet forward pass, also returning a class activation map per class.
+
+    The classifier is a single linear layer over globally pooled features, so
+    Grad-CAM for class c reduces to ReLU(sum_k w[c, k] * A_k) over the last
+    dense block's activations A. The forward pass is spelled out here
+    (features, ReLU, pooling, classifier, then the model's output
+    normalization) so A is a local of this call: the model is shared between
+    threads, and a hook on it would see other callers' passes. The maps come
+    from the same pass as the predictions and need no backward pass.
+    Returns (outputs, maps) with maps shaped (N, classes, h, w).
+    """
+    if hasattr(model, "input_resolution"):
+        from torchxrayvision.utils import fix_resolution
+        batch = fix_resolution(batch, model.input_resolution, model)
+
+    activations = torch.relu(model.features(batch))
+    pooled = F.adaptive_avg_pool2d(activations, (1, 1)).flatten(1)
+    outputs = model.classifier(pooled)
+    if getattr(model, "op_threshs", None) is not None:
+        from torchxrayvision.models import op_norm
+        outputs = op_norm(torch.sigmoid(outputs), model.op_threshs)
+    elif getattr(model, "apply_sigmoid", False):
+        outputs = torch.sigmoid(outputs)
+
+    maps = torch.relu(torch.einsum("nkhw,ck->nchw", activations, model.classifier.weight))
+    return outputs, maps
+
+
+def encode_heatmaps(maps: np.ndarray, labels: Sequence[str], selected: List[str]) -> dict:
+    """Quantize one image's (classes, h, w) maps for the selected labels to base64 uint8 grids.
+
+    Each map is scaled by its own peak, so 255 marks the most activated cell.
+    """
+    index = {label: i for i, label in enumerate(labels)}
+    encoded = {}
+    for label in selected:
+        if label not in index:
+            continue
+        cam = maps[index[label]].astype(np.float32)
+        peak = float(cam.max())
+        quantized = np.zeros(cam.shape, dtype=np.uint8) if peak <= 0 else \
+            np.rint(cam * (255.0 / peak)).astype(np.uint8)
+        encoded[label] = base64.b64encode(quantized.tobytes()).decode("ascii")
+    return {"size": [int(maps.shape[1]), int(maps.shape[2])], "maps": encoded}
+
+
+def decode_heatmap(heatmaps: dict, label: str) -> np.ndarray:
+    height, width = heatmaps["size"]
+    return np.frombuffer(base64.b64decode(heatmaps["maps"][label]), dtype=np.uint8).reshape(height, width)
+
+
+def _severity(confidence: float) -> str:
+    return "Moderate" if confidence > 0.7 else ("Mild" if confidence > 0.4 else "None")
+
+
+def heatmap_locations(heatmaps: dict, predictions: List[dict]) -> Dict[str, dict]:
+    """condition_locations entries derived from activation maps.
+
+    x and y are the activation-weighted centre of the highlighted region and
+    radius its equivalent-circle radius, all in percent of the image.
+    """
+    locations = {}
+    for pred in predictions:
+        if pred["confidence"] <= LOCATION_MIN_CONFIDENCE or pred["label"] not in heatmaps["maps"]:
+            continue
+        cam = decode_heatmap(heatmaps, pred["label"]).astype(np.float32)
+        height, width = cam.shape
+        region = np.where(cam >= REGION_THRESHOLD * 255.0, cam, 0.0)
+        total = float(region.sum())
+        if total <= 0:
+            continue
+        ys, xs = np.mgrid[0:height, 0:width]
+        x = float((region * (xs + 0.5)).sum() / total) / width * 100.0
+        y = float((region * (ys + 0.5)).sum() / total) / height * 100.0
+        area = float((region > 0).sum()) / (height * width)
+        locations[pred["label"]] = {
+            "x": round(x, 1),
+            "y": round(y, 1),
+            "radius": round(float(np.sqrt(area / np.pi)) * 100.0, 1),
+            "severity": _severity(pred["confidence"]),
+        }
+    return locations
@@ -0,0 +1,130 @@
+import time
+import logging
+from io import BytesIO
+from pathlib import Path
+from typing import Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Bytes per pixel of the Pillow modes we expect from uploads
+MODE_BYTES_PER_PIXEL = {
+    "1": 1, "L": 1, "P": 1, "LA": 2, "RGB": 3, "YCbCr": 3, "RGBA": 4, "CMYK": 4,
+    "I;16": 2, "I;16B": 2, "I;16L": 2, "I;16N": 2, "I": 4, "F": 4,
+}
+
+# Single-channel modes wider than 8 bits (16-bit PNG/TIFF radiographs)
+HIGH_BIT_DEPTH_MODES = ("I;16", "I;16B", "I;16L", "I;16N", "I", "F")
+
+
+def _pixel_bytes(img: Image.Image) -> int:
+    return img.size[0] * img.size[1] * MODE_BYTES_PER_PIXEL.get(img.mode, 4)
+
+
+class DecodeStats:
+    """Per-image record of the reduced decode and an estimate of the pixel memory it avoided.
+
+    decode_ms is measured. The byte counts are not: they are computed from
+    image dimensions and modes, as the pixel buffers alive at the peak of
+    each pipeline, against the previous full-resolution RGB decode. Pillow
+    allocates pixel memory outside the Python allocator, so it is not
+    measured per request.
+    """
+
+    __slots__ = ("format", "mode", "source_size", "decoded_size", "decode_ms",
+                 "estimated_peak_pixel_bytes", "estimated_baseline_pixel_bytes")
+
+    def __init__(self, format: str, mode: str, source_size: Tuple[int, int]):
+        self.format = format
+        self.mode = mode
+        self.source_size = source_size
+        self.decoded_size = source_size
+        self.decode_ms = 0.0
+        self.estimated_peak_pixel_bytes = 0
+        self.estimated_baseline_pixel_bytes = 0
+
+    @property
+    def estimated_bytes_saved(self) -> int:
+        return max(0, self.estimated_baseline_pixel_bytes - self.estimated_peak_pixel_bytes)
+
+    def as_dict(self) -> dict:
+        return {
+            "format": self.format,
+            "mode": self.mode,
+            "source_size": list(self.source_size),
+            "decoded_size": list(self.decoded_size),
+            "decode_ms": round(self.decode_ms, 2),
+            "estimated_peak_pixel_bytes": self.estimated_peak_pixel_bytes,
+            "estimated_baseline_pixel_bytes": self.estimated_baseline_pixel_bytes,
+            "estimated_bytes_saved": self.estimated_bytes_saved,
+        }
+
+
+def reduce_high_bit_depth(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """Box-reduce a 16-bit image in NumPy, then window its value range into 8 bits."""
+    arr = np.asarray(img)
+    factor = min(arr.shape[1] // size[0], arr.shape[0] // size[1])
+    if factor >= 2:
+        h, w = (arr.shape[0] // factor) * factor, (arr.shape[1] // factor) * factor
+        arr = arr[:h, :w].reshape(h // factor, factor, w // factor, factor).mean(
+            axis=(1, 3), dtype=np.float32
+        )
+    else:
+        arr = arr.astype(np.float32)
+
+    lo, hi = float(arr.min()), float(arr.max())
+    if hi <= lo:
+        return Image.new("L", (arr.shape[1], arr.shape[0]), 0)
+    arr -= lo
+    arr *= 255.0 / (hi - lo)
+    return Image.fromarray(arr.astype(np.uint8), mode="L")
+
+
+def decode_grayscale(
+    source: Union[str, Path, bytes, memoryview, BytesIO],
+    size: Tuple[int, int] = (224, 224),
+) -> Tuple[Image.Image, DecodeStats]:
+    """Decode an uploaded image straight to 8-bit grayscale at the requested size.
+
+    JPEGs are decoded at the smallest DCT scale that still covers ``size`` and
+    only the luma channel is produced. Other formats are shrunk with
+    ``Image.reduce`` before the final resample, and 16-bit radiographs are
+    windowed to 8 bits without an RGB round trip. ``source`` may be a path,
+    in which case Pillow reads the stored file directly.
+    """
+    started = time.perf_counter()
+    stream = source if isinstance(source, (str, Path)) or hasattr(source, "read") else BytesIO(source)
+    img = Image.open(stream)
+
+    stats = DecodeStats(img.format or "unknown", img.mode, img.size)
+    full_pixels = img.size[0] * img.size[1]
+    # Previous pipeline: full-resolution decode, an RGB copy and its grayscale conversion.
+    stats.estimated_baseline_pixel_bytes = _pixel_bytes(img) + full_pixels * 3 + full_pixels
+
+    if img.format == "JPEG":
+        img.draft("L", size)
+    img.load()
+    stats.decoded_size = img.size
+    decoded_bytes = _pixel_bytes(img)
+
+    if img.mode in HIGH_BIT_DEPTH_MODES:
+        # Decoded buffer plus the NumPy copy taken from it.
+        stats.estimated_peak_pixel_bytes = decoded_bytes * 2
+        img = reduce_high_bit_depth(img, size)
+    else:
+        stats.estimated_peak_pixel_bytes = decoded_bytes
+        if img.mode != "L":
+            img = img.convert("L")
+            stats.estimated_peak_pixel_bytes += _pixel_bytes(img)
+        factor = min(img.size[0] // size[0], img.size[1] // size[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+
+    if img.size != size:
+        img = img.resize(size, Image.BICUBIC)
+
+    stats.decode_ms = (time.perf_counter() - started) * 1000.0
+    logger.debug(f"Decoded image: {stats.as_dict()}")
+    return img, stats
@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Inference executor configuration
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread")  # "thread" or "process"
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "32"))
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference queue has no room for another job."""
+
+
+def _init_process_worker():
+    # Each process worker keeps its own copy of the models resident.
+    from model_registry import registry
+
+    registry.load_all()
+
+
+class InferenceExecutor:
+    """Runs CPU-heavy analysis functions off the event loop with a bounded queue."""
+
+    def __init__(self, kind: str = INFERENCE_EXECUTOR, max_workers: int = INFERENCE_WORKERS,
+                 max_queue: int = INFERENCE_QUEUE_SIZE):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_process_worker
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="inference"
+            )
+        logger.info(
+            f"Started {self.kind} inference executor with {self.max_workers} workers "
+            f"and queue size {self.max_queue}"
+        )
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on the pool, raising InferenceQueueFull if the queue is saturated."""
+        if self._pending >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise InferenceQueueFull(
+                f"Inference queue is full ({self._pending} jobs pending)"
+            )
+
+        self.start()
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._pending -= 1
+            self._busy_seconds += time.perf_counter() - started
+        self._completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "queue_capacity": self.max_queue,
+            "running": min(self._pending, self.max_workers),
+            "queued": max(0, self._pending - self.max_workers),
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "busy_seconds": round(self._busy_seconds, 3),
+        }
+
+
+executor = InferenceExecutor()
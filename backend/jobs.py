@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job queue configuration
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "256"))
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("JOB_RESULT_TTL_SECONDS", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be accepted."""
+
+
+class Job:
+    """A queued analysis request and, once processed, its result or error."""
+
+    def __init__(self, job_type: str, user_id: str, payload: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.user_id = user_id
+        self.payload: Optional[Dict[str, Any]] = payload
+        self.status = QUEUED
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self._finished_monotonic: Optional[float] = None
+        self._done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """In-process job queue served by a fixed number of worker tasks.
+
+    Jobs and results live in this worker's memory only, so clients must poll
+    the same API process they submitted to. Finished jobs are kept for
+    ``result_ttl`` seconds.
+    """
+
+    def __init__(self, handler: Callable[[Job], Awaitable[dict]], workers: int = JOB_WORKERS,
+                 max_queue: int = JOB_QUEUE_SIZE, result_ttl: float = JOB_RESULT_TTL_SECONDS):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.result_ttl = result_ttl
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started job queue with {self.workers} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_type: str, user_id: str, payload: Dict[str, Any]) -> Job:
+        self._purge_expired()
+        self.start()
+        job = Job(job_type, user_id, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self._queue.qsize()} jobs queued)")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge_expired()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Long-poll: wait up to ``timeout`` seconds for the job to finish."""
+        if not job.finished and timeout > 0:
+            try:
+                await asyncio.wait_for(job._done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            job.started_at = datetime.utcnow()
+            try:
+                job.result = await self.handler(job)
+                job.status = DONE
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.error = getattr(e, "detail", None) or str(e)
+                job.status = FAILED
+                self.failed += 1
+                logger.error(f"Job {job.id} ({job.type}) failed: {job.error}")
+            finally:
+                # The upload is no longer needed once the job has run
+                job.payload = None
+                job.finished_at = datetime.utcnow()
+                job._finished_monotonic = time.monotonic()
+                job._done.set()
+                self._queue.task_done()
+
+    def _purge_expired(self):
+        cutoff = time.monotonic() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job._finished_monotonic is not None and job._finished_monotonic < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue,
+            "tracked": len(self._jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,147 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# X-ray model configuration
+XRAY_MODEL_NAME = "xray"
+XRAY_MODEL_WEIGHTS = os.environ.get("XRAY_MODEL_WEIGHTS", "densenet121-res224-all")
+
+# After a failed load, further attempts wait this long (doubling per failure, up to the maximum)
+MODEL_RETRY_BACKOFF_SECONDS = float(os.environ.get("MODEL_RETRY_BACKOFF_SECONDS", "30"))
+MODEL_RETRY_MAX_BACKOFF_SECONDS = float(os.environ.get("MODEL_RETRY_MAX_BACKOFF_SECONDS", "600"))
+
+
+class ModelUnavailable(Exception):
+    """Raised without retrying while a model that failed to load is backing off."""
+
+
+class ModelRegistry:
+    """Loads each registered model once per worker process and keeps it in memory."""
+
+    def __init__(self):
+        self._specs: Dict[str, dict] = {}
+        self._models: Dict[str, torch.nn.Module] = {}
+        self._errors: Dict[str, str] = {}
+        # name -> (consecutive failures, monotonic time of the next allowed attempt)
+        self._failures: Dict[str, Tuple[int, float]] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], torch.nn.Module],
+        version: str,
+        warmup_shape: Optional[Tuple[int, ...]] = None,
+    ):
+        """Register a model loader under a name; the model is not built until first use."""
+        self._specs[name] = {"loader": loader, "version": version, "warmup_shape": warmup_shape}
+
+    def version(self, name: str) -> str:
+        return self._specs[name]["version"]
+
+    def _check_backoff(self, name: str):
+        failure = self._failures.get(name)
+        if failure is not None and time.monotonic() < failure[1]:
+            raise ModelUnavailable(f"Model '{name}' failed to load: {self._errors.get(name)}")
+
+    def load(self, name: str) -> torch.nn.Module:
+        """Build, warm up and cache the named model, returning the cached instance if present.
+
+        A failed load is remembered: until its backoff expires, further calls
+        raise ModelUnavailable at once instead of retrying, so callers go
+        straight to their fallback.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        self._check_backoff(name)
+
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+            self._check_backoff(name)
+
+            spec = self._specs[name]
+            started = time.perf_counter()
+            try:
+                model = spec["loader"]()
+                model.eval()
+                if spec["warmup_shape"] is not None:
+                    # A dummy forward pass allocates buffers and initialises kernels
+                    # so the first real request only pays for its own inference.
+                    with torch.no_grad():
+                        model(torch.zeros(spec["warmup_shape"]))
+            except Exception as e:
+                failures = self._failures.get(name, (0, 0.0))[0] + 1
+                backoff = min(MODEL_RETRY_BACKOFF_SECONDS * 2 ** (failures - 1), MODEL_RETRY_MAX_BACKOFF_SECONDS)
+                self._failures[name] = (failures, time.monotonic() + backoff)
+                self._errors[name] = str(e)
+                logger.error(f"Failed to load model '{name}', retrying after {backoff:.0f}s: {str(e)}")
+                raise ModelUnavailable(f"Model '{name}' failed to load: {str(e)}") from e
+
+            self._models[name] = model
+            self._errors.pop(name, None)
+            self._failures.pop(name, None)
+            self._load_seconds[name] = time.perf_counter() - started
+            logger.info(f"Loaded model '{name}' ({spec['version']}) in {self._load_seconds[name]:.2f}s")
+            return model
+
+    def reload(self, name: str) -> torch.nn.Module:
+        """Load the named model again now, ignoring any backoff from earlier failures."""
+        with self._lock:
+            self._models.pop(name, None)
+            self._failures.pop(name, None)
+        return self.load(name)
+
+    def get(self, name: str) -> torch.nn.Module:
+        """Return a ready-to-run model, loading it on first use."""
+        return self.load(name)
+
+    def load_all(self):
+        """Load every registered model, logging (not raising) failures."""
+        for name in self._specs:
+            try:
+                self.load(name)
+            except Exception:
+                pass
+
+    def is_ready(self, name: Optional[str] = None) -> bool:
+        """True when the named model (or every registered model) is resident in memory."""
+        if name is not None:
+            return name in self._models
+        return all(n in self._models for n in self._specs)
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "version": spec["version"],
+                "ready": name in self._models,
+                "load_seconds": self._load_seconds.get(name),
+                "error": self._errors.get(name),
+                "failures": self._failures.get(name, (0, 0.0))[0],
+            }
+            for name, spec in self._specs.items()
+        }
+
+
+def _load_xray_densenet() -> torch.nn.Module:
+    import torchxrayvision as xrv
+
+    return xrv.models.DenseNet(weights=XRAY_MODEL_WEIGHTS)
+
+
+registry = ModelRegistry()
+registry.register(
+    XRAY_MODEL_NAME,
+    _load_xray_densenet,
+    version=XRAY_MODEL_WEIGHTS,
+    warmup_shape=(1, 1, 224, 224),
+)
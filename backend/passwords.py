@@ -0,0 +1,81 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", "64"))
+
+# Hashes made with a different cost are flagged by verify_and_update, so
+# changing BCRYPT_ROUNDS migrates users transparently as they log in.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash/verify jobs are already waiting."""
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a small dedicated thread pool.
+
+    bcrypt releases the GIL while hashing, so a couple of threads keep the
+    event loop free without letting a login burst take every core.
+    """
+
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS,
+                 max_queue: int = PASSWORD_HASH_QUEUE_SIZE):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = self.max_workers + max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password")
+        self._pending = 0
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy(f"Password hashing queue is full ({self._pending} jobs pending)")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(pwd_context.hash, password)
+        self.hashed += 1
+        return hashed
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password, also returning a new hash when the stored one uses an outdated cost."""
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed_password)
+        self.verified += 1
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": BCRYPT_ROUNDS,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "hashed": self.hashed,
+            "verified": self.verified,
+            "rehashed": self.rehashed,
+            "rejected": self.rejected,
+        }
+
+
+password_hasher = PasswordHasher()
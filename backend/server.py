@@ -1,28 +1,53 @@
 import os
+import time
 import uuid
+import functools
 import json
 import logging
-from typing import List, Optional
+import asyncio
+import zipfile
+import threading
+from typing import List, Optional, Union
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import jwt
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Body, Header, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Body, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr, Field
-from passlib.context import CryptContext
 import torchxrayvision as xrv
 import torch
 import numpy as np
 from PIL import Image
 from io import BytesIO
 import torchvision.transforms as transforms
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 
+from model_registry import registry as model_registry, XRAY_MODEL_NAME
+from inference_executor import executor as inference_executor, InferenceQueueFull
+from batching import xray_batcher
+from image_decode import decode_grayscale
+from xray_pipeline import preprocess_batch, postprocess_batch
+from heatmaps import encode_heatmaps, heatmap_locations
+from cache import result_cache, user_cache, image_access_cache, content_digest, RESULT_CACHE_PERSISTENT
+from singleflight import analysis_flights
+import data_access
+from passwords import password_hasher, PasswordHasherBusy
+from jobs import JobQueue, JobQueueFull
+from batch_upload import ingest_image_files, iter_image_entries, chunked, BatchTooLarge, BATCH_CHUNK_SIZE, BATCH_MAX_TOTAL_BYTES
+from uploads import UPLOAD_DIR, MAX_UPLOAD_BYTES, blob_store, IngestedUpload, UploadTooLarge, ingest_upload, store_bytes
+from uploads import upload_key, upload_url, UPLOAD_URL_PREFIX, LEGACY_UPLOAD_URL_PREFIX
+from blob_serving import blob_file_response, not_modified
+from derivatives import derivative_store, variant_urls, DERIVATIVE_SIZES
+from tiles import tile_store, dzi_descriptor
+from write_behind import WriteBehindQueue, WRITE_BEHIND_ENABLED
+from exports import export_stream, EXPORT_FORMATS, EXPORT_BATCH_SIZE
+from sync import (sync_pusher, token_valid, parse_blob_key, decode_batch, read_body, RequestReader,
+                  SyncBatchInvalid, SYNC_TOKEN, SYNC_MAX_BATCH_BYTES, MAX_MISSING_KEYS)
+
 # Load environment variables
 load_dotenv()
 
@@ -33,6 +58,29 @@ logger = logging.getLogger(__name__)
 # Initialize FastAPI app
 app = FastAPI(title="ZemedicAI API", description="API for ZemedicAI medical image analysis")
 
+# Multipart framing (boundaries, part headers, small form fields) allowed on top of the file size limits
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Refuse a multipart body whose Content-Length is over the upload limit before it is read.
+
+    Starlette spools a multipart body to a temporary file while parsing the
+    form, before any handler runs, so this is the only check that keeps an
+    oversized upload off the disk. The chunked cap in ingest_upload() is a
+    second line of defence for bodies sent without a Content-Length.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        limit = BATCH_MAX_TOTAL_BYTES if request.url.path == "/api/analyze/xray/batch" else MAX_UPLOAD_BYTES
+        limit += MULTIPART_OVERHEAD_BYTES
+        try:
+            length = int(request.headers.get("content-length", ""))
+        except ValueError:
+            length = None
+        if length is not None and length > limit:
+            return JSONResponse(status_code=413, content={"detail": f"Request body exceeds the limit of {limit} bytes"})
+    return await call_next(request)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -40,37 +88,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-History-Watermark"],
 )
 
 # MongoDB connection
 MONGO_URL = os.environ.get("MONGO_URL")
 DB_NAME = os.environ.get("DB_NAME", "zemedic_db")
 
-try:
-    client = MongoClient(MONGO_URL)
-    # Test the connection
-    client.admin.command('ping')
-    db = client[DB_NAME]
-    logger.info("Successfully connected to MongoDB")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {str(e)}")
-    # For demo purposes, we'll still initialize the app but won't use the database
-    client = None
-    db = None
+# Async data-access layer, connected at startup: MongoDB, or embedded SQLite
+# when DATA_BACKEND selects it. When MongoDB is unreachable and there is no
+# SQLite fallback this stays None and the app runs in demo mode.
+store = None  # data_access.DataStore or sqlite_store.SQLiteDataStore
+
+# Incremental history fetches leave out changes younger than this, so a
+# watermark never passes an analysis whose write is still in flight
+HISTORY_WATERMARK_LAG_SECONDS = float(os.environ.get("HISTORY_WATERMARK_LAG_SECONDS", "5"))
 
 # JWT Configuration
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key")  # Should be properly secured in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+# Image URLs handed to the browser carry their own token, which can only load the user's images
+IMAGE_TOKEN_SCOPE = "images"
+IMAGE_TOKEN_TTL_SECONDS = int(os.environ.get("IMAGE_TOKEN_TTL_SECONDS", "900"))
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
+# Password hashing runs on a dedicated pool, see passwords.py
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
 # File upload directory
-UPLOAD_DIR = Path("./uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
 # ----------------------------------------
@@ -125,30 +171,48 @@ class AnalysisResult(BaseModel):
     predictions: List[Prediction]
     recommendations: Optional[List[str]] = None
 
+class SyncBlobKeys(BaseModel):
+    keys: List[str] = Field(..., max_length=MAX_MISSING_KEYS)
+
 # ----------------------------------------
 # Auth functions
 # ----------------------------------------
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def hash_or_busy(coro):
+    """Await a password hashing job, mapping a saturated pool to a 503."""
+    try:
+        return await coro
+    except PasswordHasherBusy as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Authentication service is busy, please retry shortly",
+            headers={"Retry-After": "2"}
+        )
+
+async def verify_password(plain_password, hashed_password):
+    return await hash_or_busy(password_hasher.verify_and_update(plain_password, hashed_password))
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await hash_or_busy(password_hasher.hash(password))
 
-def get_user(email: str):
-    user_doc = db.users.find_one({"email": email})
+async def get_user(email: str):
+    user_doc = await store.users.get_by_email(email)
     if user_doc:
-        user_doc["id"] = str(user_doc["_id"])
-        del user_doc["_id"]
         return UserInDB(**user_doc)
     return None
 
-def authenticate_user(email: str, password: str):
-    user = get_user(email)
+async def authenticate_user(email: str, password: str):
+    user = await get_user(email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        # The stored hash uses an outdated bcrypt cost; upgrade it transparently
+        await store.users.update(user.id, {"hashed_password": new_hash})
+        user_cache.delete(user.id)
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -161,7 +225,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_image_token(user_id: str) -> str:
+    """Short-lived token for image URLs (<img> tags cannot send an Authorization header).
+
+    It is scoped to image endpoints, so one leaked through logs or referrers
+    cannot call the rest of the API. Expiry is aligned to TTL windows: within
+    a window every response carries the same token, so image URLs stay
+    cacheable. A token lives between one and two TTLs.
+    """
+    now = int(time.time())
+    expire = now - now % IMAGE_TOKEN_TTL_SECONDS + 2 * IMAGE_TOKEN_TTL_SECONDS
+    return jwt.encode({"sub": user_id, "scope": IMAGE_TOKEN_SCOPE, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await user_for_token(token)
+
+async def user_for_token(token: str, scope: Optional[str] = None):
+    """The user a token was issued to; access tokens have no scope, image tokens IMAGE_TOKEN_SCOPE."""
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -169,11 +249,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     
     # Demo mode for MongoDB unavailability
-    if client is None or db is None:
+    if store is None:
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             user_id: str = payload.get("sub")
-            if user_id is None:
+            if user_id is None or payload.get("scope") != scope:
                 raise credentials_exception
                 
             # Create a demo user
@@ -190,83 +270,92 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("scope") != scope:
             raise credentials_exception
         token_data = TokenData(user_id=user_id)
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user_doc = db.users.find_one({"_id": ObjectId(token_data.user_id)})
+    user = user_cache.get(token_data.user_id)
+    if user is not None:
+        return user
+    
+    user_doc = await store.users.get_by_id(token_data.user_id)
     if user_doc is None:
         raise credentials_exception
     
-    user_doc["id"] = str(user_doc["_id"])
-    del user_doc["_id"]
-    return UserInDB(**user_doc)
+    user = UserInDB(**user_doc)
+    user_cache.set(token_data.user_id, user)
+    return user
+
+async def get_image_user(request: Request, token: Optional[str] = Query(None)):
+    """get_current_user for image URLs.
+
+    Browsers load images through <img> tags and tile viewers, which cannot
+    send an Authorization header, so an image token from create_image_token()
+    may be passed as ?token= instead. Access tokens are only accepted in the
+    header, so they never end up in URLs.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return await user_for_token(authorization[7:])
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return await user_for_token(token, IMAGE_TOKEN_SCOPE)
 
 # ----------------------------------------
 # Image Analysis Functions
 # ----------------------------------------
 
-def analyze_xray_image(image_data: bytes):
-    """Analyze chest X-ray images using torchxrayvision model."""
+XRAY_RECOMMENDATIONS = [
+    "Consult with a healthcare professional for proper diagnosis",
+    "Consider follow-up imaging to monitor any changes",
+    "Maintain a healthy lifestyle with proper diet and exercise",
+    "If you smoke, consider a smoking cessation program"
+]
+
+def xray_labels() -> List[str]:
+    """Output labels of the loaded X-ray model, in logit order; they depend on XRAY_MODEL_WEIGHTS."""
+    model = model_registry.get(XRAY_MODEL_NAME)
+    return list(getattr(model, "pathologies", xrv.datasets.default_pathologies))
+
+def analyze_xray_image(image_data):
+    """Analyze chest X-ray images using torchxrayvision model.
+
+    image_data is the uploaded bytes or the path of the stored upload.
+    """
     try:
         # Create a fallback for demo mode if model loading fails
         try:
             # Try to load the pre-trained model
             import torchxrayvision as xrv
-            import torch
-            from PIL import Image
-            from io import BytesIO
-            import torchvision.transforms as transforms
-            import numpy as np
-            
-            model = xrv.models.DenseNet(weights="densenet121-res224-all")
-            model.eval()
-            
-            # Preprocess the image
-            img = Image.open(BytesIO(image_data)).convert('RGB')
-            img = img.resize((224, 224))
-            transform = transforms.Compose([
-                transforms.Grayscale(num_output_channels=1),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.5], std=[0.5])
-            ])
-            
-            img_tensor = transform(img).unsqueeze(0)
-            
-            # Make prediction
-            with torch.no_grad():
-                output = model(img_tensor)
-                
-            # Get results
-            preds = output.cpu().detach().numpy()[0]
             
-            # Map to pathology names
-            pathologies = xrv.datasets.default_pathologies
+            # Preprocess the image: decode at reduced scale straight to 8-bit grayscale
+            img, decode_stats = decode_grayscale(image_data, (224, 224))
+            logger.info(
+                f"Decoded {decode_stats.format} {decode_stats.source_size} in "
+                f"{decode_stats.decode_ms:.1f}ms, an estimated {decode_stats.estimated_bytes_saved // 1024} KiB "
+                f"less pixel memory than a full-resolution decode"
+            )
+            img_tensor = preprocess_batch([img])
             
-            # Prepare results (top 3 highest confidence)
-            results = []
-            for i in range(len(pathologies)):
-                # Convert from logit to probability with sigmoid
-                prob = 1 / (1 + np.exp(-preds[i]))
-                results.append({"label": pathologies[i], "confidence": float(prob)})
+            # Make prediction; concurrent requests share one forward pass,
+            # which also yields the class activation maps
+            output, maps = xray_batcher.predict(img_tensor)
             
-            # Sort by confidence and take top 3
-            results.sort(key=lambda x: x["confidence"], reverse=True)
-            top_results = results[:3]
+            # Top 3 highest confidence pathologies
+            labels = xray_labels()
+            top_results = postprocess_batch(output.cpu().numpy(), labels, k=3)[0]
+            heatmaps = encode_heatmaps(maps[0].cpu().numpy(), labels, [pred["label"] for pred in top_results])
             
             # Generate recommendations based on findings
-            recommendations = [
-                "Consult with a healthcare professional for proper diagnosis",
-                "Consider follow-up imaging to monitor any changes",
-                "Maintain a healthy lifestyle with proper diet and exercise",
-                "If you smoke, consider a smoking cessation program"
-            ]
+            recommendations = XRAY_RECOMMENDATIONS
             
             return {
                 "predictions": top_results,
-                "recommendations": recommendations
+                "recommendations": recommendations,
+                "heatmaps": heatmaps,
+                "decode": decode_stats.as_dict()
             }
         except Exception as e:
             # If model loading fails, use demo data
@@ -289,23 +378,65 @@ def analyze_xray_image(image_data: bytes):
             selected_conditions = random.sample(conditions, num_conditions)
             selected_conditions.sort(key=lambda x: x["confidence"], reverse=True)
             
-            recommendations = [
-                "Consult with a healthcare professional for proper diagnosis",
-                "Consider follow-up imaging to monitor any changes",
-                "Maintain a healthy lifestyle with proper diet and exercise",
-                "If you smoke, consider a smoking cessation program"
-            ]
+            recommendations = XRAY_RECOMMENDATIONS
             
             return {
                 "predictions": selected_conditions,
-                "recommendations": recommendations
+                "recommendations": recommendations,
+                "demo": True
             }
             
     except Exception as e:
         logger.error(f"Error analyzing X-ray: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error analyzing image: {str(e)}")
 
-def analyze_skin_image(image_data: bytes):
+def analyze_xray_batch(images: List[Union[bytes, str]]):
+    """Analyze several chest X-rays (bytes or stored paths) with a single batched forward pass.
+
+    Entries that cannot be decoded get an "error" instead of predictions. If
+    the model is unavailable every entry falls back to analyze_xray_image.
+    """
+    results = [None] * len(images)
+    decoded, indices = [], []
+    for i, image_data in enumerate(images):
+        try:
+            img, _ = decode_grayscale(image_data, (224, 224))
+            decoded.append(img)
+            indices.append(i)
+        except Exception as e:
+            results[i] = {"error": f"Could not decode image: {str(e)}"}
+    
+    if not decoded:
+        return results
+    
+    try:
+        output, maps = xray_batcher.predict(preprocess_batch(decoded))
+        labels = xray_labels()
+        predictions = postprocess_batch(output.cpu().numpy(), labels, k=3)
+        maps = maps.cpu().numpy()
+        for row, (i, top_results) in enumerate(zip(indices, predictions)):
+            results[i] = {
+                "predictions": top_results,
+                "recommendations": XRAY_RECOMMENDATIONS,
+                "heatmaps": encode_heatmaps(maps[row], labels, [pred["label"] for pred in top_results])
+            }
+    except Exception as e:
+        logger.error(f"Error running batched XRay model: {str(e)}")
+        for i in indices:
+            results[i] = analyze_xray_image(images[i])
+    return results
+
+def xray_heatmaps(image_data, labels: List[str]) -> Optional[dict]:
+    """Class activation maps of a stored X-ray for the given findings, or None if the model is unavailable."""
+    try:
+        img, _ = decode_grayscale(image_data, (224, 224))
+        _, maps = xray_batcher.predict(preprocess_batch([img]))
+        return encode_heatmaps(maps[0].cpu().numpy(), xray_labels(), labels)
+    except Exception as e:
+        logger.error(f"Error computing X-ray heatmaps: {str(e)}")
+        return None
+
+def analyze_skin_image(image_data):
     """Placeholder for skin lesion analysis."""
     # Demo predictions for skin lesions
     predictions = [
@@ -326,7 +457,7 @@ def analyze_skin_image(image_data: bytes):
         "recommendations": recommendations
     }
 
-def analyze_ct_scan(image_data: bytes):
+def analyze_ct_scan(image_data):
     """Placeholder for CT scan analysis."""
     # Demo predictions for CT scans
     predictions = [
@@ -347,6 +478,332 @@ def analyze_ct_scan(image_data: bytes):
         "recommendations": recommendations
     }
 
+async def run_analysis(analyze_fn, image_data):
+    """Run an analysis function on the inference executor instead of the event loop."""
+    try:
+        return await inference_executor.run(analyze_fn, image_data)
+    except InferenceQueueFull as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Analysis service is busy, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
+def cacheable_result(analysis_result: dict) -> dict:
+    """The parts of an analysis result kept in the result cache."""
+    cached = {
+        "predictions": analysis_result["predictions"],
+        "recommendations": analysis_result["recommendations"]
+    }
+    if "heatmaps" in analysis_result:
+        cached["heatmaps"] = analysis_result["heatmaps"]
+    return cached
+
+def analysis_model_version(analysis_type: str) -> str:
+    """Identifier of the model behind an analysis type, part of the result cache key."""
+    if analysis_type == "xray":
+        return f"{XRAY_MODEL_NAME}:{model_registry.version(XRAY_MODEL_NAME)}"
+    return f"{analysis_type}:placeholder-v1"
+
+async def analyze_with_cache(analysis_type: str, analyze_fn, image_data, digest: str):
+    """Return the cached result for previously analyzed bytes, running the analysis on a miss.
+
+    image_data is passed through to analyze_fn; digest is the content digest of
+    the upload. Concurrent requests for the same bytes share a single in-flight
+    analysis.
+    """
+    cache_key = result_cache.key(digest, analysis_type, analysis_model_version(analysis_type))
+    cached = await result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    async def analyze_and_cache():
+        analysis_result = await run_analysis(analyze_fn, image_data)
+        
+        # Demo fallbacks are random, so only real model output is cached
+        if not analysis_result.get("demo"):
+            await result_cache.set(cache_key, cacheable_result(analysis_result))
+        return analysis_result
+    
+    return await analysis_flights.do(cache_key, analyze_and_cache)
+
+# ----------------------------------------
+# Analysis pipeline
+# ----------------------------------------
+
+# Per-type analysis function and the placeholder image shown if saving the upload fails
+ANALYSIS_TYPES = {
+    "xray": {
+        "analyze": analyze_xray_image,
+        "placeholder_url": "https://images.unsplash.com/photo-1584555684040-bad07f46a21f"
+    },
+    "skin": {
+        "analyze": analyze_skin_image,
+        "placeholder_url": "https://images.unsplash.com/photo-1606501190025-f3ad6d3ea6ae"
+    },
+    "ct-scan": {
+        "analyze": analyze_ct_scan,
+        "placeholder_url": "https://images.unsplash.com/photo-1631563019676-dade0dbdb8fc"
+    }
+}
+
+def condition_locations(analysis_type: str, analysis_result: dict) -> Optional[dict]:
+    """Location data for heatmap visualization (X-ray and CT scans only).
+
+    X-ray locations come from the model's class activation maps. CT analysis
+    (and the X-ray demo fallback) has no model yet, so it keeps fixed positions.
+    """
+    if analysis_type == "skin":
+        return None
+    if "heatmaps" in analysis_result:
+        return heatmap_locations(analysis_result["heatmaps"], analysis_result["predictions"])
+    predictions = analysis_result["predictions"]
+    return {
+        pred["label"]: {
+            "x": 45,  # Default position
+            "y": (35 if pred["label"] == "Normal Findings" else 45) if analysis_type == "ct-scan" else 40,
+            "radius": 20,
+            "severity": "Moderate" if pred["confidence"] > 0.7 else ("Mild" if pred["confidence"] > 0.4 else "None")
+        } for pred in predictions if pred["confidence"] > 0.3
+    }
+
+async def save_upload(image_data: bytes, filename: str, placeholder_url: str) -> tuple:
+    """Save an in-memory image to the blob store, returning (url, blob key).
+
+    Hashing and writing run on a worker thread. Falls back to
+    (placeholder_url, None) if saving fails.
+    """
+    try:
+        upload = await asyncio.to_thread(store_bytes, image_data, filename)
+        return upload.url, upload.key
+    except Exception as e:
+        logger.error(f"Error saving image: {str(e)}")
+        return placeholder_url, None
+
+def build_analysis_doc(analysis_type: str, user_id: str, image_url: str, analysis_result: dict,
+                       image_key: Optional[str] = None) -> dict:
+    """MongoDB document recording one analysis, with a freshly generated id.
+
+    image_key is the blob store key of the image.
+    """
+    analysis_doc = {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "type": analysis_type,
+        "date": datetime.utcnow(),
+        "image_url": image_url,
+        "predictions": analysis_result["predictions"],
+        "recommendations": analysis_result["recommendations"]
+    }
+    if image_key is not None:
+        analysis_doc["image_key"] = image_key
+    if "heatmaps" in analysis_result:
+        analysis_doc["heatmaps"] = analysis_result["heatmaps"]
+    locations = condition_locations(analysis_type, analysis_result)
+    if locations is not None:
+        analysis_doc["condition_locations"] = locations
+    return analysis_doc
+
+def analysis_response(analysis_doc: dict) -> dict:
+    """API response for a freshly created analysis."""
+    return {
+        "id": str(analysis_doc["_id"]),
+        "type": analysis_doc["type"],
+        "predictions": analysis_doc["predictions"],
+        "recommendations": analysis_doc["recommendations"],
+        "image_url": analysis_doc["image_url"]
+    }
+
+async def persist_analyses(analysis_docs: List[dict]):
+    await store.analyses.insert_many(analysis_docs)
+
+# Analysis documents are written to MongoDB in batches after the response
+analysis_writer = WriteBehindQueue(persist_analyses)
+
+async def store_analyses(analysis_docs: List[dict]):
+    """Durably queue analyses for write-behind persistence, or insert them directly if queueing fails."""
+    if store is None or not analysis_docs:
+        return
+    if WRITE_BEHIND_ENABLED:
+        try:
+            await analysis_writer.enqueue_many(analysis_docs)
+            return
+        except Exception as e:
+            logger.error(f"Error queueing analyses, writing them directly: {str(e)}")
+    try:
+        await store.analyses.insert_many(analysis_docs)
+    except Exception as e:
+        logger.error(f"Error storing analyses in MongoDB: {str(e)}")
+
+async def find_analysis(analysis_id: str) -> Optional[dict]:
+    """An analysis by id, including one still queued for write-behind persistence."""
+    pending = analysis_writer.pending(analysis_id)
+    if pending is not None:
+        analysis = {key: value for key, value in pending.items() if key != "_id"}
+        analysis["id"] = analysis_id
+        return analysis
+    return await store.analyses.get(analysis_id)
+
+def pending_history(user_id: str, summary: bool) -> List[dict]:
+    """A user's analyses still queued for write-behind persistence, as history items, newest first."""
+    items = []
+    for doc in analysis_writer.pending_docs():
+        if doc["user_id"] != user_id:
+            continue
+        item = {key: value for key, value in doc.items()
+                if key != "_id" and (not summary or key in data_access.HISTORY_SUMMARY_FIELDS)}
+        item["id"] = str(doc["_id"])
+        items.append(item)
+    items.sort(key=lambda item: item["date"], reverse=True)
+    return items
+
+def history_settled_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=HISTORY_WATERMARK_LAG_SECONDS)
+
+def history_watermark(position: Optional[tuple] = None) -> str:
+    """Opaque ?since= watermark at an (updated_at, _id) position; by default where changes have settled."""
+    if position is None:
+        position = (history_settled_before(), data_access.MIN_OBJECT_ID)
+    return data_access.encode_cursor(position[0], str(position[1]))
+
+async def owns_image(user_id: str, key: str) -> bool:
+    """Whether one of the user's analyses references the upload, by its current or legacy URL."""
+    image_urls = (f"{UPLOAD_URL_PREFIX}{key}", f"{LEGACY_UPLOAD_URL_PREFIX}{key}")
+    if any(doc["user_id"] == user_id and doc["image_url"] in image_urls for doc in analysis_writer.pending_docs()):
+        return True
+    for image_url in image_urls:
+        if await store.analyses.owns_image(user_id, image_url):
+            return True
+    return False
+
+async def run_analysis_pipeline(analysis_type: str, upload: IngestedUpload, user_id: str) -> dict:
+    """Analyze a stored upload, record the analysis and return the API response."""
+    spec = ANALYSIS_TYPES[analysis_type]
+    
+    # Analyze the image straight from its stored blob (re-uploads of identical
+    # bytes are served from the cache). A failed analysis leaves the blob in
+    # place so a client retry is deduplicated against it.
+    analysis_result = await analyze_with_cache(
+        analysis_type, spec["analyze"], str(upload.path), upload.digest
+    )
+    
+    analysis_doc = build_analysis_doc(
+        analysis_type, user_id, upload.url, analysis_result, image_key=upload.key
+    )
+    
+    # Store in MongoDB if available
+    await store_analyses([analysis_doc])
+    
+    # Have the history thumbnail ready before it is first viewed
+    derivative_store.prefetch(upload.key)
+    
+    # Return the result
+    return analysis_response(analysis_doc)
+
+async def run_xray_batch_pipeline(entries: List[tuple], user_id: str) -> tuple:
+    """Analyze a chunk of (filename, image) X-ray entries, returning per-image results and new docs.
+
+    An image is either in-memory bytes (a ZIP member) or an already stored
+    IngestedUpload. Cached results are reused; the remaining images share one
+    executor job and one batched forward pass.
+    """
+    model_version = analysis_model_version("xray")
+    cache_keys = [
+        result_cache.key(image.digest if isinstance(image, IngestedUpload) else content_digest(image),
+                         "xray", model_version)
+        for _, image in entries
+    ]
+    analysis_results = [await result_cache.get(key) for key in cache_keys]
+    
+    misses = [i for i, result in enumerate(analysis_results) if result is None]
+    if misses:
+        images = [entries[i][1] for i in misses]
+        images = [str(image.path) if isinstance(image, IngestedUpload) else image for image in images]
+        analyzed = await run_analysis(analyze_xray_batch, images)
+        for i, analysis_result in zip(misses, analyzed):
+            analysis_results[i] = analysis_result
+            if "error" not in analysis_result and not analysis_result.get("demo"):
+                await result_cache.set(cache_keys[i], cacheable_result(analysis_result))
+    
+    results, docs = [], []
+    placeholder_url = ANALYSIS_TYPES["xray"]["placeholder_url"]
+    for (filename, image), analysis_result in zip(entries, analysis_results):
+        if "error" in analysis_result:
+            results.append({"filename": filename, "error": analysis_result["error"]})
+            continue
+        if isinstance(image, IngestedUpload):
+            image_url, image_key = image.url, image.key
+        else:
+            image_url, image_key = await save_upload(image, filename, placeholder_url)
+        analysis_doc = build_analysis_doc("xray", user_id, image_url, analysis_result, image_key=image_key)
+        docs.append(analysis_doc)
+        results.append({"filename": filename, **analysis_response(analysis_doc)})
+    return results, docs
+
+async def run_analysis_job(job) -> dict:
+    """Job queue handler: run the regular analysis pipeline for a submitted upload."""
+    return await run_analysis_pipeline(job.type, job.payload["upload"], job.user_id)
+
+job_queue = JobQueue(run_analysis_job)
+
+# ----------------------------------------
+# Lifecycle
+# ----------------------------------------
+
+@app.on_event("startup")
+async def connect_database():
+    """Connect the async data-access layer; failures leave the app in demo mode."""
+    global store
+    store = await data_access.connect(MONGO_URL, DB_NAME)
+    if store is not None:
+        await store.ensure_indexes()
+    if RESULT_CACHE_PERSISTENT and store is not None and store.db is not None:
+        await result_cache.attach(store.db.analysis_cache)
+    if WRITE_BEHIND_ENABLED and store is not None:
+        await analysis_writer.start()
+    if store is not None:
+        sync_pusher.start(store)
+
+@app.on_event("startup")
+def load_models():
+    """Load and warm up models and scan the tile cache in the background so the API can start serving."""
+    threading.Thread(target=model_registry.load_all, name="model-loader", daemon=True).start()
+    inference_executor.start()
+    job_queue.start()
+    tile_store.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    """Stop the analysis job workers."""
+    await job_queue.stop()
+
+@app.on_event("shutdown")
+def stop_worker_pools():
+    """Wait for in-flight inference, password hashing and blob uploads before the worker exits."""
+    inference_executor.shutdown()
+    xray_batcher.stop()
+    password_hasher.shutdown()
+    derivative_store.shutdown()
+    tile_store.shutdown()
+    blob_store.shutdown()
+
+@app.on_event("shutdown")
+async def stop_sync_pusher():
+    """Stop pushing to the upstream deployment; the next start resumes from its watermark."""
+    await sync_pusher.stop()
+
+@app.on_event("shutdown")
+async def flush_analysis_writer():
+    """Persist queued analyses; whatever cannot be written in time stays in the journal."""
+    await analysis_writer.stop()
+
+@app.on_event("shutdown")
+def disconnect_database():
+    """Close the MongoDB connection pool."""
+    if store is not None:
+        store.close()
+
 # ----------------------------------------
 # API Endpoints
 # ----------------------------------------
@@ -354,14 +811,40 @@ def analyze_ct_scan(image_data: bytes):
 @app.get("/api/health")
 def health_check():
     """Health check endpoint."""
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "ok",
+        "timestamp": datetime.now().isoformat(),
+        "models_ready": model_registry.is_ready(),
+        "models": model_registry.status(),
+        "inference": inference_executor.stats(),
+        "batching": {"xray": xray_batcher.stats()},
+        "result_cache": result_cache.stats(),
+        "single_flight": analysis_flights.stats(),
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "blob_store": blob_store.stats(),
+        "derivatives": derivative_store.stats(),
+        "tiles": tile_store.stats(),
+        "analysis_writer": analysis_writer.stats(),
+        "sync": sync_pusher.stats(),
+        "jobs": job_queue.stats()
+    }
+
+@app.get("/api/health/ready")
+def readiness_check():
+    """Readiness check: 503 until model weights are resident in memory."""
+    ready = model_registry.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "models": model_registry.status()}
+    )
 
 # Auth endpoints
 @app.post("/api/auth/register", response_model=Token)
 async def register(data: RegisterData):
     """Register a new user."""
     # Demo mode for MongoDB unavailability
-    if client is None or db is None:
+    if store is None:
         # Generate a demo user ID and token for testing
         user_id = str(uuid.uuid4())
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -379,15 +862,14 @@ async def register(data: RegisterData):
     
     # Normal flow with MongoDB
     # Check if email already exists
-    existing_user = db.users.find_one({"email": data.email})
-    if existing_user:
+    if await store.users.email_exists(data.email):
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
     
     # Create new user document
-    hashed_password = get_password_hash(data.password)
+    hashed_password = await get_password_hash(data.password)
     user_id = str(ObjectId())
     
     user_data = {
@@ -398,7 +880,7 @@ async def register(data: RegisterData):
         "created_at": datetime.utcnow()
     }
     
-    db.users.insert_one(user_data)
+    await store.users.create(user_data)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -418,7 +900,7 @@ async def register(data: RegisterData):
 async def login(data: LoginData):
     """Login and get access token."""
     # Demo mode for MongoDB unavailability
-    if client is None or db is None:
+    if store is None:
         # Generate a demo user ID and token for testing
         user_id = str(uuid.uuid4())
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -435,7 +917,7 @@ async def login(data: LoginData):
         }
     
     # Normal flow with MongoDB
-    user = authenticate_user(data.email, data.password)
+    user = await authenticate_user(data.email, data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -457,74 +939,29 @@ async def login(data: LoginData):
     }
 
 # Analysis endpoints
-@app.post("/api/analyze/xray")
-async def analyze_xray(
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
-):
-    """Analyze a chest X-ray image."""
+async def read_image_upload(file: UploadFile) -> IngestedUpload:
+    """Validate that an upload is an image and stream it to storage."""
     if not file.content_type.startswith("image/"):
         raise HTTPException(
             status_code=400,
             detail="File must be an image"
         )
-    
-    # Read the image file
-    image_data = await file.read()
-    
-    # Analyze the image
-    analysis_result = analyze_xray_image(image_data)
-    
-    # Generate a unique ID
-    analysis_id = str(uuid.uuid4())
-    
-    # Save the image if possible
     try:
-        file_extension = file.filename.split(".")[-1]
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-        with open(file_path, "wb") as f:
-            f.write(image_data)
-        image_url = f"/uploads/{unique_filename}"
-    except Exception as e:
+        return await ingest_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except OSError as e:
         logger.error(f"Error saving image: {str(e)}")
-        # Use a placeholder if saving fails
-        image_url = "https://images.unsplash.com/photo-1584555684040-bad07f46a21f"
-    
-    # Store in MongoDB if available
-    if client is not None and db is not None:
-        try:
-            analysis_doc = {
-                "_id": ObjectId(analysis_id),
-                "user_id": current_user.id,
-                "type": "xray",
-                "date": datetime.utcnow(),
-                "image_url": image_url,
-                "predictions": analysis_result["predictions"],
-                "recommendations": analysis_result["recommendations"],
-                # Add location data for heatmap visualization
-                "condition_locations": {
-                    pred["label"]: {
-                        "x": 45,  # Default position
-                        "y": 40,
-                        "radius": 20,
-                        "severity": "Moderate" if pred["confidence"] > 0.7 else ("Mild" if pred["confidence"] > 0.4 else "None")
-                    } for pred in analysis_result["predictions"] if pred["confidence"] > 0.3
-                }
-            }
-            
-            db.analyses.insert_one(analysis_doc)
-        except Exception as e:
-            logger.error(f"Error storing analysis in MongoDB: {str(e)}")
-    
-    # Return the result
-    return {
-        "id": analysis_id,
-        "type": "xray",
-        "predictions": analysis_result["predictions"],
-        "recommendations": analysis_result["recommendations"],
-        "image_url": image_url
-    }
+        raise HTTPException(status_code=500, detail="Could not store uploaded image")
+
+@app.post("/api/analyze/xray")
+async def analyze_xray(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Analyze a chest X-ray image."""
+    upload = await read_image_upload(file)
+    return await run_analysis_pipeline("xray", upload, current_user.id)
 
 @app.post("/api/analyze/skin")
 async def analyze_skin_lesion(
@@ -532,136 +969,131 @@ async def analyze_skin_lesion(
     current_user: User = Depends(get_current_user)
 ):
     """Analyze a skin lesion image."""
-    if not file.content_type.startswith("image/"):
+    upload = await read_image_upload(file)
+    return await run_analysis_pipeline("skin", upload, current_user.id)
+
+@app.post("/api/analyze/ct-scan")
+async def analyze_ct_scan_image(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Analyze a CT scan image."""
+    upload = await read_image_upload(file)
+    return await run_analysis_pipeline("ct-scan", upload, current_user.id)
+
+@app.post("/api/analyze/xray/batch")
+async def analyze_xray_batch_upload(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Analyze many chest X-rays in one request, given as several image files and/or ZIP archives.
+
+    Each plain image file is capped at MAX_UPLOAD_BYTES, and the batch as a
+    whole at BATCH_MAX_TOTAL_BYTES.
+    """
+    results, docs = [], []
+    try:
+        stored = await ingest_image_files(files)
+        entries = iter_image_entries(files, stored)
+        while True:
+            # Entries are read (and ZIP members inflated) off the event loop, a chunk at a time
+            chunk = await asyncio.to_thread(lambda: next(chunked(entries, BATCH_CHUNK_SIZE), None))
+            if chunk is None:
+                break
+            chunk_results, chunk_docs = await run_xray_batch_pipeline(chunk, current_user.id)
+            results.extend(chunk_results)
+            docs.extend(chunk_docs)
+    except (BatchTooLarge, UploadTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid ZIP archive: {str(e)}")
+    
+    if not results:
         raise HTTPException(
             status_code=400,
-            detail="File must be an image"
+            detail="No images found in upload"
         )
     
-    # Read the image file
-    image_data = await file.read()
-    
-    # Analyze the image
-    analysis_result = analyze_skin_image(image_data)
-    
-    # Generate a unique ID
-    analysis_id = str(uuid.uuid4())
-    
-    # Save the image if possible
-    try:
-        file_extension = file.filename.split(".")[-1]
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-        with open(file_path, "wb") as f:
-            f.write(image_data)
-        image_url = f"/uploads/{unique_filename}"
-    except Exception as e:
-        logger.error(f"Error saving image: {str(e)}")
-        # Use a placeholder if saving fails
-        image_url = "https://images.unsplash.com/photo-1606501190025-f3ad6d3ea6ae"
-    
-    # Store in MongoDB if available
-    if client is not None and db is not None:
-        try:
-            analysis_doc = {
-                "_id": ObjectId(analysis_id),
-                "user_id": current_user.id,
-                "type": "skin",
-                "date": datetime.utcnow(),
-                "image_url": image_url,
-                "predictions": analysis_result["predictions"],
-                "recommendations": analysis_result["recommendations"]
-            }
-            
-            db.analyses.insert_one(analysis_doc)
-        except Exception as e:
-            logger.error(f"Error storing analysis in MongoDB: {str(e)}")
+    # Store all analyses together if MongoDB is available
+    await store_analyses(docs)
     
-    # Return the result
     return {
-        "id": analysis_id,
-        "type": "skin",
-        "predictions": analysis_result["predictions"],
-        "recommendations": analysis_result["recommendations"],
-        "image_url": image_url
+        "count": len(results),
+        "succeeded": len(docs),
+        "failed": len(results) - len(docs),
+        "results": results
     }
 
-@app.post("/api/analyze/ct-scan")
-async def analyze_ct_scan_image(
+# Analysis job endpoints
+@app.post("/api/jobs/{analysis_type}", status_code=202)
+async def submit_analysis_job(
+    analysis_type: str,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Analyze a CT scan image."""
-    if not file.content_type.startswith("image/"):
+    """Queue an image for analysis and return a job id to poll, without waiting for the result."""
+    if analysis_type not in ANALYSIS_TYPES:
         raise HTTPException(
-            status_code=400,
-            detail="File must be an image"
+            status_code=404,
+            detail=f"Unknown analysis type: {analysis_type}"
         )
+    upload = await read_image_upload(file)
     
-    # Read the image file
-    image_data = await file.read()
-    
-    # Analyze the image
-    analysis_result = analyze_ct_scan(image_data)
-    
-    # Generate a unique ID
-    analysis_id = str(uuid.uuid4())
-    
-    # Save the image if possible
     try:
-        file_extension = file.filename.split(".")[-1]
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-        with open(file_path, "wb") as f:
-            f.write(image_data)
-        image_url = f"/uploads/{unique_filename}"
-    except Exception as e:
-        logger.error(f"Error saving image: {str(e)}")
-        # Use a placeholder if saving fails
-        image_url = "https://images.unsplash.com/photo-1631563019676-dade0dbdb8fc"
-    
-    # Store in MongoDB if available
-    if client is not None and db is not None:
-        try:
-            analysis_doc = {
-                "_id": ObjectId(analysis_id),
-                "user_id": current_user.id,
-                "type": "ct-scan",
-                "date": datetime.utcnow(),
-                "image_url": image_url,
-                "predictions": analysis_result["predictions"],
-                "recommendations": analysis_result["recommendations"],
-                # Add location data for heatmap visualization
-                "condition_locations": {
-                    pred["label"]: {
-                        "x": 45,  # Default position for brain scan
-                        "y": 35 if pred["label"] == "Normal Findings" else 45,
-                        "radius": 20,
-                        "severity": "Moderate" if pred["confidence"] > 0.7 else ("Mild" if pred["confidence"] > 0.4 else "None")
-                    } for pred in analysis_result["predictions"] if pred["confidence"] > 0.3
-                }
-            }
-            
-            db.analyses.insert_one(analysis_doc)
-        except Exception as e:
-            logger.error(f"Error storing analysis in MongoDB: {str(e)}")
+        job = job_queue.submit(analysis_type, current_user.id, {"upload": upload})
+    except JobQueueFull as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Analysis queue is full, please retry shortly",
+            headers={"Retry-After": "10"}
+        )
     
-    # Return the result
     return {
-        "id": analysis_id,
-        "type": "ct-scan",
-        "predictions": analysis_result["predictions"],
-        "recommendations": analysis_result["recommendations"],
-        "image_url": image_url
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}"
     }
 
+@app.get("/api/jobs/{job_id}")
+async def get_analysis_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=30),
+    current_user: User = Depends(get_current_user)
+):
+    """Get a job's status and result; with wait > 0, long-poll up to that many seconds for it to finish."""
+    job = job_queue.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(
+            status_code=404,
+            detail="Job not found"
+        )
+    
+    job = await job_queue.wait(job, wait)
+    return job.as_dict()
+
 @app.get("/api/user/history")
 async def get_user_history(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    view: str = Query("summary", pattern="^(summary|full)$"),
     current_user: User = Depends(get_current_user)
 ):
-    """Get user's analysis history."""
+    """Get one page of the user's analysis history, newest first.
+
+    The cursor for the next page is returned in the X-Next-Cursor header. The
+    default summary view omits recommendations and heatmap locations.
+
+    The first page also carries an X-History-Watermark header. Passing it
+    back as ?since= returns only the analyses stored or changed after it,
+    oldest change first, with the watermark of the last one. Changes from
+    the last few seconds are left for a later fetch, and some items may come
+    again; clients merge them by id. A full page means more changes follow.
+    """
     # Demo mode for MongoDB unavailability
-    if client is None or db is None:
+    if store is None:
         # Return demo data
         demo_history = [
             {
@@ -699,22 +1131,84 @@ async def get_user_history(
                 ]
             }
         ]
-        return demo_history
+        return [{**item, **variant_urls(item["image_url"])} for item in demo_history]
+    
+    if since is not None and cursor is not None:
+        raise HTTPException(status_code=400, detail="Use either cursor or since, not both")
     
     # Normal flow with MongoDB
+    next_cursor, position = None, None
     try:
-        analyses = db.analyses.find({"user_id": current_user.id}).sort("date", -1)
-        
-        result = []
-        for analysis in analyses:
-            analysis["id"] = str(analysis["_id"])
-            del analysis["_id"]
-            result.append(analysis)
-        
-        return result
+        if since is not None:
+            position = data_access.decode_cursor(since)
+            items = await store.analyses.list_changed(
+                current_user.id, position, limit, until=history_settled_before(), summary=(view == "summary")
+            )
+            if items:
+                position = (items[-1]["updated_at"], ObjectId(items[-1]["id"]))
+        else:
+            items, next_cursor = await store.analyses.list_page(
+                current_user.id, limit, cursor, summary=(view == "summary")
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error retrieving history: {str(e)}")
         return []
+    
+    # Analyses from the last few milliseconds may still be queued for writing
+    if cursor is None:
+        queued = pending_history(current_user.id, summary=(view == "summary"))
+        if queued:
+            queued_ids = {item["id"] for item in queued}
+            rest = [item for item in items if item["id"] not in queued_ids]
+            items = rest + queued if since is not None else queued + rest
+        response.headers["X-History-Watermark"] = history_watermark(position)
+    
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    for item in items:
+        item["image_url"] = upload_url(item.get("image_url"))
+    image_token = create_image_token(current_user.id)
+    return [{**item, **variant_urls(item.get("image_url"), image_token)} for item in items]
+
+async def export_history_docs(user_id: str):
+    """All of a user's analyses for export, including any still queued for write-behind persistence."""
+    queued = pending_history(user_id, summary=False)
+    for item in queued:
+        yield item
+    queued_ids = {item["id"] for item in queued}
+    try:
+        async for doc in store.analyses.iter_history(user_id, EXPORT_BATCH_SIZE):
+            if doc["id"] not in queued_ids:
+                yield doc
+    except Exception as e:
+        logger.error(f"Error exporting history: {str(e)}")
+        raise
+
+@app.get("/api/user/history/export")
+async def export_user_history(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    compress: bool = Query(False, alias="gzip"),
+    current_user: User = Depends(get_current_user)
+):
+    """Download the user's whole analysis history as NDJSON or CSV, newest first.
+
+    Rows are streamed from the database in batches, so memory use does not
+    depend on the size of the history. ?gzip=true returns a .gz file.
+    """
+    if store is None:
+        raise HTTPException(status_code=503, detail="Database is not available")
+    
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"zemedic-history-{datetime.utcnow():%Y%m%d}.{extension}"
+    if compress:
+        media_type, filename = "application/gzip", f"{filename}.gz"
+    return StreamingResponse(
+        export_stream(export_history_docs(current_user.id), export_format, compress=compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.get("/api/analysis/{analysis_id}")
 async def get_analysis_by_id(
@@ -723,7 +1217,7 @@ async def get_analysis_by_id(
 ):
     """Get a specific analysis by ID."""
     # Demo mode for MongoDB unavailability
-    if client is None or db is None or analysis_id.startswith("demo"):
+    if store is None or analysis_id.startswith("demo"):
         # Return demo data
         if analysis_id == "demo1":
             return {
@@ -787,7 +1281,7 @@ async def get_analysis_by_id(
     
     # Normal flow with MongoDB
     try:
-        analysis = db.analyses.find_one({"_id": ObjectId(analysis_id)})
+        analysis = await find_analysis(analysis_id)
         
         if not analysis:
             raise HTTPException(
@@ -801,9 +1295,7 @@ async def get_analysis_by_id(
                 detail="Not authorized to access this analysis"
             )
         
-        analysis["id"] = str(analysis["_id"])
-        del analysis["_id"]
-        
+        analysis["image_url"] = upload_url(analysis.get("image_url"))
         return analysis
     except Exception as e:
         logger.error(f"Error retrieving analysis: {str(e)}")
@@ -812,6 +1304,62 @@ async def get_analysis_by_id(
             detail=f"Error retrieving analysis: {str(e)}"
         )
 
+@app.get("/api/analysis/{analysis_id}/heatmap")
+async def get_analysis_heatmap(
+    analysis_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Class activation maps of an X-ray analysis's findings.
+
+    Each map is a uint8 grid at the model's feature resolution, base64
+    encoded, scaled so 255 is its peak. Analyses stored without maps get them
+    computed on first request and saved.
+    """
+    if store is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    try:
+        analysis = await find_analysis(analysis_id)
+    except Exception:
+        analysis = None
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    if analysis["user_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this analysis")
+    if analysis["type"] != "xray":
+        raise HTTPException(status_code=404, detail="Heatmaps are only available for X-ray analyses")
+    
+    heatmaps = analysis.get("heatmaps")
+    if heatmaps is None:
+        key = analysis.get("image_key") or upload_key(analysis.get("image_url"))
+        try:
+            path = await asyncio.to_thread(blob_store.local_path, key) if key else None
+        except ValueError:
+            path = None
+        if path is None:
+            raise HTTPException(status_code=404, detail="Analysis image not found")
+        
+        async def compute_heatmaps():
+            labels = [pred["label"] for pred in analysis["predictions"]]
+            computed = await run_analysis(functools.partial(xray_heatmaps, labels=labels), str(path))
+            if computed is not None:
+                await store.analyses.set_heatmaps(
+                    analysis_id, computed, heatmap_locations(computed, analysis["predictions"])
+                )
+            return computed
+        
+        heatmaps = await analysis_flights.do(("heatmap", analysis_id), compute_heatmaps)
+        if heatmaps is None:
+            raise HTTPException(status_code=503, detail="X-ray model is not available", headers={"Retry-After": "30"})
+    
+    return {
+        "analysis_id": analysis_id,
+        "size": heatmaps["size"],
+        "maps": [
+            {"label": pred["label"], "confidence": pred["confidence"], "data": heatmaps["maps"][pred["label"]]}
+            for pred in analysis["predictions"] if pred["label"] in heatmaps["maps"]
+        ]
+    }
+
 @app.get("/api/user/profile")
 async def get_user_profile(
     current_user: User = Depends(get_current_user)
@@ -835,19 +1383,213 @@ async def update_user_profile(
     if name:
         updates["name"] = name
     
-    if updates:
-        db.users.update_one(
-            {"_id": ObjectId(current_user.id)},
-            {"$set": updates}
-        )
-    
-    updated_user = db.users.find_one({"_id": ObjectId(current_user.id)})
-    updated_user["id"] = str(updated_user["_id"])
-    del updated_user["_id"]
+    updated_user = await store.users.update(current_user.id, updates)
+    user_cache.delete(current_user.id)
     del updated_user["hashed_password"]
     
     return updated_user
 
+@app.get("/api/uploads/{key:path}")
+async def get_upload(
+    key: str,
+    request: Request,
+    variant: Optional[str] = Query(None),
+    current_user: User = Depends(get_image_user)
+):
+    """Serve an uploaded image to the user whose analysis references it.
+
+    ?variant=thumbnail or preview returns a downscaled copy instead of the original.
+    """
+    if variant is not None and variant not in DERIVATIVE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown image variant: {variant}")
+    
+    # Demo mode has no analysis records to check ownership against
+    if store is not None and not image_access_cache.get((current_user.id, key)):
+        if not await owns_image(current_user.id, key):
+            raise HTTPException(status_code=404, detail="Image not found")
+        image_access_cache.set((current_user.id, key), True)
+    
+    if variant is not None:
+        name = derivative_store.name(key, variant)
+        cached = not_modified(request, name)
+        if cached is not None:
+            return cached
+        try:
+            path = await derivative_store.get(key, variant)
+        except ValueError:
+            path = None
+        except Exception as e:
+            logger.error(f"Error generating {variant} for {key}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error generating image preview")
+        if path is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return blob_file_response(request, path, name)
+    
+    try:
+        path = await asyncio.to_thread(blob_store.local_path, key)
+    except ValueError:
+        path = None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return blob_file_response(request, path, key)
+
+async def analysis_image_key(analysis_id: str, current_user) -> str:
+    """Blob key of the uploaded image behind one of the user's analyses (404 otherwise)."""
+    if store is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    cache_key = (current_user.id, "analysis", analysis_id)
+    key = image_access_cache.get(cache_key)
+    if key is not None:
+        return key
+    
+    try:
+        analysis = await find_analysis(analysis_id)
+    except Exception:
+        analysis = None
+    key = upload_key(analysis.get("image_url")) if analysis is not None else None
+    if key is None or analysis["user_id"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    key = analysis.get("image_key") or key
+    image_access_cache.set(cache_key, key)
+    return key
+
+@app.get("/api/images/{analysis_id}/tiles")
+async def get_image_tiles_descriptor(
+    analysis_id: str,
+    current_user: User = Depends(get_image_user)
+):
+    """DZI descriptor of an analysis image for deep-zoom viewers."""
+    key = await analysis_image_key(analysis_id, current_user)
+    try:
+        info = await tile_store.info(key)
+    except Exception as e:
+        logger.error(f"Error building tile pyramid for {key}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error preparing image tiles")
+    if info is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return dzi_descriptor(info, f"/api/images/{analysis_id}/tiles/")
+
+@app.get("/api/images/{analysis_id}/tiles/{level}/{tile}")
+async def get_image_tile(
+    analysis_id: str,
+    level: int,
+    tile: str,
+    request: Request,
+    current_user: User = Depends(get_image_user)
+):
+    """One JPEG tile of an analysis image's deep-zoom pyramid, addressed as {x}_{y}[.jpeg]."""
+    try:
+        x, y = (int(part) for part in tile.split(".", 1)[0].split("_"))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    key = await analysis_image_key(analysis_id, current_user)
+    
+    name = tile_store.tile_name(key, level, x, y)
+    cached = not_modified(request, name)
+    if cached is not None:
+        return cached
+    try:
+        path = await tile_store.tile(key, level, x, y)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    except Exception as e:
+        logger.error(f"Error rendering tile {level}/{x}_{y} for {key}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error rendering image tile")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return blob_file_response(request, path, name)
+
+def sync_node(
+    x_sync_token: Optional[str] = Header(None),
+    x_sync_node: Optional[str] = Header(None)
+) -> str:
+    """The pushing node's id, once its shared sync token checks out."""
+    if not SYNC_TOKEN:
+        raise HTTPException(status_code=404, detail="Sync is not enabled")
+    if not token_valid(x_sync_token):
+        raise HTTPException(status_code=401, detail="Invalid sync token")
+    if not x_sync_node:
+        raise HTTPException(status_code=400, detail="Missing X-Sync-Node header")
+    if store is None:
+        raise HTTPException(status_code=503, detail="Database is not available")
+    return x_sync_node
+
+@app.get("/api/sync/state")
+async def get_sync_state(node_id: str = Depends(sync_node)):
+    """Highest sequence value applied from the node, where its next push resumes."""
+    return {"node_id": node_id, "last_seq": await store.sync.last_seq(node_id)}
+
+@app.post("/api/sync/blobs/missing")
+async def get_missing_blobs(data: SyncBlobKeys, node_id: str = Depends(sync_node)):
+    """Which of the given content-addressed blob keys this deployment does not have yet."""
+    for key in data.keys:
+        if parse_blob_key(key) is None:
+            raise HTTPException(status_code=400, detail=f"Invalid blob key: {key}")
+    exists = await asyncio.gather(*(asyncio.to_thread(blob_store.exists, key) for key in data.keys))
+    return {"missing": [key for key, found in zip(data.keys, exists) if not found]}
+
+@app.put("/api/sync/blobs/{key:path}")
+async def put_sync_blob(key: str, request: Request, node_id: str = Depends(sync_node)):
+    """Store a blob pushed by a node; its content must hash to the digest in its key."""
+    parsed = parse_blob_key(key)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid blob key: {key}")
+    if await asyncio.to_thread(blob_store.exists, key):
+        return {"key": key, "created": False}
+    try:
+        ref = await blob_store.put_stream(RequestReader(request), parsed[1], MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if ref.key != key:
+        if ref.created:
+            await asyncio.to_thread(blob_store.delete, ref.key)
+        raise HTTPException(status_code=400, detail="Blob content does not match its key")
+    return {"key": key, "created": ref.created}
+
+@app.post("/api/sync/batches")
+async def post_sync_batch(request: Request, node_id: str = Depends(sync_node)):
+    """Apply a node's NDJSON batch of users and analyses (gzipped if Content-Encoding says so).
+
+    Analyses are upserted by id and the node's watermark only moves forward,
+    so a batch that is applied twice changes nothing.
+    """
+    try:
+        body = await read_body(request, SYNC_MAX_BATCH_BYTES)
+        users, analyses = decode_batch(body, request.headers.get("content-encoding", "").lower() == "gzip")
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except SyncBatchInvalid as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    created = 0
+    for user in users:
+        if await store.users.create_if_absent(user):
+            created += 1
+        elif await store.users.get_by_id(str(user["_id"])) is None:
+            logger.warning(f"Synced user {user['_id']} from node {node_id} conflicts with an existing email")
+    if not analyses:
+        return {"users_created": created, "analyses": 0, "last_seq": await store.sync.last_seq(node_id)}
+    
+    # Upserting restamps the documents with this deployment's own sequence
+    batch_seq = max(doc["sync_seq"] for doc in analyses)
+    await store.analyses.upsert_many(analyses)
+    last_seq = await store.sync.advance(node_id, batch_seq)
+    return {"users_created": created, "analyses": len(analyses), "last_seq": last_seq}
+
+@app.post("/api/sync/push")
+async def push_sync(x_sync_token: Optional[str] = Header(None)):
+    """Push this node's pending changes upstream now instead of waiting for the next round."""
+    if not token_valid(x_sync_token):
+        raise HTTPException(status_code=401, detail="Invalid sync token")
+    if not sync_pusher.enabled or store is None:
+        raise HTTPException(status_code=404, detail="Sync is not configured on this node")
+    try:
+        return await sync_pusher.run_once()
+    except Exception as e:
+        logger.error(f"Error pushing to {sync_pusher.upstream_url}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Error pushing to the upstream deployment")
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -0,0 +1,378 @@
+import os
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+from data_access import HISTORY_SUMMARY_FIELDS, encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Embedded storage configuration
+SQLITE_READERS = int(os.environ.get("SQLITE_READERS", "4"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    image_url TEXT,
+    doc TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_nodes (
+    node_id TEXT PRIMARY KEY,
+    last_seq INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS user_history ON analyses (user_id, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS user_images ON analyses (user_id, image_url);
+CREATE INDEX IF NOT EXISTS user_changes ON analyses (user_id, updated_at, id);
+CREATE INDEX IF NOT EXISTS sync_changes ON analyses (seq);
+"""
+
+
+def _date_key(date: datetime) -> str:
+    """Fixed-width timestamp, so text order matches time order.
+
+    Truncated to milliseconds, the precision stored documents (and Mongo)
+    keep, so cursors built from a document's date match its column.
+    """
+    return date.strftime("%Y-%m-%dT%H:%M:%S.") + f"{date.microsecond // 1000:03d}"
+
+
+def _dumps(doc: dict) -> str:
+    return json_util.dumps(doc)
+
+
+def _next_seq(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM analyses").fetchone()[0]
+
+
+def _summarize(docs: List[dict]) -> List[dict]:
+    return [{key: value for key, value in doc.items() if key == "id" or key in HISTORY_SUMMARY_FIELDS} for doc in docs]
+
+
+def _load(row) -> Optional[dict]:
+    """Decode a stored document, exposing `_id` as the string `id` like the Mongo repositories."""
+    if row is None:
+        return None
+    doc = json_util.loads(row[0])
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+class SQLiteDatabase:
+    """One SQLite file in WAL mode, used from worker threads.
+
+    Writes go through a single thread and connection, as SQLite allows only
+    one writer at a time. Reads run on a small pool, each thread with its
+    own connection; in WAL mode they proceed alongside the writer.
+    """
+
+    def __init__(self, path: Path, readers: int = SQLITE_READERS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="sqlite-reader")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps committed transactions safe across a crash with NORMAL;
+            # only the last commits before a power loss can roll back.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    async def read(self, fn: Callable[[sqlite3.Connection], object]):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, lambda: fn(self._connection()))
+
+    async def write(self, fn: Callable[[sqlite3.Connection], object]):
+        def run():
+            conn = self._connection()
+            with conn:
+                return fn(conn)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, run)
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+class SQLiteUserRepository:
+    """Users stored in SQLite, with the same interface as UserRepository."""
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        return _load(await self.db.read(
+            lambda conn: conn.execute("SELECT doc FROM users WHERE email = ?", (email,)).fetchone()
+        ))
+
+    async def get_by_id(self, user_id: str) -> Optional[dict]:
+        return _load(await self.db.read(
+            lambda conn: conn.execute("SELECT doc FROM users WHERE id = ?", (user_id,)).fetchone()
+        ))
+
+    async def email_exists(self, email: str) -> bool:
+        row = await self.db.read(
+            lambda conn: conn.execute("SELECT 1 FROM users WHERE email = ? LIMIT 1", (email,)).fetchone()
+        )
+        return row is not None
+
+    async def create(self, user_doc: dict):
+        user_doc.setdefault("_id", ObjectId())
+        await self.db.write(lambda conn: conn.execute(
+            "INSERT INTO users (id, email, doc) VALUES (?, ?, ?)",
+            (str(user_doc["_id"]), user_doc["email"], _dumps(user_doc))
+        ))
+
+    async def update(self, user_id: str, updates: dict) -> Optional[dict]:
+        if updates:
+            def apply(conn):
+                row = conn.execute("SELECT doc FROM users WHERE id = ?", (user_id,)).fetchone()
+                if row is None:
+                    return
+                doc = json_util.loads(row[0])
+                doc.update(updates)
+                conn.execute("UPDATE users SET email = ?, doc = ? WHERE id = ?", (doc["email"], _dumps(doc), user_id))
+            await self.db.write(apply)
+        return await self.get_by_id(user_id)
+
+    async def create_if_absent(self, user_doc: dict) -> bool:
+        """Insert a user replicated from another node; False if its id or email is already taken."""
+        cursor = await self.db.write(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO users (id, email, doc) VALUES (?, ?, ?)",
+            (str(user_doc["_id"]), user_doc["email"], _dumps(user_doc))
+        ))
+        return cursor.rowcount > 0
+
+
+class SQLiteAnalysisRepository:
+    """Analyses stored in SQLite, with the same interface as AnalysisRepository.
+
+    Each analysis is kept as its JSON document, with the fields the history,
+    detail and ownership queries filter on copied into indexed columns. The
+    change sequence is MAX(seq) + 1, safe because all writes share one
+    connection and thread.
+    """
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    async def insert(self, analysis_doc: dict):
+        await self.insert_many([analysis_doc])
+
+    async def insert_many(self, analysis_docs: List[dict]):
+        """Insert documents in one transaction; ids that already exist are skipped, not errors."""
+        def apply(conn):
+            seq = _next_seq(conn)
+            now = datetime.utcnow()
+            for doc in analysis_docs:
+                doc["sync_seq"] = seq
+                doc["updated_at"] = now
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO analyses (id, user_id, date, image_url, doc, seq, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(doc["_id"]), doc["user_id"], _date_key(doc["date"]), doc.get("image_url"), _dumps(doc),
+                     seq, _date_key(now))
+                )
+                if cursor.rowcount:
+                    seq += 1
+        await self.db.write(apply)
+
+    async def get(self, analysis_id: str) -> Optional[dict]:
+        return _load(await self.db.read(
+            lambda conn: conn.execute("SELECT doc FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        ))
+
+    async def upsert_many(self, analysis_docs: List[dict]):
+        """Insert or replace documents by id, e.g. ones replicated from another node."""
+        def apply(conn):
+            seq = _next_seq(conn)
+            now = datetime.utcnow()
+            for doc in analysis_docs:
+                analysis_id = str(doc["_id"])
+                doc["sync_seq"] = seq
+                doc["updated_at"] = now
+                conn.execute(
+                    "INSERT INTO analyses (id, user_id, date, image_url, doc, seq, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET user_id = excluded.user_id, "
+                    "date = excluded.date, image_url = excluded.image_url, doc = excluded.doc, "
+                    "seq = excluded.seq, updated_at = excluded.updated_at",
+                    (analysis_id, doc["user_id"], _date_key(doc["date"]), doc.get("image_url"), _dumps(doc),
+                     seq, _date_key(now))
+                )
+                seq += 1
+        if analysis_docs:
+            await self.db.write(apply)
+
+    async def set_heatmaps(self, analysis_id: str, heatmaps: dict, condition_locations: dict):
+        def apply(conn):
+            row = conn.execute("SELECT doc FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+            if row is None:
+                return
+            seq = _next_seq(conn)
+            now = datetime.utcnow()
+            doc = json_util.loads(row[0])
+            doc["heatmaps"] = heatmaps
+            doc["condition_locations"] = condition_locations
+            doc["sync_seq"] = seq
+            doc["updated_at"] = now
+            conn.execute("UPDATE analyses SET doc = ?, seq = ?, updated_at = ? WHERE id = ?",
+                         (_dumps(doc), seq, _date_key(now), analysis_id))
+        await self.db.write(apply)
+
+    async def changes_since(self, seq: int, limit: int) -> List[dict]:
+        """Documents inserted or changed after sequence value seq, in sequence order, with their raw `_id`."""
+        rows = await self.db.read(lambda conn: conn.execute(
+            "SELECT doc FROM analyses WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+        ).fetchall())
+        return [json_util.loads(row[0]) for row in rows]
+
+    async def owns_image(self, user_id: str, image_url: str) -> bool:
+        row = await self.db.read(lambda conn: conn.execute(
+            "SELECT 1 FROM analyses WHERE user_id = ? AND image_url = ? LIMIT 1", (user_id, image_url)
+        ).fetchone())
+        return row is not None
+
+    async def list_page(self, user_id: str, limit: int, cursor: Optional[str] = None,
+                        summary: bool = True) -> Tuple[List[dict], Optional[str]]:
+        """One page of a user's analyses, newest first, using keyset pagination on (date, id)."""
+        sql = "SELECT doc FROM analyses WHERE user_id = ?"
+        params = [user_id]
+        if cursor is not None:
+            date, last_id = decode_cursor(cursor)
+            sql += " AND (date < ? OR (date = ? AND id < ?))"
+            params += [_date_key(date), _date_key(date), str(last_id)]
+        sql += " ORDER BY date DESC, id DESC LIMIT ?"
+        # Fetch one extra row to learn whether another page follows.
+        params.append(limit + 1)
+
+        rows = await self.db.read(lambda conn: conn.execute(sql, params).fetchall())
+        docs = [_load(row) for row in rows]
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["date"], docs[-1]["id"])
+        if summary:
+            docs = _summarize(docs)
+        return docs, next_cursor
+
+    async def iter_history(self, user_id: str, batch_size: int) -> AsyncIterator[dict]:
+        """Every analysis of a user, newest first, read one keyset page of batch_size at a time."""
+        cursor = None
+        while True:
+            docs, cursor = await self.list_page(user_id, batch_size, cursor, summary=False)
+            for doc in docs:
+                yield doc
+            if cursor is None:
+                return
+
+    async def list_changed(self, user_id: str, since: Tuple[datetime, ObjectId], limit: int,
+                           until: Optional[datetime] = None, summary: bool = True) -> List[dict]:
+        """Up to limit of a user's analyses stored or changed after since and no later than until,
+        ordered by (updated_at, id)."""
+        updated_at, last_id = since
+        sql = "SELECT doc FROM analyses WHERE user_id = ? AND (updated_at > ? OR (updated_at = ? AND id > ?))"
+        params = [user_id, _date_key(updated_at), _date_key(updated_at), str(last_id)]
+        if until is not None:
+            sql += " AND updated_at <= ?"
+            params.append(_date_key(until))
+        sql += " ORDER BY updated_at, id LIMIT ?"
+        params.append(limit)
+        rows = await self.db.read(lambda conn: conn.execute(sql, params).fetchall())
+        docs = [_load(row) for row in rows]
+        return _summarize(docs) if summary else docs
+
+    async def ensure_indexes(self):
+        await self.db.write(lambda conn: conn.executescript(INDEXES))
+
+
+class SQLiteSyncStateRepository:
+    """Per-node sync watermarks stored in SQLite, with the same interface as SyncStateRepository."""
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    async def last_seq(self, node_id: str) -> int:
+        row = await self.db.read(lambda conn: conn.execute(
+            "SELECT last_seq FROM sync_nodes WHERE node_id = ?", (node_id,)
+        ).fetchone())
+        return row[0] if row else 0
+
+    async def advance(self, node_id: str, seq: int) -> int:
+        """Raise a node's watermark to seq (never lower it), returning the new value."""
+        def apply(conn):
+            conn.execute(
+                "INSERT INTO sync_nodes (node_id, last_seq, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(node_id) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq), "
+                "updated_at = excluded.updated_at",
+                (node_id, seq, _date_key(datetime.utcnow()))
+            )
+            return conn.execute("SELECT last_seq FROM sync_nodes WHERE node_id = ?", (node_id,)).fetchone()[0]
+        return await self.db.write(apply)
+
+
+class SQLiteDataStore:
+    """Embedded storage for nodes without a MongoDB server, e.g. offline booths.
+
+    Offers the same repositories as DataStore. There is no Mongo database
+    handle, so features that need one (the persistent result cache) stay off.
+    """
+
+    db = None
+
+    def __init__(self, path: Path):
+        self.database = SQLiteDatabase(path)
+        self.users = SQLiteUserRepository(self.database)
+        self.analyses = SQLiteAnalysisRepository(self.database)
+        self.sync = SQLiteSyncStateRepository(self.database)
+
+    async def create_schema(self):
+        await self.database.write(lambda conn: conn.executescript(SCHEMA))
+
+    async def ensure_indexes(self):
+        await self.analyses.ensure_indexes()
+
+    def close(self):
+        self.database.close()
+
+
+async def connect_sqlite(path: Path) -> SQLiteDataStore:
+    store = SQLiteDataStore(path)
+    await store.create_schema()
+    logger.info(f"Using embedded SQLite storage at {path}")
+    return store
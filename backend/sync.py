@@ -0,0 +1,301 @@
+import os
+import re
+import hmac
+import gzip
+import zlib
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+
+import httpx
+from bson import json_util
+from bson.objectid import ObjectId
+from fastapi import Request
+
+from blob_store import BlobStore, UploadTooLarge
+from uploads import blob_store
+
+logger = logging.getLogger(__name__)
+
+# Sync configuration. A node pushes to SYNC_UPSTREAM_URL when it is set; a
+# deployment accepts pushes when SYNC_TOKEN is set. Both sides share the token.
+SYNC_TOKEN = os.environ.get("SYNC_TOKEN", "")
+SYNC_UPSTREAM_URL = os.environ.get("SYNC_UPSTREAM_URL", "").rstrip("/")
+# Must stay stable for the node's database; a node that starts over with an
+# empty database needs a new id, as its sequence restarts from 1
+SYNC_NODE_ID = os.environ.get("SYNC_NODE_ID") or socket.gethostname()
+SYNC_INTERVAL_SECONDS = float(os.environ.get("SYNC_INTERVAL_SECONDS", "300"))
+SYNC_BATCH_SIZE = int(os.environ.get("SYNC_BATCH_SIZE", "200"))
+SYNC_COMPRESSION_LEVEL = int(os.environ.get("SYNC_COMPRESSION_LEVEL", "6"))
+SYNC_MAX_BATCH_BYTES = int(os.environ.get("SYNC_MAX_BATCH_BYTES", str(64 * 1024 * 1024)))
+SYNC_TIMEOUT_SECONDS = float(os.environ.get("SYNC_TIMEOUT_SECONDS", "60"))
+# Changes younger than this are left for the next batch, so a write that
+# reserved a lower sequence value but has not committed yet is not skipped
+SYNC_SETTLE_SECONDS = float(os.environ.get("SYNC_SETTLE_SECONDS", "5"))
+
+SYNC_TOKEN_HEADER = "X-Sync-Token"
+SYNC_NODE_HEADER = "X-Sync-Node"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MAX_MISSING_KEYS = 1000
+
+_BLOB_KEY = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{32})\.([A-Za-z0-9]{1,8})$")
+
+
+class SyncBatchInvalid(Exception):
+    """Raised for a sync batch that cannot be decoded or applied."""
+
+
+def token_valid(token: Optional[str]) -> bool:
+    return bool(SYNC_TOKEN) and token is not None and hmac.compare_digest(token, SYNC_TOKEN)
+
+
+def parse_blob_key(key: str) -> Optional[Tuple[str, str]]:
+    """(digest, extension) of a well-formed content-addressed blob key, else None."""
+    match = _BLOB_KEY.match(key)
+    if match is None or not match.group(3).startswith(match.group(1) + match.group(2)):
+        return None
+    return match.group(3), match.group(4)
+
+
+def encode_batch(users: List[dict], analyses: List[dict]) -> bytes:
+    """Gzipped NDJSON, one {"kind", "doc"} record per line, users first."""
+    lines = [json_util.dumps({"kind": "user", "doc": doc}) for doc in users]
+    lines += [json_util.dumps({"kind": "analysis", "doc": doc}) for doc in analyses]
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=SYNC_COMPRESSION_LEVEL)
+
+
+def decode_batch(body: bytes, compressed: bool, max_bytes: int = SYNC_MAX_BATCH_BYTES) -> Tuple[List[dict], List[dict]]:
+    """Inverse of encode_batch(), returning (users, analyses); raises SyncBatchInvalid."""
+    if compressed:
+        inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            data = inflater.decompress(body, max_bytes + 1)
+        except zlib.error as e:
+            raise SyncBatchInvalid(f"Batch is not valid gzip: {str(e)}")
+        if len(data) > max_bytes or inflater.unconsumed_tail:
+            raise SyncBatchInvalid(f"Batch exceeds {max_bytes} bytes uncompressed")
+        if not inflater.eof:
+            raise SyncBatchInvalid("Batch is truncated")
+        body = data
+
+    users, analyses = [], []
+    for number, line in enumerate(body.decode("utf-8", errors="replace").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json_util.loads(line)
+            kind, doc = record["kind"], record["doc"]
+        except (ValueError, KeyError, TypeError):
+            raise SyncBatchInvalid(f"Unreadable record on line {number}")
+        if not isinstance(doc, dict) or not isinstance(doc.get("_id"), ObjectId):
+            raise SyncBatchInvalid(f"Record on line {number} has no document id")
+        if kind == "user" and isinstance(doc.get("email"), str):
+            users.append(doc)
+        elif kind == "analysis" and isinstance(doc.get("user_id"), str) and isinstance(doc.get("date"), datetime) \
+                and isinstance(doc.get("sync_seq"), int):
+            analyses.append(doc)
+        else:
+            raise SyncBatchInvalid(f"Invalid {kind} record on line {number}")
+    return users, analyses
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, refusing to buffer more than max_bytes."""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f"Request body exceeds {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class RequestReader:
+    """Gives a raw request body the async read() that BlobStore.put_stream() expects."""
+
+    def __init__(self, request: Request):
+        self._stream = request.stream()
+        self._buffer = b""
+        self._done = False
+
+    async def read(self, size: int) -> bytes:
+        while len(self._buffer) < size and not self._done:
+            try:
+                self._buffer += await self._stream.__anext__()
+            except StopAsyncIteration:
+                self._done = True
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class SyncPusher:
+    """Pushes this node's analyses, and the image blobs they reference, to an upstream deployment.
+
+    Changes are read in sequence order from the node's store. Each round
+    asks upstream for the highest sequence value it has applied from this
+    node, so an interrupted push resumes where upstream left off. A batch
+    first uploads only the blobs upstream reports missing (keys are content
+    hashes), then posts the analyses, and the users they belong to, as one
+    gzipped NDJSON body. Upstream applies batches as upserts by id, so one
+    that is sent twice after a lost response changes nothing.
+    """
+
+    def __init__(self, blobs: BlobStore, upstream_url: str = SYNC_UPSTREAM_URL, node_id: str = SYNC_NODE_ID,
+                 token: str = SYNC_TOKEN, batch_size: int = SYNC_BATCH_SIZE,
+                 interval: float = SYNC_INTERVAL_SECONDS, settle: float = SYNC_SETTLE_SECONDS,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.blobs = blobs
+        self.upstream_url = upstream_url
+        self.node_id = node_id
+        self.token = token
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.settle = settle
+        self.transport = transport
+        self.store = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.rounds = 0
+        self.failures = 0
+        self.batches = 0
+        self.analyses = 0
+        self.blobs_uploaded = 0
+        self.bytes_sent = 0
+        self.last_seq = 0
+        self.last_success: Optional[datetime] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.upstream_url)
+
+    def start(self, store):
+        """Start pushing periodically from the given data store, if an upstream is configured."""
+        self.store = store
+        self._lock = asyncio.Lock()
+        if self.enabled and self._task is None:
+            logger.info(f"Syncing analyses to {self.upstream_url} as node {self.node_id}")
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error syncing to {self.upstream_url}, retrying in {self.interval:.0f}s: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> dict:
+        """Push everything not yet applied upstream; returns what this round sent."""
+        if not self.enabled or self.store is None:
+            raise RuntimeError("Sync is not configured")
+        async with self._lock:
+            self.rounds += 1
+            try:
+                return await self._push()
+            except Exception:
+                self.failures += 1
+                raise
+
+    async def _push(self) -> dict:
+        sent = {"batches": 0, "analyses": 0, "blobs": 0}
+        headers = {SYNC_TOKEN_HEADER: self.token, SYNC_NODE_HEADER: self.node_id}
+        async with httpx.AsyncClient(base_url=self.upstream_url, headers=headers, timeout=SYNC_TIMEOUT_SECONDS,
+                                     transport=self.transport) as client:
+            response = await client.get("/api/sync/state")
+            response.raise_for_status()
+            last_seq = response.json()["last_seq"]
+            while True:
+                docs = self._settled(await self.store.analyses.changes_since(last_seq, self.batch_size))
+                if not docs:
+                    break
+                sent["blobs"] += await self._push_blobs(client, docs)
+                body = encode_batch(await self._users(docs), docs)
+                response = await client.post("/api/sync/batches", content=body, headers={
+                    "Content-Type": NDJSON_MEDIA_TYPE, "Content-Encoding": "gzip",
+                })
+                response.raise_for_status()
+                last_seq = response.json()["last_seq"]
+                sent["batches"] += 1
+                sent["analyses"] += len(docs)
+                self.batches += 1
+                self.analyses += len(docs)
+                self.bytes_sent += len(body)
+                if len(docs) < self.batch_size:
+                    break
+        self.last_seq = last_seq
+        self.last_success = datetime.utcnow()
+        return {**sent, "last_seq": last_seq}
+
+    def _settled(self, docs: List[dict]) -> List[dict]:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.settle)
+        for i, doc in enumerate(docs):
+            if doc["updated_at"] > cutoff:
+                return docs[:i]
+        return docs
+
+    async def _users(self, docs: List[dict]) -> List[dict]:
+        users = []
+        for user_id in sorted({doc["user_id"] for doc in docs}):
+            user = await self.store.users.get_by_id(user_id)
+            if user is not None:
+                user["_id"] = ObjectId(user.pop("id"))
+                users.append(user)
+        return users
+
+    async def _push_blobs(self, client: httpx.AsyncClient, docs: List[dict]) -> int:
+        keys = sorted({doc["image_key"] for doc in docs if doc.get("image_key")})
+        if not keys:
+            return 0
+        response = await client.post("/api/sync/blobs/missing", json={"keys": keys})
+        response.raise_for_status()
+        uploaded = 0
+        for key in response.json()["missing"]:
+            if not await asyncio.to_thread(self.blobs.exists, key):
+                logger.warning(f"Blob {key} is missing locally; its analyses sync without the image")
+                continue
+            response = await client.put(f"/api/sync/blobs/{key}", content=self._read_blob(key),
+                                        headers={"Content-Type": "application/octet-stream"})
+            response.raise_for_status()
+            uploaded += 1
+        self.blobs_uploaded += uploaded
+        return uploaded
+
+    async def _read_blob(self, key: str) -> AsyncIterator[bytes]:
+        chunks = self.blobs.iter_chunks(key)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            chunks.close()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "node_id": self.node_id,
+            "accepting": bool(SYNC_TOKEN),
+            "rounds": self.rounds,
+            "failures": self.failures,
+            "batches": self.batches,
+            "analyses": self.analyses,
+            "blobs_uploaded": self.blobs_uploaded,
+            "bytes_sent": self.bytes_sent,
+            "last_seq": self.last_seq,
+            "last_success": self.last_success.isoformat() if self.last_success else None,
+        }
+
+
+sync_pusher = SyncPusher(blob_store)
@@ -0,0 +1,392 @@
+import os
+import json
+import math
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from blob_store import BlobStore
+from image_decode import HIGH_BIT_DEPTH_MODES
+from singleflight import SingleFlight
+from uploads import UPLOAD_DIR, blob_store
+
+logger = logging.getLogger(__name__)
+
+# Deep-zoom tiling configuration
+TILE_SIZE = int(os.environ.get("TILE_SIZE", "256"))
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", "1"))
+TILE_QUALITY = int(os.environ.get("TILE_QUALITY", "85"))
+TILE_WORKERS = int(os.environ.get("TILE_WORKERS", "2"))
+TILE_CACHE_MAX_BYTES = int(os.environ.get("TILE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+TILE_FORMAT = "jpeg"
+DZI_NAMESPACE = "http://schemas.microsoft.com/deepzoom/2008"
+
+# Rows of the source image copied, and of each level reduced, per step while building a pyramid
+_BUILD_STRIP_ROWS = 512
+
+_EXIF_ORIENTATION = 0x0112
+
+
+def _transpose(raster: np.ndarray) -> np.ndarray:
+    return raster.transpose(1, 0, 2)
+
+
+# View of an upright raster, indexed (row, column) in the stored image's own
+# orientation, for each EXIF orientation. Writing the stored rows through it
+# applies the rotation/mirroring that ImageOps.exif_transpose() would.
+_ORIENTATION_VIEWS = {
+    1: lambda raster: raster,
+    2: lambda raster: raster[:, ::-1],
+    3: lambda raster: raster[::-1, ::-1],
+    4: lambda raster: raster[::-1],
+    5: lambda raster: _transpose(raster),
+    6: lambda raster: _transpose(raster)[::-1],
+    7: lambda raster: _transpose(raster)[::-1, ::-1],
+    8: lambda raster: _transpose(raster)[:, ::-1],
+}
+
+
+class PyramidInfo:
+    """Size of an image and the DZI levels derived from it.
+
+    Level ``max_level`` is full resolution; each level below halves both
+    dimensions, down to a single pixel at level 0.
+    """
+
+    def __init__(self, width: int, height: int, channels: int):
+        self.width = width
+        self.height = height
+        self.channels = channels
+
+    @property
+    def max_level(self) -> int:
+        return math.ceil(math.log2(max(self.width, self.height, 1)))
+
+    def level_size(self, level: int) -> Tuple[int, int]:
+        scale = 2 ** (self.max_level - level)
+        return max(1, math.ceil(self.width / scale)), max(1, math.ceil(self.height / scale))
+
+    def tile_box(self, level: int, x: int, y: int) -> Tuple[int, int, int, int]:
+        """Pixel box (left, top, right, bottom) of a tile, including its overlap."""
+        if not 0 <= level <= self.max_level:
+            raise ValueError(f"No level {level}")
+        width, height = self.level_size(level)
+        if not (0 <= x < math.ceil(width / TILE_SIZE) and 0 <= y < math.ceil(height / TILE_SIZE)):
+            raise ValueError(f"No tile {x}_{y} at level {level}")
+        left = x * TILE_SIZE - (TILE_OVERLAP if x > 0 else 0)
+        top = y * TILE_SIZE - (TILE_OVERLAP if y > 0 else 0)
+        right = min((x + 1) * TILE_SIZE + TILE_OVERLAP, width)
+        bottom = min((y + 1) * TILE_SIZE + TILE_OVERLAP, height)
+        return left, top, right, bottom
+
+    def as_dict(self) -> dict:
+        return {"width": self.width, "height": self.height, "channels": self.channels}
+
+
+def dzi_descriptor(info: PyramidInfo, tiles_url: str) -> dict:
+    """DZI descriptor in the JSON form deep-zoom viewers (e.g. OpenSeadragon) accept."""
+    return {
+        "Image": {
+            "xmlns": DZI_NAMESPACE,
+            "Url": tiles_url,
+            "Format": TILE_FORMAT,
+            "Overlap": str(TILE_OVERLAP),
+            "TileSize": str(TILE_SIZE),
+            "Size": {"Width": str(info.width), "Height": str(info.height)},
+        }
+    }
+
+
+def _strip_pixels(strip: Image.Image, extrema: Optional[Tuple[float, float]]) -> np.ndarray:
+    """(rows, width, channels) uint8 pixels of a strip of the source image.
+
+    With extrema the strip is a high bit depth one, windowed to 8 bits over
+    the whole image's value range so every strip uses the same mapping.
+    """
+    if extrema is not None:
+        lo, hi = extrema
+        if hi <= lo:
+            return np.zeros((strip.size[1], strip.size[0], 1), dtype=np.uint8)
+        pixels = np.asarray(strip, dtype=np.float32)
+        pixels -= lo
+        pixels *= 255.0 / (hi - lo)
+        pixels = pixels.astype(np.uint8)
+    elif strip.mode in ("1", "L", "LA"):
+        pixels = np.asarray(strip.convert("L"))
+    else:
+        pixels = np.asarray(strip.convert("RGB"))
+    return pixels[:, :, np.newaxis] if pixels.ndim == 2 else pixels
+
+
+def _halve(block: np.ndarray) -> np.ndarray:
+    """2x2 box reduction of an (h, w, c) block, repeating the last row/column when odd."""
+    if block.shape[0] % 2:
+        block = np.concatenate([block, block[-1:]], axis=0)
+    if block.shape[1] % 2:
+        block = np.concatenate([block, block[:, -1:]], axis=1)
+    summed = (block[0::2, 0::2].astype(np.uint16) + block[1::2, 0::2]
+              + block[0::2, 1::2] + block[1::2, 1::2])
+    return ((summed + 2) // 4).astype(np.uint8)
+
+
+class TileStore:
+    """DZI tile pyramids of stored uploads, cached on local disk.
+
+    The first request for an image decodes it once and copies it, strip by
+    strip, into a memory-mapped full-resolution raw raster (rotated
+    upright per its EXIF orientation), with no full-size intermediate
+    copies. Every lower level is built from the one above it, also strip by
+    strip. Tiles are then cut from memory-mapped levels, so serving a tile
+    reads only the pages it covers. Rendered tiles are kept as JPEG files.
+    When the cache grows past ``max_bytes``, whole pyramids are evicted,
+    least recently used first. Cache usage is tracked in memory: start()
+    scans the pyramids already on disk once, on the tile pool.
+    """
+
+    def __init__(self, blobs: BlobStore, root: Path, max_bytes: int = TILE_CACHE_MAX_BYTES,
+                 max_workers: int = TILE_WORKERS):
+        self.blobs = blobs
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="tiles")
+        self._flights = SingleFlight("tiles")
+        self._lock = threading.Lock()
+        # Pyramid directory -> [bytes on disk, last used (monotonic)]
+        self._usage: Dict[Path, list] = {}
+        self._scanned = False
+        self.tiles_rendered = 0
+        self.pyramids_built = 0
+        self.evicted = 0
+
+    def pyramid_dir(self, key: str) -> Path:
+        return self.root / os.path.dirname(key) / os.path.basename(key).split(".", 1)[0]
+
+    def tile_name(self, key: str, level: int, x: int, y: int) -> str:
+        """Unique file name of a tile, e.g. "<digest>-12-3_4.jpg"."""
+        stem = os.path.basename(key).split(".", 1)[0]
+        return f"{stem}-{level}-{x}_{y}.jpg"
+
+    def start(self):
+        """Scan the pyramids already on disk in the background, before eviction is enabled."""
+        self._executor.submit(self._load_usage)
+
+    async def info(self, key: str) -> Optional[PyramidInfo]:
+        """Pyramid of a stored upload, building it first if needed; None if the original is missing."""
+        info = await asyncio.to_thread(self._load_info, self.pyramid_dir(key))
+        if info is not None:
+            return info
+        return await self._run(("build", key), self._build, key)
+
+    async def tile(self, key: str, level: int, x: int, y: int) -> Optional[Path]:
+        """Path of a rendered tile; raises ValueError for coordinates outside the pyramid."""
+        directory = self.pyramid_dir(key)
+        path = directory / str(level) / self.tile_name(key, level, x, y)
+        if await asyncio.to_thread(path.exists):
+            self._touch(directory)
+            return path
+        info = await self.info(key)
+        if info is None:
+            return None
+        info.tile_box(level, x, y)
+        return await self._run(("tile", key, level, x, y), self._render_tile, key, info, level, x, y)
+
+    async def _run(self, flight_key, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await self._flights.do(flight_key, lambda: loop.run_in_executor(self._executor, fn, *args))
+
+    def _load_info(self, directory: Path) -> Optional[PyramidInfo]:
+        try:
+            with open(directory / "pyramid.json") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return PyramidInfo(meta["width"], meta["height"], meta["channels"])
+
+    def _raster_path(self, directory: Path, level: int) -> Path:
+        return directory / f"level-{level}.raw"
+
+    def _raster(self, directory: Path, info: PyramidInfo, level: int, mode: str = "r") -> np.memmap:
+        width, height = info.level_size(level)
+        return np.memmap(self._raster_path(directory, level), dtype=np.uint8, mode=mode,
+                         shape=(height, width, info.channels))
+
+    def _build(self, key: str) -> Optional[PyramidInfo]:
+        directory = self.pyramid_dir(key)
+        info = self._load_info(directory)
+        if info is not None:
+            return info
+        source = self.blobs.local_path(key)
+        if source is None:
+            return None
+
+        started = time.perf_counter()
+        # Build in a scratch directory and rename it into place, so readers
+        # never see a partial pyramid.
+        scratch = directory.parent / f".{directory.name}.{uuid.uuid4().hex}.part"
+        scratch.mkdir(parents=True)
+        try:
+            with Image.open(source) as img:
+                orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+                if orientation not in _ORIENTATION_VIEWS:
+                    orientation = 1
+                # 16-bit radiographs are windowed to 8 bits over the whole image's range
+                extrema = img.getextrema() if img.mode in HIGH_BIT_DEPTH_MODES else None
+                channels = 1 if extrema is not None or img.mode in ("1", "L", "LA") else 3
+                width, height = img.size
+                if orientation >= 5:
+                    info = PyramidInfo(height, width, channels)
+                else:
+                    info = PyramidInfo(width, height, channels)
+
+                base = self._raster(scratch, info, info.max_level, mode="w+")
+                view = _ORIENTATION_VIEWS[orientation](base)
+                for row in range(0, height, _BUILD_STRIP_ROWS):
+                    strip = img.crop((0, row, width, min(row + _BUILD_STRIP_ROWS, height)))
+                    view[row:row + strip.size[1]] = _strip_pixels(strip, extrema)
+                    del strip
+                base.flush()
+                del base, view
+
+            for level in range(info.max_level - 1, -1, -1):
+                upper = self._raster(scratch, info, level + 1)
+                lower = self._raster(scratch, info, level, mode="w+")
+                for row in range(0, upper.shape[0], _BUILD_STRIP_ROWS):
+                    reduced = _halve(upper[row:row + _BUILD_STRIP_ROWS])
+                    lower[row // 2:row // 2 + reduced.shape[0]] = reduced
+                lower.flush()
+                del upper, lower
+
+            with open(scratch / "pyramid.json", "w") as f:
+                json.dump(info.as_dict(), f)
+            try:
+                os.replace(scratch, directory)
+            except OSError:
+                # Another worker finished the same pyramid first
+                if self._load_info(directory) is None:
+                    raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        self.pyramids_built += 1
+        self._touch(directory, self._dir_bytes(directory))
+        logger.info(f"Built tile pyramid for {key} ({info.width}x{info.height}, {info.max_level + 1} levels) "
+                    f"in {(time.perf_counter() - started) * 1000.0:.0f} ms")
+        return info
+
+    def _render_tile(self, key: str, info: PyramidInfo, level: int, x: int, y: int) -> Optional[Path]:
+        directory = self.pyramid_dir(key)
+        path = directory / str(level) / self.tile_name(key, level, x, y)
+        if path.exists():
+            return path
+        left, top, right, bottom = info.tile_box(level, x, y)
+        try:
+            raster = self._raster(directory, info, level)
+        except FileNotFoundError:
+            # Evicted since info() was read
+            if self._build(key) is None:
+                return None
+            raster = self._raster(directory, info, level)
+        region = np.ascontiguousarray(raster[top:bottom, left:right])
+        del raster
+        tile = Image.fromarray(region[:, :, 0] if info.channels == 1 else region)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(f".{uuid.uuid4().hex}.part")
+        try:
+            tile.save(part_path, format="JPEG", quality=TILE_QUALITY)
+            os.replace(part_path, path)
+        finally:
+            try:
+                part_path.unlink()
+            except FileNotFoundError:
+                pass
+        self.tiles_rendered += 1
+        self._touch(directory, path.stat().st_size)
+        return path
+
+    def _dir_bytes(self, directory: Path) -> int:
+        return sum(entry.stat().st_size for entry in directory.rglob("*") if entry.is_file())
+
+    def _scan(self) -> Dict[Path, list]:
+        """Usage of the pyramids already on disk, oldest modification first."""
+        usage = {}
+        if self.root.exists():
+            for meta in self.root.rglob("pyramid.json"):
+                directory = meta.parent
+                usage[directory] = [self._dir_bytes(directory), meta.stat().st_mtime - time.time() + time.monotonic()]
+        return usage
+
+    def _load_usage(self):
+        try:
+            usage = self._scan()
+        except Exception as e:
+            logger.warning(f"Error scanning tile cache {self.root}: {str(e)}")
+            usage = {}
+        with self._lock:
+            # Pyramids used while the scan ran may also have been counted by it
+            for directory, (size, last_used) in usage.items():
+                entry = self._usage.setdefault(directory, [0, 0.0])
+                entry[0] = max(entry[0], size)
+                entry[1] = max(entry[1], last_used)
+            self._scanned = True
+        logger.info(f"Tile cache holds {len(usage)} pyramids")
+
+    def _touch(self, directory: Path, added_bytes: int = 0):
+        """Record a pyramid as used (and grown by added_bytes). Only growth can trigger eviction."""
+        with self._lock:
+            entry = self._usage.setdefault(directory, [0, 0.0])
+            entry[0] += added_bytes
+            entry[1] = time.monotonic()
+            if not added_bytes or not self._scanned \
+                    or sum(size for size, _ in self._usage.values()) <= self.max_bytes:
+                return
+            victims = self._evict(keep=directory)
+        for victim in victims:
+            shutil.rmtree(victim, ignore_errors=True)
+            logger.info(f"Evicted tile pyramid {victim}")
+
+    def _evict(self, keep: Path) -> List[Path]:
+        """Drop least recently used pyramids from the usage table until it is back under 90% of
+        max_bytes; returns their directories for the caller to delete outside the lock."""
+        total = sum(size for size, _ in self._usage.values())
+        target = self.max_bytes * 0.9
+        victims = []
+        for directory, (size, _) in sorted(self._usage.items(), key=lambda item: item[1][1]):
+            if total <= target:
+                break
+            if directory == keep:
+                continue
+            del self._usage[directory]
+            victims.append(directory)
+            total -= size
+            self.evicted += 1
+        return victims
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "scanned": self._scanned,
+                "pyramids": len(self._usage),
+                "bytes": sum(size for size, _ in self._usage.values()),
+                "max_bytes": self.max_bytes,
+                "pyramids_built": self.pyramids_built,
+                "tiles_rendered": self.tiles_rendered,
+                "evicted": self.evicted,
+                **self._flights.stats(),
+            }
+
+
+tile_store = TileStore(blob_store, UPLOAD_DIR / ".tiles")
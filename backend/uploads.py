@@ -0,0 +1,63 @@
+import os
+import re
+import logging
+from pathlib import Path
+from typing import Optional
+
+from fastapi import UploadFile
+
+from blob_store import (  # noqa: F401 (re-exported for the API layer)
+    create_blob_store, upload_key, upload_url, UploadTooLarge, UPLOAD_URL_PREFIX, LEGACY_UPLOAD_URL_PREFIX,
+)
+
+logger = logging.getLogger(__name__)
+
+# Upload ingestion configuration
+UPLOAD_DIR = Path(os.environ.get("UPLOAD_DIR", "./uploads"))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+_SAFE_EXTENSION = re.compile(r"^[A-Za-z0-9]{1,8}$")
+
+blob_store = create_blob_store(UPLOAD_DIR)
+
+
+class IngestedUpload:
+    """An upload that has been hashed and committed to the blob store."""
+
+    def __init__(self, key: str, filename: str, digest: str, size: int, created: bool):
+        self.key = key
+        self.filename = filename
+        self.digest = digest
+        self.size = size
+        # False when identical bytes were already stored and this upload was deduplicated
+        self.created = created
+
+    @property
+    def url(self) -> str:
+        return blob_store.url(self.key)
+
+    @property
+    def path(self) -> Optional[Path]:
+        return blob_store.local_path(self.key)
+
+
+def file_extension(filename: str) -> str:
+    extension = (filename or "").rsplit(".", 1)[-1] if "." in (filename or "") else ""
+    return extension.lower() if _SAFE_EXTENSION.match(extension) else "bin"
+
+
+async def ingest_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> IngestedUpload:
+    """Stream an upload into the blob store in chunks, hashing it and enforcing the size limit.
+
+    By now Starlette has already spooled the multipart body to disk; the API
+    rejects oversized bodies on their Content-Length before that, so this
+    cap only catches bodies sent without one.
+    """
+    ref = await blob_store.put_stream(file, file_extension(file.filename), max_bytes)
+    return IngestedUpload(ref.key, file.filename, ref.digest, ref.size, ref.created)
+
+
+def store_bytes(data: bytes, filename: str) -> IngestedUpload:
+    """Commit in-memory bytes (e.g. a ZIP member) to the blob store."""
+    ref = blob_store.put_bytes(data, file_extension(filename))
+    return IngestedUpload(ref.key, filename, ref.digest, ref.size, ref.created)
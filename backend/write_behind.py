@@ -0,0 +1,309 @@
+import os
+import time
+import fcntl
+import asyncio
+import logging
+from pathlib import Path
+from typing import IO, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Write-behind configuration for analysis documents
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "true").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get("WRITE_BEHIND_MAX_BATCH", "100"))
+WRITE_BEHIND_MAX_WAIT_MS = float(os.environ.get("WRITE_BEHIND_MAX_WAIT_MS", "50"))
+WRITE_BEHIND_MAX_BACKOFF_SECONDS = float(os.environ.get("WRITE_BEHIND_MAX_BACKOFF_SECONDS", "30"))
+WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS", "10"))
+# Each worker process journals to its own file next to this one, e.g. analysis_journal.<pid>.ndjson
+WRITE_BEHIND_JOURNAL = Path(os.environ.get("WRITE_BEHIND_JOURNAL", "./analysis_journal.ndjson"))
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _append_lines(path: Path, lines: List[str]):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _truncate(path: Path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _parse_journal(f, path: Path) -> List[dict]:
+    docs = []
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            docs.append(json_util.loads(line))
+        except ValueError:
+            # A torn final line from a crash mid-append
+            logger.warning(f"Skipping unreadable journal line {number} in {path}")
+    return docs
+
+
+def _read_journal(path: Path) -> List[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return _parse_journal(f, path)
+    except FileNotFoundError:
+        return []
+
+
+def worker_journal_path(base: Path, worker_id: int) -> Path:
+    return base.with_name(f"{base.stem}.{worker_id}{base.suffix}")
+
+
+def _lock_journal(path: Path, create: bool = False):
+    """Open a journal and take its exclusive lock, which is held for as long as the file stays open.
+
+    Returns None if another live process holds the lock, or the file is
+    missing or was removed by whoever held it before us.
+    """
+    try:
+        f = open(path, "a+" if create else "r+", encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+            raise FileNotFoundError(path)
+    except (BlockingIOError, FileNotFoundError):
+        f.close()
+        return None
+    return f
+
+
+def _open_journal(base: Path) -> Tuple[IO, Path, List[dict]]:
+    """Lock this process's journal and take over those of processes that have exited.
+
+    Returns the locked journal file, its path and the documents left
+    unpersisted in it and in the journals taken over. Documents taken over
+    are appended to this process's journal before the other file is deleted.
+    """
+    path = worker_journal_path(base, os.getpid())
+    own = _lock_journal(path, create=True)
+    if own is None:
+        raise RuntimeError(f"Journal {path} is locked by another process")
+    docs = _read_journal(path)
+
+    for other in sorted(base.parent.glob(f"{base.stem}.*{base.suffix}")):
+        if other == path:
+            continue
+        f = _lock_journal(other)
+        if f is None:
+            continue
+        try:
+            orphaned = _parse_journal(f, other)
+            if orphaned:
+                logger.info(f"Taking over {len(orphaned)} journaled documents from {other}")
+                _append_lines(path, [json_util.dumps(doc) + "\n" for doc in orphaned])
+                docs.extend(orphaned)
+            other.unlink()
+        finally:
+            f.close()
+    return own, path, docs
+
+
+class WriteBehindQueue:
+    """Persists documents in batches after the request that produced them has returned.
+
+    enqueue() appends the documents to a local journal and fsyncs it, so
+    once it returns a crash cannot lose them. Concurrent enqueues share one
+    fsync. A background task then groups documents into ``insert_many``
+    batches of up to ``max_batch`` or whatever arrived within
+    ``max_wait_ms``. Failed batches are retried with exponential backoff.
+    The journal is truncated whenever everything in it has been persisted,
+    and replayed on start. Re-inserting a document that already made it in
+    before a crash is a duplicate key error, which counts as success.
+
+    Each worker process keeps its own journal under an flock held while it
+    runs, so one worker's truncate never touches another's documents. On
+    start, a worker replays its own journal and takes over any whose lock is
+    free, i.e. those left by processes that have exited.
+    """
+
+    def __init__(self, insert_many: Callable[[List[dict]], Awaitable[None]], journal_path: Path = WRITE_BEHIND_JOURNAL,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, max_wait_ms: float = WRITE_BEHIND_MAX_WAIT_MS,
+                 max_backoff: float = WRITE_BEHIND_MAX_BACKOFF_SECONDS):
+        self.insert_many = insert_many
+        self.journal_base = Path(journal_path)
+        # This process's journal, chosen and locked by start()
+        self.journal_path: Optional[Path] = None
+        self._journal_file = None
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_backoff = max_backoff
+        # Journaled but not yet persisted, by document id, in arrival order
+        self._pending: Dict[str, dict] = {}
+        self._buffer: List[dict] = []
+        self._journal_waiters: List[tuple] = []
+        self._journal_task: Optional[asyncio.Task] = None
+        self._journal_lock: Optional[asyncio.Lock] = None
+        self._arrived: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.persisted = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self.replayed = 0
+
+    async def start(self):
+        """Replay anything left in the journal, then start the flusher."""
+        if self._task is not None:
+            return
+        self._journal_lock = asyncio.Lock()
+        self._arrived = asyncio.Event()
+        self._stopping = False
+        self.journal_base.parent.mkdir(parents=True, exist_ok=True)
+        self._journal_file, self.journal_path, leftovers = await asyncio.to_thread(_open_journal, self.journal_base)
+        if leftovers:
+            logger.info(f"Replaying {len(leftovers)} journaled documents from {self.journal_path}")
+            self.replayed += len(leftovers)
+            self._accept(leftovers)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self, timeout: float = WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS):
+        """Flush what is queued; anything still unpersisted after ``timeout`` stays journaled."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._arrived.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            logger.warning(f"{len(self._pending)} documents left in {self.journal_path} for the next start")
+        self._task = None
+        await asyncio.to_thread(self._close_journal)
+
+    def _close_journal(self):
+        # An empty journal is removed; one with documents left is taken over by the next worker to start
+        if not self._pending:
+            self.journal_path.unlink(missing_ok=True)
+        self._journal_file.close()
+        self._journal_file = None
+
+    async def enqueue(self, doc: dict):
+        await self.enqueue_many([doc])
+
+    async def enqueue_many(self, docs: Iterable[dict]):
+        """Durably queue documents; returns once they are fsynced to the journal."""
+        docs = list(docs)
+        if not docs:
+            return
+        if self._task is None or self._stopping:
+            raise RuntimeError("Write-behind queue is not running")
+        waiter = asyncio.get_running_loop().create_future()
+        self._journal_waiters.append(([json_util.dumps(doc) + "\n" for doc in docs], docs, waiter))
+        if self._journal_task is None or self._journal_task.done():
+            self._journal_task = asyncio.create_task(self._write_journal())
+        await waiter
+
+    def pending(self, doc_id: str) -> Optional[dict]:
+        """A queued document that may not be in the database yet."""
+        return self._pending.get(doc_id)
+
+    def pending_docs(self) -> List[dict]:
+        return list(self._pending.values())
+
+    def _accept(self, docs: List[dict]):
+        for doc in docs:
+            self._pending[str(doc["_id"])] = doc
+        self._buffer.extend(docs)
+        self._arrived.set()
+
+    async def _write_journal(self):
+        # Everything that queued up while the previous fsync ran goes out in one write
+        while self._journal_waiters:
+            waiters, self._journal_waiters = self._journal_waiters, []
+            lines = [line for entry_lines, _, _ in waiters for line in entry_lines]
+            try:
+                async with self._journal_lock:
+                    await asyncio.to_thread(_append_lines, self.journal_path, lines)
+            except Exception as e:
+                logger.error(f"Error writing analysis journal: {str(e)}")
+                for _, _, waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            for _, docs, waiter in waiters:
+                self._accept(docs)
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def _flush_loop(self):
+        while True:
+            if not self._buffer:
+                if self._stopping and not self._journal_waiters:
+                    return
+                self._arrived.clear()
+                await self._arrived.wait()
+                continue
+            # Give a partial batch a moment to fill up
+            deadline = time.monotonic() + self.max_wait
+            while len(self._buffer) < self.max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+            await self._persist(batch)
+
+    async def _persist(self, batch: List[dict]):
+        backoff = 0.5
+        while True:
+            try:
+                await self.insert_many(batch)
+                break
+            except BulkWriteError as e:
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY_ERROR]
+                if errors:
+                    # Rejected documents would be rejected again; drop them rather than block the queue
+                    self.dropped += len(errors)
+                    logger.error(f"Dropping {len(errors)} analysis documents rejected by MongoDB: "
+                                 f"{errors[0].get('errmsg')}")
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.retries += 1
+                logger.warning(f"Error persisting {len(batch)} analysis documents, retrying in {backoff:.1f}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        for doc in batch:
+            self._pending.pop(str(doc["_id"]), None)
+        self.persisted += len(batch)
+        self.batches += 1
+        if not self._pending and not self._journal_waiters:
+            async with self._journal_lock:
+                # Re-check: an enqueue may have journaled more while we waited for the lock
+                if not self._pending:
+                    await asyncio.to_thread(_truncate, self.journal_path)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "pending": len(self._pending),
+            "persisted": self.persisted,
+            "batches": self.batches,
+            "mean_batch_size": round(self.persisted / self.batches, 2) if self.batches else 0.0,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "replayed": self.replayed,
+            "journal": str(self.journal_path) if self.journal_path else None,
+        }
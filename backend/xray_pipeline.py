@@ -0,0 +1,58 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Input geometry of the torchxrayvision DenseNet
+XRAY_INPUT_SIZE = (224, 224)
+
+# Normalize(mean=0.5, std=0.5) applied to ToTensor()'s [0, 1] range, i.e. x / 127.5 - 1
+_SCALE = np.float32(1.0 / 127.5)
+_SHIFT = np.float32(1.0)
+
+
+def preprocess_batch(images: Sequence[Image.Image], out: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """Normalize 8-bit grayscale images into one (N, 1, H, W) float32 tensor.
+
+    Pixels are copied from each image's uint8 buffer directly into the output
+    tensor and scaled in place over the whole batch, with no per-image float
+    intermediates. Pass ``out`` to reuse a preallocated tensor.
+    """
+    height, width = XRAY_INPUT_SIZE[1], XRAY_INPUT_SIZE[0]
+    if out is None:
+        out = torch.empty((len(images), 1, height, width), dtype=torch.float32)
+    batch = out.numpy()
+
+    for i, img in enumerate(images):
+        if img.mode != "L" or img.size != XRAY_INPUT_SIZE:
+            raise ValueError(f"Expected {XRAY_INPUT_SIZE} grayscale image, got {img.mode} {img.size}")
+        batch[i, 0] = np.asarray(img)
+
+    batch *= _SCALE
+    batch -= _SHIFT
+    return out
+
+
+def postprocess_batch(logits: np.ndarray, labels: Sequence[str], k: int = 3) -> List[List[dict]]:
+    """Turn (N, P) model logits into the top-k {"label", "confidence"} predictions per image.
+
+    Outputs with an empty label (ones the loaded weights were not trained on) are never reported.
+    """
+    logits = np.asarray(logits, dtype=np.float32)
+    probs = 1.0 / (1.0 + np.exp(-logits))
+    trained = np.array([bool(label) for label in labels])
+    probs = np.where(trained, probs, -1.0)
+
+    k = min(k, int(trained.sum()))
+    # argpartition finds the k best per row in linear time; only those k are sorted.
+    top = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    top_probs = np.take_along_axis(probs, top, axis=1)
+    order = np.argsort(-top_probs, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    top_probs = np.take_along_axis(top_probs, order, axis=1)
+
+    return [
+        [{"label": labels[j], "confidence": float(p)} for j, p in zip(row_idx, row_probs)]
+        for row_idx, row_probs in zip(top.tolist(), top_probs.tolist())
+    ]
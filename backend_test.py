@@ -327,6 +327,44 @@ class ZemedicAPITester:
         
         return success
 
+    def test_analysis_job(self):
+        """Test submitting an X-ray analysis job and long-polling for its result"""
+        if not self.token:
+            logger.error("❌ Cannot test analysis jobs: No authentication token")
+            return False
+        
+        test_image_path = '/app/frontend/public/sample-xray.jpg'
+        with open(test_image_path, 'rb') as f:
+            files = {'file': ('sample-xray.jpg', f, 'image/jpeg')}
+            success, response = self.run_test(
+                "Submit X-ray Analysis Job",
+                "POST",
+                "api/jobs/xray",
+                202,
+                files=files
+            )
+        
+        if not success or 'job_id' not in response:
+            logger.error("❌ Job submission did not return a job_id")
+            return False
+        
+        success, job = self.run_test(
+            "Poll X-ray Analysis Job",
+            "GET",
+            f"api/jobs/{response['job_id']}?wait=30",
+            200
+        )
+        
+        if success:
+            logger.info(f"Job status: {job.get('status')}")
+            if job.get('status') == 'done' and 'predictions' in (job.get('result') or {}):
+                logger.info("✅ Job finished with predictions")
+            else:
+                logger.error(f"❌ Job did not finish with a result: {json.dumps(job, indent=2)}")
+                success = False
+        
+        return success
+
 def main():
     # Setup
     tester = ZemedicAPITester()
@@ -369,6 +407,9 @@ def main():
         # Test CT scan analysis with heatmap visualization
         tester.test_ct_scan_analysis()
         
+        # Test asynchronous analysis job submission and polling
+        tester.test_analysis_job()
+        
         # Test user history to get valid analysis IDs
         success, history = tester.run_test(
             "User History",
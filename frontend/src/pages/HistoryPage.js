@@ -12,6 +12,8 @@ const HistoryPage = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [filter, setFilter] = useState('all');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   
   useEffect(() => {
     const fetchHistory = async () => {
@@ -19,8 +21,9 @@ const HistoryPage = () => {
         if (!currentUser || !currentUser.token) return;
         
         if (!demoMode) {
-          const data = await getUserHistory(currentUser.token);
-          setHistory(data || []);
+          const page = await getUserHistory(currentUser.token);
+          setHistory(page.items || []);
+          setNextCursor(page.nextCursor);
         } else {
           // Demo data
           const demoHistory = [
@@ -61,6 +64,7 @@ const HistoryPage = () => {
             }
           ];
           setHistory(demoHistory);
+          setNextCursor(null);
         }
       } catch (error) {
         console.error('Error fetching history:', error);
@@ -73,6 +77,21 @@ const HistoryPage = () => {
     fetchHistory();
   }, [currentUser, demoMode]);
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await getUserHistory(currentUser.token, nextCursor);
+      setHistory((items) => [...items, ...(page.items || [])]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error fetching history:', error);
+      setError('Failed to load more analyses');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const formatDate = (dateString) => {
     const options = { year: 'numeric', month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' };
     return new Date(dateString).toLocaleDateString(undefined, options);
@@ -269,6 +288,18 @@ const HistoryPage = () => {
             )}
           </div>
         )}
+        
+        {nextCursor && (
+          <div className="p-4 border-t border-gray-200 text-center">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="text-[#5718e3] hover:underline disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
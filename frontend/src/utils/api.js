@@ -60,16 +60,30 @@ export const analyzeCTScan = async (file, token) => {
   return handleResponse(response);
 };
 
-// Function to get user's analysis history
-export const getUserHistory = async (token) => {
-  const response = await fetch(`${API_URL}/api/user/history`, {
+// Function to get one page of the user's analysis history, newest first.
+// Items carry findings (prediction labels) and imageUrl (the thumbnail) as the history page shows them.
+// Pass the returned nextCursor to fetch the following page; it is null on the last page.
+export const getUserHistory = async (token, cursor = null) => {
+  const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+  const response = await fetch(`${API_URL}/api/user/history${query}`, {
     method: 'GET',
     headers: {
       'Authorization': `Bearer ${token}`
     }
   });
 
-  return handleResponse(response);
+  const items = await handleResponse(response);
+  return {
+    items: items.map((item) => ({
+      ...item,
+      findings: (item.predictions || []).map((prediction) => prediction.label),
+      // thumbnail_url carries a short-lived image token, so an <img> tag can load it
+      imageUrl: item.thumbnail_url && item.thumbnail_url.startsWith('/')
+        ? `${API_URL}${item.thumbnail_url}`
+        : item.thumbnail_url
+    })),
+    nextCursor: response.headers.get('X-Next-Cursor')
+  };
 };
 
 // Function to get a specific analysis result by ID
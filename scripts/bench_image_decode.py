@@ -0,0 +1,66 @@
+"""Compare the reduced grayscale decode with the previous full RGB decode.
+
+Usage: python scripts/bench_image_decode.py [image ...]
+
+Without arguments a synthetic 3000x3000 JPEG and a 16-bit PNG are generated.
+"""
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from image_decode import decode_grayscale  # noqa: E402
+
+
+def legacy_decode(image_data: bytes) -> Image.Image:
+    img = Image.open(BytesIO(image_data)).convert('RGB')
+    img = img.resize((224, 224))
+    return img.convert('L')
+
+
+def synthetic_images():
+    rng = np.random.default_rng(0)
+    rgb = (rng.random((3000, 3000, 3)) * 255).astype(np.uint8)
+    buf = BytesIO()
+    Image.fromarray(rgb).save(buf, "JPEG", quality=90)
+    yield "synthetic 3000x3000 JPEG", buf.getvalue()
+
+    radiograph = (rng.random((3000, 2500)) * 4095).astype(np.uint16)
+    buf = BytesIO()
+    Image.fromarray(radiograph).save(buf, "PNG")
+    yield "synthetic 2500x3000 16-bit PNG", buf.getvalue()
+
+
+def best_of(fn, data, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000.0
+
+
+def main():
+    if len(sys.argv) > 1:
+        images = [(path, Path(path).read_bytes()) for path in sys.argv[1:]]
+    else:
+        images = list(synthetic_images())
+
+    for name, data in images:
+        legacy_ms = best_of(legacy_decode, data)
+        reduced_ms = best_of(lambda d: decode_grayscale(d, (224, 224)), data)
+        _, stats = decode_grayscale(data, (224, 224))
+        print(f"{name}")
+        print(f"  legacy decode:  {legacy_ms:8.1f} ms, ~{stats.baseline_pixel_bytes / 1e6:6.1f} MB pixels")
+        print(f"  reduced decode: {reduced_ms:8.1f} ms, ~{stats.peak_pixel_bytes / 1e6:6.1f} MB pixels "
+              f"(decoded at {stats.decoded_size[0]}x{stats.decoded_size[1]})")
+        print(f"  saved:          {legacy_ms - reduced_ms:8.1f} ms, ~{stats.bytes_saved / 1e6:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
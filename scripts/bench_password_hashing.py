@@ -0,0 +1,70 @@
+"""Login burst benchmark: bcrypt verification inline on the event loop vs. on the password pool.
+
+Usage: BCRYPT_ROUNDS=12 python scripts/bench_password_hashing.py [logins]
+
+While the logins run, a probe coroutine stands in for a cheap request such as
+/api/health and records how long it waits for the event loop.
+"""
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from passwords import pwd_context, password_hasher, BCRYPT_ROUNDS  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+async def inline_login(hashed):
+    # Previous behaviour: verify directly inside the async handler
+    return pwd_context.verify(PASSWORD, hashed)
+
+
+async def pooled_login(hashed):
+    valid, _ = await password_hasher.verify_and_update(PASSWORD, hashed)
+    return valid
+
+
+async def probe(stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        latencies.append(time.perf_counter() - started - 0.005)
+
+
+async def run(login, hashed, logins):
+    stop = asyncio.Event()
+    latencies = []
+    probe_task = asyncio.create_task(probe(stop, latencies))
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login(hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe_task
+    assert all(results)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else elapsed
+    return elapsed, p99, max(latencies) if latencies else elapsed
+
+
+async def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    hashed = pwd_context.hash(PASSWORD)
+    print(f"{logins} concurrent logins, bcrypt rounds {BCRYPT_ROUNDS}, "
+          f"{password_hasher.max_workers} password workers")
+
+    for name, login in (("inline on event loop", inline_login), ("password pool", pooled_login)):
+        elapsed, p99, worst = await run(login, hashed, logins)
+        print(f"  {name:22s} {logins / elapsed:6.1f} logins/s, "
+              f"other-request delay p99 {p99 * 1000:7.1f} ms, max {worst * 1000:7.1f} ms")
+
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""Micro-benchmark of X-ray pre/post-processing: per-image torchvision path vs. batched NumPy path.
+
+Usage: python scripts/bench_xray_pipeline.py [batch_size]
+
+Model inference is excluded; random logits stand in for the DenseNet output.
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from xray_pipeline import preprocess_batch, postprocess_batch  # noqa: E402
+
+PATHOLOGIES = [f"pathology_{i}" for i in range(18)]
+
+
+def legacy_pipeline(rgb_images, logits):
+    transform = transforms.Compose([
+        transforms.Grayscale(num_output_channels=1),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.5], std=[0.5])
+    ])
+    tensors = [transform(img).unsqueeze(0) for img in rgb_images]
+    all_results = []
+    for preds in logits:
+        results = []
+        for i in range(len(PATHOLOGIES)):
+            prob = 1 / (1 + np.exp(-preds[i]))
+            results.append({"label": PATHOLOGIES[i], "confidence": float(prob)})
+        results.sort(key=lambda x: x["confidence"], reverse=True)
+        all_results.append(results[:3])
+    return tensors, all_results
+
+
+def batched_pipeline(gray_images, logits):
+    return preprocess_batch(gray_images), postprocess_batch(logits, PATHOLOGIES, k=3)
+
+
+def best_of(fn, *args, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000.0
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rng = np.random.default_rng(0)
+    gray = [Image.fromarray((rng.random((224, 224)) * 255).astype(np.uint8), mode="L")
+            for _ in range(batch_size)]
+    rgb = [img.convert("RGB") for img in gray]
+    logits = rng.normal(size=(batch_size, len(PATHOLOGIES))).astype(np.float32)
+
+    legacy_tensors, legacy_results = legacy_pipeline(rgb, logits)
+    batched_tensor, batched_results = batched_pipeline(gray, logits)
+    assert torch.allclose(torch.cat(legacy_tensors), batched_tensor, atol=1e-5)
+    assert [[p["label"] for p in r] for r in legacy_results] == \
+        [[p["label"] for p in r] for r in batched_results]
+
+    legacy_ms = best_of(legacy_pipeline, rgb, logits)
+    batched_ms = best_of(batched_pipeline, gray, logits)
+    print(f"batch size {batch_size}")
+    print(f"  per-image torchvision + Python loop: {legacy_ms:7.2f} ms ({legacy_ms / batch_size:.3f} ms/image)")
+    print(f"  batched NumPy:                       {batched_ms:7.2f} ms ({batched_ms / batch_size:.3f} ms/image)")
+    print(f"  speedup:                             {legacy_ms / batched_ms:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
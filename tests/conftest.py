@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other as top-level modules, as under uvicorn
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Module-level stores (uploads, tile cache, journals) live in a scratch directory
+_scratch = tempfile.mkdtemp(prefix="zemedic-tests-")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_scratch, "uploads"))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+async def store(request, tmp_path):
+    """An empty data store, once per storage backend."""
+    if request.param == "sqlite":
+        from sqlite_store import connect_sqlite
+        store = await connect_sqlite(tmp_path / "zemedic.db")
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        from data_access import DataStore
+        store = DataStore(AsyncMongoMockClient(), "zemedic_test")
+    await store.ensure_indexes()
+    yield store
+    store.close()
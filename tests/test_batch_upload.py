@@ -0,0 +1,65 @@
+import io
+import zipfile
+
+import pytest
+from starlette.datastructures import Headers, UploadFile
+
+import batch_upload
+from batch_upload import BatchTooLarge, ingest_image_files, iter_image_entries
+from uploads import IngestedUpload, UploadTooLarge
+
+IMAGE = b"\xff\xd8\xff fake jpeg" * 100
+
+
+def upload(filename, data, content_type):
+    return UploadFile(io.BytesIO(data), filename=filename, headers=Headers({"content-type": content_type}))
+
+
+def zip_of(*members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i, data in enumerate(members):
+            archive.writestr(f"scan-{i}.jpg", data)
+    return buffer.getvalue()
+
+
+async def entries(files, **limits):
+    stored = await ingest_image_files(files, **limits)
+    return list(iter_image_entries(files, stored, **limits))
+
+
+@pytest.mark.anyio
+async def test_plain_files_are_stored_and_zip_members_expanded_in_order():
+    files = [
+        upload("a.jpg", IMAGE + b"a", "image/jpeg"),
+        upload("scans.zip", zip_of(IMAGE + b"z"), "application/zip"),
+        upload("notes.txt", b"text", "text/plain"),
+    ]
+    result = await entries(files)
+    assert [name for name, _ in result] == ["a.jpg", "scan-0.jpg"]
+    assert isinstance(result[0][1], IngestedUpload) and result[0][1].size == len(IMAGE) + 1
+    assert result[1][1] == IMAGE + b"z"
+
+
+@pytest.mark.anyio
+async def test_plain_file_over_max_upload_bytes_is_rejected(monkeypatch):
+    monkeypatch.setattr(batch_upload, "MAX_UPLOAD_BYTES", len(IMAGE))
+    with pytest.raises(UploadTooLarge):
+        await entries([upload("big.jpg", IMAGE + b"!", "image/jpeg")])
+
+
+@pytest.mark.anyio
+async def test_batch_total_counts_plain_files_and_zip_members():
+    files = [upload("a.jpg", IMAGE, "image/jpeg"), upload("scans.zip", zip_of(IMAGE, IMAGE), "application/zip")]
+    assert len(await entries(files, max_total_bytes=3 * len(IMAGE))) == 3
+    for file in files:
+        await file.seek(0)
+    with pytest.raises(BatchTooLarge):
+        await entries(files, max_total_bytes=3 * len(IMAGE) - 1)
+
+
+@pytest.mark.anyio
+async def test_image_count_limit_spans_files_and_archives():
+    files = [upload("a.jpg", IMAGE, "image/jpeg"), upload("scans.zip", zip_of(IMAGE, IMAGE), "application/zip")]
+    with pytest.raises(BatchTooLarge):
+        await entries(files, max_images=2)
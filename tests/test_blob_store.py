@@ -0,0 +1,92 @@
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from blob_store import BlobStore, LocalBlobStore, S3BlobStore, blob_key  # noqa: E402
+from cache import content_digest  # noqa: E402
+
+BUCKET = "zemedic-test"
+DATA = b"\x89PNG fake image bytes" * 100
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_store(root, upload_workers=4):
+    return S3BlobStore(root, BUCKET, prefix="uploads/", endpoint_url=None, region="us-east-1",
+                       upload_workers=upload_workers)
+
+
+def test_blob_store_is_abstract():
+    with pytest.raises(TypeError):
+        BlobStore("/tmp/spool")
+
+
+def test_put_bytes_uploads_once(s3, tmp_path):
+    store = make_store(tmp_path / "node")
+    first = store.put_bytes(DATA, "png")
+    second = store.put_bytes(DATA, "png")
+    store.shutdown()
+
+    assert first.key == blob_key(content_digest(DATA), "png")
+    assert first.created and not second.created
+    body = s3.get_object(Bucket=BUCKET, Key=f"uploads/{first.key}")["Body"].read()
+    assert body == DATA
+    assert store.stats()["uploaded"] == 1
+    assert store.stats()["pending_uploads"] == 0
+
+
+def test_other_node_reads_from_bucket(s3, tmp_path):
+    writer = make_store(tmp_path / "writer")
+    key = writer.put_bytes(DATA, "png").key
+    writer.shutdown()
+
+    reader = make_store(tmp_path / "reader")
+    assert not LocalBlobStore.exists(reader, key)
+    assert reader.exists(key)
+    assert b"".join(reader.iter_chunks(key, chunk_size=64)) == DATA
+    # Streaming does not fill the cache; local_path downloads into it
+    assert not LocalBlobStore.exists(reader, key)
+    path = reader.local_path(key)
+    assert path is not None and path.read_bytes() == DATA
+    assert reader.stats()["downloaded"] == 1
+
+
+def test_missing_blob(s3, tmp_path):
+    store = make_store(tmp_path / "node")
+    key = blob_key("0" * 32, "png")
+    assert not store.exists(key)
+    assert store.local_path(key) is None
+
+
+def test_failed_upload_is_retried(s3, tmp_path):
+    s3.delete_bucket(Bucket=BUCKET)
+    store = make_store(tmp_path / "node", upload_workers=1)
+    key = store.put_bytes(DATA, "png").key
+    # One upload worker, so this runs once the failed upload has finished
+    store._uploader.submit(lambda: None).result()
+    assert store.stats()["failed_uploads"] == 1
+
+    s3.create_bucket(Bucket=BUCKET)
+    store.put_bytes(DATA, "png")
+    store.shutdown()
+    assert store.stats()["failed_uploads"] == 0
+    assert s3.head_object(Bucket=BUCKET, Key=f"uploads/{key}")["ContentLength"] == len(DATA)
+
+
+def test_delete_removes_cache_and_object(s3, tmp_path):
+    store = make_store(tmp_path / "node")
+    key = store.put_bytes(DATA, "png").key
+    store.shutdown()
+    store.delete(key)
+    assert store.local_path(key) is None
+    assert not store.exists(key)
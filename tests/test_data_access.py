@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from data_access import DataStore, decode_cursor, encode_cursor
+
+
+@pytest.fixture
+def mongo_store():
+    store = DataStore(AsyncMongoMockClient(), "zemedic_test")
+    yield store
+    store.close()
+
+
+def make_analysis(user_id, date):
+    return {"_id": ObjectId(), "user_id": user_id, "type": "xray", "date": date,
+            "image_url": None, "predictions": []}
+
+
+def test_cursor_round_trip():
+    date, analysis_id = datetime(2024, 3, 9, 14, 5, 7, 123000), ObjectId()
+    cursor = encode_cursor(date, str(analysis_id))
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+    assert decode_cursor(cursor) == (date, analysis_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor(datetime(2024, 1, 1), "not-an-objectid")])
+def test_decode_cursor_rejects_malformed_cursors(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.anyio
+async def test_ensure_indexes_backfills_change_tracking(mongo_store):
+    start = datetime(2024, 1, 1)
+    # Stored by a release without change tracking: no sync_seq or updated_at
+    old = [make_analysis("u1", start + timedelta(minutes=i)) for i in range(5)]
+    await mongo_store.db.analyses.insert_many(old)
+    await mongo_store.analyses.insert(make_analysis("u1", start + timedelta(hours=1)))
+
+    await mongo_store.ensure_indexes()
+
+    changes = await mongo_store.analyses.changes_since(0, 100)
+    assert len(changes) == 6
+    seqs = [doc["sync_seq"] for doc in changes]
+    assert len(set(seqs)) == 6
+    backfilled = {doc["_id"]: doc for doc in changes}
+    for doc in old:
+        assert backfilled[doc["_id"]]["updated_at"] == doc["date"]
+
+    changed = await mongo_store.analyses.list_changed("u1", (start - timedelta(days=1), ObjectId("0" * 24)), 100)
+    assert len(changed) == 6
+
+    # Stamping is a one-off: later startups leave the sequence alone
+    await mongo_store.ensure_indexes()
+    assert [doc["sync_seq"] for doc in await mongo_store.analyses.changes_since(0, 100)] == seqs
+
+
+def make_user(email):
+    return {"email": email, "name": email.split("@")[0], "hashed_password": "x",
+            "created_at": datetime(2024, 1, 1, 9, 30)}
+
+
+@pytest.mark.anyio
+async def test_user_crud(store):
+    user = make_user("alice@example.com")
+    await store.users.create(user)
+    user_id = str(user["_id"])
+
+    by_email = await store.users.get_by_email("alice@example.com")
+    assert by_email == {"id": user_id, "email": "alice@example.com", "name": "alice", "hashed_password": "x",
+                        "created_at": datetime(2024, 1, 1, 9, 30)}
+    assert await store.users.get_by_id(user_id) == by_email
+    assert await store.users.get_by_id(str(ObjectId())) is None
+    assert await store.users.email_exists("alice@example.com")
+    assert not await store.users.email_exists("bob@example.com")
+
+    updated = await store.users.update(user_id, {"name": "Alice", "email": "alice@example.org"})
+    assert (updated["name"], updated["email"]) == ("Alice", "alice@example.org")
+    assert await store.users.get_by_email("alice@example.org") == updated
+    assert await store.users.update(user_id, {}) == updated
+
+    # Replicated users: neither the id nor the email may already be taken
+    assert not await store.users.create_if_absent({**make_user("carol@example.com"), "_id": user["_id"]})
+    assert not await store.users.create_if_absent({**make_user("alice@example.org"), "_id": ObjectId()})
+    carol = {**make_user("carol@example.com"), "_id": ObjectId()}
+    assert await store.users.create_if_absent(carol)
+    assert (await store.users.get_by_id(str(carol["_id"])))["email"] == "carol@example.com"
+
+
+@pytest.mark.anyio
+async def test_analysis_crud(store):
+    doc = make_analysis("u1", datetime(2024, 2, 1, 8, 0, 0, 250000))
+    doc.update(image_url="/api/uploads/ab/cd/abcd.png", recommendations=["Follow up"])
+    analysis_id = str(doc["_id"])
+    await store.analyses.insert(doc)
+
+    stored = await store.analyses.get(analysis_id)
+    assert stored["id"] == analysis_id and "_id" not in stored
+    assert stored["date"] == doc["date"] and stored["recommendations"] == ["Follow up"]
+    assert stored["sync_seq"] == 1
+    assert await store.analyses.get(str(ObjectId())) is None
+    assert await store.analyses.owns_image("u1", "/api/uploads/ab/cd/abcd.png")
+    assert not await store.analyses.owns_image("u2", "/api/uploads/ab/cd/abcd.png")
+
+    await store.analyses.set_heatmaps(analysis_id, {"Effusion": "map"}, {"Effusion": "left"})
+    stored = await store.analyses.get(analysis_id)
+    assert stored["heatmaps"] == {"Effusion": "map"} and stored["condition_locations"] == {"Effusion": "left"}
+    assert stored["sync_seq"] == 2
+
+    replaced = {**doc, "_id": doc["_id"], "predictions": [{"label": "Edema", "confidence": 0.3}]}
+    await store.analyses.upsert_many([replaced])
+    stored = await store.analyses.get(analysis_id)
+    assert stored["predictions"] == [{"label": "Edema", "confidence": 0.3}] and stored["sync_seq"] == 3
+    assert [str(d["_id"]) for d in await store.analyses.changes_since(0, 10)] == [analysis_id]
+    assert await store.analyses.changes_since(3, 10) == []
+
+
+@pytest.mark.anyio
+async def test_list_page_and_iter_history(store):
+    start = datetime(2024, 1, 1)
+    docs = [make_analysis("u1", start + timedelta(hours=i // 2)) for i in range(9)]
+    for doc in docs:
+        doc["recommendations"] = ["Follow up"]
+    await store.analyses.insert_many(docs + [make_analysis("u2", start)])
+    newest_first = [str(doc["_id"]) for doc in sorted(docs, key=lambda d: (d["date"], d["_id"]), reverse=True)]
+
+    pages, cursor = [], None
+    while True:
+        page, cursor = await store.analyses.list_page("u1", 4, cursor)
+        pages.append(page)
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [4, 4, 1]
+    assert [item["id"] for page in pages for item in page] == newest_first
+    # The summary view carries the listed fields only
+    assert set(pages[0][0]) == {"id", "user_id", "type", "date", "image_url", "predictions", "updated_at"}
+
+    full, cursor = await store.analyses.list_page("u1", 20, summary=False)
+    assert cursor is None and full[0]["recommendations"] == ["Follow up"]
+    assert [doc["id"] async for doc in store.analyses.iter_history("u1", 2)] == newest_first
+    assert await store.analyses.list_page("nobody", 4) == ([], None)
+
+
+@pytest.mark.anyio
+async def test_list_changed(store):
+    docs = [make_analysis("u1", datetime(2024, 1, 1)) for _ in range(5)]
+    await store.analyses.insert_many(docs + [make_analysis("u2", datetime(2024, 1, 1))])
+    origin = (datetime(2000, 1, 1), ObjectId("0" * 24))
+
+    changed = await store.analyses.list_changed("u1", origin, 3)
+    assert [item["id"] for item in changed] == sorted(str(doc["_id"]) for doc in docs)[:3]
+    position = (changed[-1]["updated_at"], ObjectId(changed[-1]["id"]))
+    rest = await store.analyses.list_changed("u1", position, 3)
+    assert [item["id"] for item in rest] == sorted(str(doc["_id"]) for doc in docs)[3:]
+
+    # Stamped in a later millisecond than the inserts
+    await asyncio.sleep(0.01)
+    await store.analyses.set_heatmaps(str(docs[0]["_id"]), {}, {})
+    position = (rest[-1]["updated_at"], ObjectId(rest[-1]["id"]))
+    assert [item["id"] for item in await store.analyses.list_changed("u1", position, 3)] == [str(docs[0]["_id"])]
+    # Changes stamped after until are left out
+    assert await store.analyses.list_changed("u1", position, 3, until=rest[-1]["updated_at"]) == []
@@ -0,0 +1,102 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from bson.objectid import ObjectId
+
+import server
+from exports import CSV_COLUMNS, export_stream
+
+
+def make_docs(n, user_id="u1"):
+    start = datetime(2024, 5, 1, 12, 0)
+    return [{
+        "_id": ObjectId(), "user_id": user_id, "type": "xray", "date": start - timedelta(hours=i),
+        "image_url": f"/uploads/ab/cd/abcd{i}.png", "image_key": f"ab/cd/abcd{i}.png", "sync_seq": i + 1,
+        "predictions": [{"label": "Edema", "confidence": 0.2}, {"label": "Effusion", "confidence": 0.71234}],
+        "recommendations": ["Follow up", "Repeat in 6 weeks"],
+    } for i in range(n)]
+
+
+def with_ids(docs):
+    return [{**{key: value for key, value in doc.items() if key != "_id"}, "id": str(doc["_id"])} for doc in docs]
+
+
+async def iterate(docs):
+    for doc in docs:
+        yield doc
+
+
+async def collect(docs, export_format, compress=False, batch_size=4):
+    return [chunk async for chunk in export_stream(iterate(docs), export_format, compress, batch_size)]
+
+
+@pytest.mark.anyio
+async def test_ndjson_export():
+    docs = with_ids(make_docs(10))
+    chunks = await collect(docs, "ndjson")
+    # One chunk per batch, none of them empty
+    assert len(chunks) == 3 and all(chunks)
+
+    records = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert [record["id"] for record in records] == [doc["id"] for doc in docs]
+    assert records[0]["date"] == "2024-05-01T12:00:00"
+    # Legacy upload URLs are rewritten and internal bookkeeping is left out
+    assert records[0]["image_url"] == "/api/uploads/ab/cd/abcd0.png"
+    assert "image_key" not in records[0] and "sync_seq" not in records[0]
+    assert records[0]["predictions"] == docs[0]["predictions"]
+
+
+@pytest.mark.anyio
+async def test_csv_export():
+    docs = with_ids(make_docs(5))
+    rows = list(csv.reader(io.StringIO(b"".join(await collect(docs, "csv")).decode())))
+    assert rows[0] == CSV_COLUMNS
+    assert len(rows) == 6
+    assert rows[1] == [
+        docs[0]["id"], "2024-05-01T12:00:00", "xray", "/api/uploads/ab/cd/abcd0.png", "Effusion", "0.7123",
+        "Effusion=0.7123; Edema=0.2000", "Follow up | Repeat in 6 weeks",
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+async def test_gzip_export_matches_plain(export_format):
+    docs = with_ids(make_docs(10))
+    plain = b"".join(await collect(docs, export_format))
+    compressed = b"".join(await collect(docs, export_format, compress=True))
+    assert compressed[:2] == b"\x1f\x8b"
+    assert gzip.decompress(compressed) == plain
+
+
+@pytest.mark.anyio
+async def test_empty_export():
+    assert b"".join(await collect([], "ndjson")) == b""
+    assert gzip.decompress(b"".join(await collect([], "ndjson", compress=True))) == b""
+    assert b"".join(await collect([], "csv")).decode().strip() == ",".join(CSV_COLUMNS)
+
+
+@pytest.mark.anyio
+async def test_export_endpoint(store, monkeypatch):
+    monkeypatch.setattr(server, "store", store)
+    user = {"email": "alice@example.com", "name": "alice", "hashed_password": "x", "created_at": datetime.utcnow()}
+    await store.users.create(user)
+    user_id = str(user["_id"])
+    docs = make_docs(7, user_id) + make_docs(2, "someone-else")
+    await store.analyses.insert_many(docs)
+    headers = {"Authorization": f"Bearer {server.create_access_token({'sub': user_id})}"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        response = await client.get("/api/user/history/export", params={"format": "csv", "gzip": "true"},
+                                    headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    assert response.headers["content-disposition"].endswith('.csv.gz"')
+    rows = list(csv.reader(io.StringIO(gzip.decompress(response.content).decode())))
+    assert rows[0] == CSV_COLUMNS
+    # Newest first, only the user's own analyses
+    assert [row[0] for row in rows[1:]] == [str(doc["_id"]) for doc in docs[:7]]
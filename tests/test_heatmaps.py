@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+xrv = pytest.importorskip("torchxrayvision")
+
+from heatmaps import class_activation_maps  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return xrv.models.DenseNet(weights=None, op_threshs=None).eval()
+
+
+def test_outputs_match_the_model_forward_pass(model):
+    batch = torch.randn(2, 1, 224, 224)
+    with torch.no_grad():
+        expected = model(batch)
+        outputs, maps = class_activation_maps(model, batch)
+    assert torch.allclose(outputs, expected, atol=1e-5)
+    assert maps.shape == (2, expected.shape[1], 7, 7)
+
+
+def test_concurrent_calls_on_a_shared_model_get_their_own_maps(model):
+    images = [torch.randn(1, 1, 224, 224, generator=torch.Generator().manual_seed(i)) for i in range(8)]
+    with torch.no_grad():
+        expected = [class_activation_maps(model, image)[1] for image in images]
+
+    def run(i):
+        with torch.no_grad():
+            return [class_activation_maps(model, images[i])[1] for _ in range(5)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(run, range(8)))
+    for i, maps in enumerate(results):
+        for cam in maps:
+            assert torch.allclose(cam, expected[i], atol=1e-5), f"image {i} got another request's maps"
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from bson.objectid import ObjectId
+
+import server
+
+
+@pytest.fixture(autouse=True)
+def served_store(store, monkeypatch):
+    monkeypatch.setattr(server, "store", store)
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+        yield client
+
+
+async def add_user(store, email="alice@example.com"):
+    user = {"email": email, "name": email.split("@")[0], "hashed_password": "x", "created_at": datetime.utcnow()}
+    await store.users.create(user)
+    user_id = str(user["_id"])
+    return user_id, {"Authorization": f"Bearer {server.create_access_token({'sub': user_id})}"}
+
+
+def make_analyses(user_id, n, start=datetime(2024, 1, 1)):
+    return [{"_id": ObjectId(), "user_id": user_id, "type": "xray", "date": start + timedelta(minutes=i),
+             "image_url": None, "predictions": [], "recommendations": []} for i in range(n)]
+
+
+@pytest.mark.anyio
+async def test_cursor_pages_through_the_whole_history(store, client):
+    user_id, headers = await add_user(store)
+    # Pages break inside runs of analyses sharing a date, which the _id tiebreak keeps in order
+    docs = make_analyses(user_id, 25)
+    for i, doc in enumerate(docs):
+        doc["date"] = datetime(2024, 1, 1 + i // 5)
+    await store.analyses.insert_many(docs)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 7, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/user/history", params=params, headers=headers)
+        assert response.status_code == 200
+        seen += response.json()
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(seen) == 25
+    expected = sorted(docs, key=lambda doc: (doc["date"], doc["_id"]), reverse=True)
+    assert [item["id"] for item in seen] == [str(doc["_id"]) for doc in expected]
+
+
+@pytest.mark.anyio
+async def test_malformed_cursor_is_rejected(store, client):
+    _, headers = await add_user(store)
+    response = await client.get("/api/user/history", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_since_pages_through_a_burst_of_changes(store, client, monkeypatch):
+    monkeypatch.setattr(server, "HISTORY_WATERMARK_LAG_SECONDS", 0.5)
+    user_id, headers = await add_user(store)
+    response = await client.get("/api/user/history", headers=headers)
+    assert response.json() == []
+    watermark = response.headers["X-History-Watermark"]
+
+    # More changes than fit on one page, all stamped within the same moment
+    docs = make_analyses(user_id, 25)
+    await store.analyses.insert_many(docs)
+
+    # Too recent to be handed out yet: the watermark stays put
+    response = await client.get("/api/user/history", params={"since": watermark, "limit": 10}, headers=headers)
+    assert response.json() == []
+    assert response.headers["X-History-Watermark"] == watermark
+
+    await asyncio.sleep(0.6)
+    seen, pages = [], []
+    while True:
+        response = await client.get("/api/user/history", params={"since": watermark, "limit": 10}, headers=headers)
+        items = response.json()
+        pages.append(len(items))
+        seen += [item["id"] for item in items]
+        assert response.headers["X-History-Watermark"] != watermark or not items
+        watermark = response.headers["X-History-Watermark"]
+        if len(items) < 10:
+            break
+    assert pages == [10, 10, 5]
+    assert sorted(seen) == sorted(str(doc["_id"]) for doc in docs)
+
+    # Only what changes afterwards comes back
+    await store.analyses.set_heatmaps(str(docs[3]["_id"]), {"Effusion": "heatmap"}, {})
+    await asyncio.sleep(0.6)
+    response = await client.get("/api/user/history", params={"since": watermark}, headers=headers)
+    assert [item["id"] for item in response.json()] == [str(docs[3]["_id"])]
+
+
+@pytest.mark.anyio
+async def test_since_only_returns_the_users_own_changes(store, client, monkeypatch):
+    monkeypatch.setattr(server, "HISTORY_WATERMARK_LAG_SECONDS", 0)
+    alice, headers = await add_user(store)
+    bob, _ = await add_user(store, "bob@example.com")
+    watermark = (await client.get("/api/user/history", headers=headers)).headers["X-History-Watermark"]
+    await asyncio.sleep(0.01)
+    await store.analyses.insert_many(make_analyses(alice, 2) + make_analyses(bob, 3))
+
+    response = await client.get("/api/user/history", params={"since": watermark}, headers=headers)
+    assert [item["user_id"] for item in response.json()] == [alice, alice]
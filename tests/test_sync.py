@@ -0,0 +1,194 @@
+from datetime import datetime
+
+import httpx
+import pytest
+from bson.objectid import ObjectId
+
+import server
+import sync
+from blob_store import LocalBlobStore
+from sqlite_store import connect_sqlite
+from sync import SyncPusher, encode_batch, NDJSON_MEDIA_TYPE, SYNC_NODE_HEADER, SYNC_TOKEN_HEADER
+
+TOKEN = "test-sync-token"
+UPSTREAM_URL = "http://upstream"
+
+
+class Node:
+    """One deployment: its own SQLite database and blob directory."""
+
+    def __init__(self, root, name):
+        self.name = name
+        self.path = root / f"{name}.db"
+        self.blobs = LocalBlobStore(root / f"{name}-blobs")
+        self.store = None
+
+    async def open(self):
+        self.store = await connect_sqlite(self.path)
+        await self.store.ensure_indexes()
+        return self
+
+    async def restart(self):
+        self.store.close()
+        return await self.open()
+
+    async def add_user(self, email):
+        user = {"email": email, "full_name": email.split("@")[0], "hashed_password": "x"}
+        await self.store.users.create(user)
+        return str(user["_id"])
+
+    async def add_analysis(self, user_id, image: bytes):
+        ref = self.blobs.put_bytes(image, "png")
+        doc = {"_id": ObjectId(), "user_id": user_id, "type": "xray", "date": datetime.utcnow(),
+               "image_url": self.blobs.url(ref.key), "image_key": ref.key,
+               "predictions": [{"condition": "Effusion", "probability": 0.4}], "recommendations": []}
+        await self.store.analyses.insert(doc)
+        return doc
+
+    async def analysis_ids(self):
+        return {str(doc["_id"]) for doc in await self.store.analyses.changes_since(0, 1000)}
+
+
+@pytest.fixture
+def nodes(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync, "SYNC_TOKEN", TOKEN)
+    monkeypatch.setattr(server, "SYNC_TOKEN", TOKEN)
+    opened = []
+
+    async def open_node(name):
+        node = await Node(tmp_path, name).open()
+        opened.append(node)
+        return node
+
+    yield open_node
+    for node in opened:
+        node.store.close()
+
+
+def serve(monkeypatch, node):
+    """Make the API the upstream deployment backed by node."""
+    monkeypatch.setattr(server, "store", node.store)
+    monkeypatch.setattr(server, "blob_store", node.blobs)
+
+
+async def pusher_for(node, settle=0.0):
+    pusher = SyncPusher(node.blobs, upstream_url=UPSTREAM_URL, node_id=node.name, token=TOKEN, settle=settle,
+                        transport=httpx.ASGITransport(app=server.app))
+    pusher.start(node.store)
+    # Rounds are run explicitly below rather than on the interval
+    await pusher.stop()
+    return pusher
+
+
+def sync_client(node_id):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url=UPSTREAM_URL,
+                             headers={SYNC_TOKEN_HEADER: TOKEN, SYNC_NODE_HEADER: node_id})
+
+
+@pytest.mark.anyio
+async def test_nodes_push_to_each_other(nodes, monkeypatch):
+    a, b = await nodes("booth-a"), await nodes("booth-b")
+    alice = await a.add_user("alice@example.com")
+    from_a = await a.add_analysis(alice, b"image from a" * 100)
+    bob = await b.add_user("bob@example.com")
+    from_b = await b.add_analysis(bob, b"image from b" * 100)
+
+    serve(monkeypatch, b)
+    sent = await (await pusher_for(a)).run_once()
+    assert sent == {"batches": 1, "analyses": 1, "blobs": 1, "last_seq": from_a["sync_seq"]}
+    assert await b.store.users.get_by_id(alice) is not None
+    replicated = await b.store.analyses.get(str(from_a["_id"]))
+    assert replicated["predictions"] == from_a["predictions"]
+    assert b.blobs.path(from_a["image_key"]).read_bytes() == b"image from a" * 100
+
+    serve(monkeypatch, a)
+    sent = await (await pusher_for(b)).run_once()
+    # B's own analysis, and the one it took from A, restamped with B's sequence
+    assert sent["analyses"] == 2 and sent["blobs"] == 1
+    assert await a.analysis_ids() == await b.analysis_ids() == {str(from_a["_id"]), str(from_b["_id"])}
+    assert await a.store.users.get_by_id(bob) is not None
+    assert a.blobs.path(from_b["image_key"]).read_bytes() == b"image from b" * 100
+
+
+@pytest.mark.anyio
+async def test_repushed_batch_changes_nothing(nodes, monkeypatch):
+    a, b = await nodes("booth-a"), await nodes("booth-b")
+    alice = await a.add_user("alice@example.com")
+    docs = [await a.add_analysis(alice, bytes([i]) * 100) for i in range(3)]
+    serve(monkeypatch, b)
+    pusher = await pusher_for(a)
+    first = await pusher.run_once()
+
+    # The same batch again, as after a response lost on the way back
+    user = await a.store.users.get_by_id(alice)
+    user["_id"] = ObjectId(user.pop("id"))
+    async with sync_client(a.name) as client:
+        response = await client.post("/api/sync/batches", content=encode_batch([user], docs), headers={
+            "Content-Type": NDJSON_MEDIA_TYPE, "Content-Encoding": "gzip",
+        })
+    assert response.status_code == 200
+    assert response.json()["users_created"] == 0
+    assert response.json()["last_seq"] == first["last_seq"]
+    assert await b.analysis_ids() == {str(doc["_id"]) for doc in docs}
+
+    assert await pusher.run_once() == {"batches": 0, "analyses": 0, "blobs": 0, "last_seq": first["last_seq"]}
+
+
+@pytest.mark.anyio
+async def test_changes_wait_for_the_settle_window(nodes, monkeypatch):
+    a, b = await nodes("booth-a"), await nodes("booth-b")
+    doc = await a.add_analysis(await a.add_user("alice@example.com"), b"image" * 100)
+    serve(monkeypatch, b)
+    pusher = await pusher_for(a, settle=3600)
+
+    assert await pusher.run_once() == {"batches": 0, "analyses": 0, "blobs": 0, "last_seq": 0}
+    assert await b.analysis_ids() == set()
+    assert not b.blobs.exists(doc["image_key"])
+
+    pusher.settle = 0
+    assert (await pusher.run_once())["analyses"] == 1
+    assert await b.analysis_ids() == {str(doc["_id"])}
+
+
+@pytest.mark.anyio
+async def test_blob_content_must_match_its_key(nodes, monkeypatch):
+    a, b = await nodes("booth-a"), await nodes("booth-b")
+    key = a.blobs.put_bytes(b"genuine image" * 100, "png").key
+    serve(monkeypatch, b)
+
+    async with sync_client(a.name) as client:
+        response = await client.post("/api/sync/blobs/missing", json={"keys": [key]})
+        assert response.json() == {"missing": [key]}
+
+        response = await client.put(f"/api/sync/blobs/{key}", content=b"tampered image" * 100)
+        assert response.status_code == 400
+        assert not b.blobs.exists(key)
+        assert list(b.blobs.root.glob("*/*/*")) == []
+
+        response = await client.put(f"/api/sync/blobs/{key}", content=b"genuine image" * 100)
+        assert response.json() == {"key": key, "created": True}
+        response = await client.post("/api/sync/blobs/missing", json={"keys": [key]})
+        assert response.json() == {"missing": []}
+
+        response = await client.put("/api/sync/blobs/ab/cd/not-a-digest.png", content=b"x")
+        assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_watermark_survives_restart(nodes, monkeypatch):
+    a, b = await nodes("booth-a"), await nodes("booth-b")
+    alice = await a.add_user("alice@example.com")
+    for i in range(3):
+        await a.add_analysis(alice, bytes([i]) * 100)
+    serve(monkeypatch, b)
+    first = await (await pusher_for(a)).run_once()
+
+    await b.restart()
+    serve(monkeypatch, b)
+    assert await b.store.sync.last_seq(a.name) == first["last_seq"]
+
+    later = await a.add_analysis(alice, b"later" * 100)
+    # A fresh pusher, as after restarting the node too, resumes from upstream's watermark
+    sent = await (await pusher_for(a)).run_once()
+    assert sent == {"batches": 1, "analyses": 1, "blobs": 1, "last_seq": later["sync_seq"]}
+    assert len(await b.analysis_ids()) == 4
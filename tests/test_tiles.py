@@ -0,0 +1,82 @@
+import io
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+from blob_store import LocalBlobStore
+from tiles import TileStore
+
+
+@pytest.fixture
+def stores(tmp_path):
+    blobs = LocalBlobStore(tmp_path / "uploads")
+    tiles = TileStore(blobs, tmp_path / "uploads" / ".tiles")
+    yield blobs, tiles
+    tiles.shutdown()
+
+
+def store_image(blobs, img, format="PNG", **params):
+    buffer = io.BytesIO()
+    img.save(buffer, format, **params)
+    return blobs.put_bytes(buffer.getvalue(), format.lower()).key
+
+
+def build_peak(tiles, key):
+    """Pyramid info and the peak of Python-tracked allocations while building it."""
+    tracemalloc.start()
+    try:
+        info = tiles._build(key)
+        return info, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_large_image_is_built_in_strips(stores):
+    blobs, tiles = stores
+    width, height = 6000, 4000
+    gradient = np.tile(np.arange(width, dtype=np.uint32) * 255 // (width - 1), (height, 1)).astype(np.uint8)
+    key = store_image(blobs, Image.fromarray(gradient).convert("RGB"), "JPEG", quality=90)
+
+    info, peak = build_peak(tiles, key)
+    assert (info.width, info.height, info.channels) == (width, height, 3)
+    assert info.max_level == 13
+    # Decoding into one array took several full-resolution copies; strips need a fraction of one
+    assert peak < width * height * 3
+
+    base = tiles._raster(tiles.pyramid_dir(key), info, info.max_level)
+    assert abs(int(base[100, 0, 0]) - 0) <= 3 and abs(int(base[100, -1, 0]) - 255) <= 3
+    top = tiles._raster(tiles.pyramid_dir(key), info, 0)
+    assert top.shape == (1, 1, 3)
+
+
+def test_high_bit_depth_image_is_windowed_without_a_float_copy(stores):
+    blobs, tiles = stores
+    width, height = 3000, 2000
+    values = np.tile(np.linspace(1000, 41000, width).astype(np.uint16), (height, 1))
+    key = store_image(blobs, Image.fromarray(values))
+
+    info, peak = build_peak(tiles, key)
+    assert info.channels == 1
+    # Windowing the whole image as float32 would take width * height * 4 bytes
+    assert peak < width * height * 2
+    base = tiles._raster(tiles.pyramid_dir(key), info, info.max_level)
+    assert base[0, 0, 0] == 0 and base[-1, -1, 0] == 255
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_exif_orientation_matches_exif_transpose(stores, orientation):
+    blobs, tiles = stores
+    pixels = np.random.default_rng(orientation).integers(0, 256, (600, 900, 3), dtype=np.uint8)
+    img = Image.fromarray(pixels)
+    exif = img.getexif()
+    exif[0x0112] = orientation
+    key = store_image(blobs, img, exif=exif.tobytes())
+
+    info = tiles._build(key)
+    with Image.open(blobs.local_path(key)) as stored:
+        expected = np.asarray(ImageOps.exif_transpose(stored))
+    base = tiles._raster(tiles.pyramid_dir(key), info, info.max_level)
+    assert (info.height, info.width) == expected.shape[:2]
+    assert np.array_equal(base, expected)
@@ -0,0 +1,91 @@
+import asyncio
+import fcntl
+
+import pytest
+from bson import json_util
+from bson.objectid import ObjectId
+
+from write_behind import WriteBehindQueue, worker_journal_path
+
+
+class Recorder:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.docs = []
+
+    async def __call__(self, docs):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        self.docs.extend(docs)
+
+
+def make_docs(n, tag):
+    return [{"_id": ObjectId(), "tag": tag, "n": i} for i in range(n)]
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def abandon(writer):
+    """What a crash leaves behind: no final flush, and the journal lock released."""
+    writer._task.cancel()
+    await asyncio.gather(writer._task, return_exceptions=True)
+    writer._journal_file.close()
+
+
+@pytest.mark.anyio
+async def test_journaled_documents_are_replayed_after_a_crash(tmp_path):
+    base = tmp_path / "journal.ndjson"
+    crashed = WriteBehindQueue(Recorder(fail=True), base, max_wait_ms=0)
+    await crashed.start()
+    docs = make_docs(3, "crashed")
+    await crashed.enqueue_many(docs)
+    await abandon(crashed)
+
+    recorder = Recorder()
+    restarted = WriteBehindQueue(recorder, base, max_wait_ms=0)
+    await restarted.start()
+    assert restarted.replayed == 3
+    await wait_for(lambda: len(recorder.docs) == 3)
+    assert {doc["_id"] for doc in recorder.docs} == {doc["_id"] for doc in docs}
+    await restarted.stop()
+    assert not restarted.journal_path.exists()
+
+
+@pytest.mark.anyio
+async def test_journals_of_exited_workers_are_taken_over(tmp_path):
+    base = tmp_path / "journal.ndjson"
+    orphan = worker_journal_path(base, 999999)
+    docs = make_docs(2, "orphan")
+    orphan.write_text("".join(json_util.dumps(doc) + "\n" for doc in docs))
+
+    recorder = Recorder()
+    writer = WriteBehindQueue(recorder, base, max_wait_ms=0)
+    await writer.start()
+    assert not orphan.exists()
+    await wait_for(lambda: len(recorder.docs) == 2)
+    await writer.stop()
+
+
+@pytest.mark.anyio
+async def test_a_live_workers_journal_is_left_alone(tmp_path):
+    base = tmp_path / "journal.ndjson"
+    live = worker_journal_path(base, 999998)
+    live.write_text(json_util.dumps(make_docs(1, "live")[0]) + "\n")
+    with open(live, "a") as held:
+        fcntl.flock(held.fileno(), fcntl.LOCK_EX)
+
+        recorder = Recorder()
+        writer = WriteBehindQueue(recorder, base, max_wait_ms=0)
+        await writer.start()
+        await writer.enqueue_many(make_docs(2, "own"))
+        await wait_for(lambda: len(recorder.docs) == 2)
+        await writer.stop()
+
+    assert writer.replayed == 0
+    assert [doc["tag"] for doc in recorder.docs] == ["own", "own"]
+    assert len(live.read_text().splitlines()) == 1
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+xrv = pytest.importorskip("torchxrayvision")
+
+from xray_pipeline import postprocess_batch  # noqa: E402
+
+
+def test_labels_follow_the_weights_output_order():
+    labels = xrv.models.model_urls["densenet121-res224-chex"]["labels"]
+    logits = np.full((1, len(labels)), -5.0, dtype=np.float32)
+    logits[0, labels.index("Edema")] = 3.0
+    assert postprocess_batch(logits, labels, k=1)[0][0]["label"] == "Edema"
+
+
+def test_untrained_outputs_are_never_reported():
+    labels = xrv.models.model_urls["densenet121-res224-rsna"]["labels"]
+    # The untrained outputs score highest, but have no label to report
+    logits = np.where(np.array([bool(label) for label in labels]), 0.0, 9.0).astype(np.float32)[np.newaxis]
+    predictions = postprocess_batch(logits, labels, k=3)[0]
+    assert [p["label"] for p in predictions] == [label for label in labels if label]